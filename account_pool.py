@@ -0,0 +1,133 @@
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import mail_api
+
+try:
+    from config import ACCOUNT_POOL_SIZE
+except ImportError:
+    ACCOUNT_POOL_SIZE = 0
+
+try:
+    from config import ACCOUNT_POOL_LOW_WATERMARK, ACCOUNT_POOL_CONCURRENCY
+except ImportError:
+    ACCOUNT_POOL_LOW_WATERMARK = None
+    ACCOUNT_POOL_CONCURRENCY = 4
+
+class AccountReservoir:
+    """Réserve de comptes Mail.tm créés, authentifiés et enregistrés à l'avance
+
+    Les comptes en réserve sont persistés avec le drapeau `pooled` (invisibles
+    dans get_all_accounts) et survivent donc à un redémarrage. take() sert un
+    compte en O(1) depuis une file en mémoire ; le remplissage se fait en
+    tâche de fond dès que la réserve passe sous `low_watermark`.
+    """
+
+    def __init__(self, storage, target_size=10, low_watermark=None,
+                 concurrency=ACCOUNT_POOL_CONCURRENCY, retry_seconds=30, provider="mailtm"):
+        self.storage = storage
+        # Fournisseur des comptes mis en réserve (jamais choisi par le Dispatcher)
+        self.provider = provider
+        self.target_size = target_size
+        self.low_watermark = low_watermark if low_watermark is not None else max(1, target_size // 2)
+        self.concurrency = concurrency
+        self.retry_seconds = retry_seconds
+        self.stats = {"hits": 0, "misses": 0, "created": 0, "failed": 0}
+        self._ready = deque()
+        self._refill_event = threading.Event()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def size(self):
+        """Nombre de comptes prêts"""
+        return len(self._ready)
+
+    def take(self):
+        """Attribue un compte prêt, ou None si la réserve est vide"""
+        while True:
+            try:
+                account = self._ready.popleft()
+            except IndexError:
+                self.stats["misses"] += 1
+                self._refill_event.set()
+                return None
+            # Un autre processus partageant la base a pu l'attribuer entre-temps
+            if self.storage.claim_pooled_account(account['db_id']):
+                self.stats["hits"] += 1
+                if len(self._ready) < self.low_watermark:
+                    self._refill_event.set()
+                return account
+
+    def _load_existing(self):
+        """Reprend les comptes restés en réserve lors d'une exécution précédente"""
+        known = {account['db_id'] for account in self._ready}
+        for account in self.storage.get_pooled_accounts(limit=self.target_size):
+            if account['id'] not in known and account['provider'] == self.provider:
+                self._ready.append({"address": account['email'], "db_id": account['id'], "pooled": True,
+                                    "provider": account['provider']})
+
+    def _create(self, _):
+        try:
+            return mail_api.create_fresh_account(pooled=True, provider=self.provider)
+        except Exception:
+            return None
+
+    def refill(self):
+        """Complète la réserve jusqu'à `target_size` ; retourne le nombre de comptes créés"""
+        created = 0
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            while not self._stop_event.is_set():
+                missing = self.target_size - len(self._ready)
+                if missing <= 0:
+                    break
+                accounts = list(executor.map(self._create, range(missing)))
+                for account in accounts:
+                    if account:
+                        account['pooled'] = True
+                        self._ready.append(account)
+                        created += 1
+                failures = accounts.count(None)
+                self.stats["created"] += missing - failures
+                self.stats["failed"] += failures
+                if failures == missing:
+                    break  # API indisponible : nouvel essai après retry_seconds
+        return created
+
+    def _run(self):
+        """Boucle du thread de remplissage"""
+        try:
+            self._load_existing()
+        except Exception:
+            pass
+        while not self._stop_event.is_set():
+            self._refill_event.clear()
+            try:
+                self.refill()
+            except Exception:
+                pass  # Nouvelle tentative au prochain réveil
+            self._refill_event.wait(self.retry_seconds)
+
+    def start(self):
+        """Démarre le remplissage en arrière-plan"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="account-pool", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Arrête le remplissage ; les comptes restants restent en réserve pour la prochaine exécution"""
+        self._stop_event.set()
+        self._refill_event.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+
+def start_from_config(storage):
+    """Démarre la réserve et la branche sur mail_api si ACCOUNT_POOL_SIZE > 0"""
+    if not storage or not ACCOUNT_POOL_SIZE:
+        return None
+    reservoir = AccountReservoir(storage, ACCOUNT_POOL_SIZE, ACCOUNT_POOL_LOW_WATERMARK)
+    reservoir.start()
+    mail_api.set_reservoir(reservoir)
+    return reservoir
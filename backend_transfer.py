@@ -0,0 +1,138 @@
+import json
+import os
+import time
+
+from content_store import CHUNK_SIZE
+from locking import atomic_write_json
+
+EMAIL_FIELDS = ("message_id", "sender", "recipient", "subject", "body", "received_at")
+ATTACHMENT_FIELDS = ("kind", "filename", "content_type", "size", "content_hash")
+
+class TransferCheckpoint:
+    """Point de reprise d'un transfert : correspondance des IDs et dernier email copié"""
+
+    def __init__(self, path=None):
+        self.path = path
+        self.account_map = {}
+        self.accounts_done = False
+        self.last_email_id = 0
+        self.emails_copied = 0
+        self.emails_skipped = 0
+        if path and os.path.exists(path):
+            with open(path, 'r') as f:
+                state = json.load(f)
+            # Les clés JSON sont des chaînes : on restaure les IDs entiers
+            self.account_map = {int(k): v for k, v in state.get("account_map", {}).items()}
+            self.accounts_done = state.get("accounts_done", False)
+            self.last_email_id = state.get("last_email_id", 0)
+            self.emails_copied = state.get("emails_copied", 0)
+            self.emails_skipped = state.get("emails_skipped", 0)
+
+    def save(self):
+        if not self.path:
+            return
+        atomic_write_json(self.path, {
+            "account_map": self.account_map,
+            "accounts_done": self.accounts_done,
+            "last_email_id": self.last_email_id,
+            "emails_copied": self.emails_copied,
+            "emails_skipped": self.emails_skipped
+        }, indent=None)
+
+def transfer(source, target, batch_size=1000, checkpoint_path=None, progress=None):
+    """Copie en masse comptes et emails d'un MariaDBStorage vers un autre
+
+    Les pièces jointes et sources .eml suivent leur email ; leurs contenus
+    sont recopiés quand les deux stockages n'ont pas le même content_store.
+    Les IDs de comptes sont réattribués par le stockage cible (correspondance
+    par adresse email) et les emails déjà présents côté cible sont écartés par
+    la déduplication (account_id, message_id). Le point de reprise est écrit
+    après chaque lot : relancer avec le même fichier reprend là où le transfert
+    s'était arrêté. `progress(stats)` est appelé après chaque lot.
+    """
+    checkpoint = TransferCheckpoint(checkpoint_path)
+    started = time.perf_counter()
+    stats = {"accounts": 0, "emails": 0, "skipped": 0, "rows_per_second": 0.0}
+
+    def report(phase):
+        elapsed = time.perf_counter() - started
+        rows = stats["accounts"] + stats["emails"] + stats["skipped"]
+        stats["rows_per_second"] = round(rows / elapsed, 1) if elapsed else 0.0
+        stats["seconds"] = round(elapsed, 3)
+        stats["phase"] = phase
+        if progress:
+            progress(dict(stats))
+
+    if not checkpoint.accounts_done:
+        batch = []
+        for account in source.iter_accounts(chunk_size=batch_size):
+            batch.append(account)
+            if len(batch) >= batch_size:
+                _copy_accounts(target, batch, checkpoint, stats)
+                report("accounts")
+                batch = []
+        _copy_accounts(target, batch, checkpoint, stats)
+        checkpoint.accounts_done = True
+        checkpoint.save()
+        report("accounts")
+
+    batch = []
+    # Parcours par ID croissant : la reprise repart juste après le dernier email copié
+    for email in source.iter_received_emails(chunk_size=batch_size, after_id=checkpoint.last_email_id):
+        batch.append(email)
+        if len(batch) >= batch_size:
+            _copy_emails(source, target, batch, checkpoint, stats)
+            report("emails")
+            batch = []
+    _copy_emails(source, target, batch, checkpoint, stats)
+    report("done")
+
+    stats["total_emails_copied"] = checkpoint.emails_copied
+    stats["total_emails_skipped"] = checkpoint.emails_skipped
+    return stats
+
+def _copy_accounts(target, accounts, checkpoint, stats):
+    """Écrit un lot de comptes et enregistre la correspondance des IDs"""
+    if not accounts:
+        return
+    ids = target.save_accounts_batch(accounts)
+    for account in accounts:
+        checkpoint.account_map[account["id"]] = ids[account["email"]]
+    stats["accounts"] += len(accounts)
+    checkpoint.save()
+
+def _copy_attachments(source, target, email):
+    """Métadonnées des pièces jointes d'un email source, contenus présents dans le content_store cible"""
+    attachments = []
+    for attachment in source.get_email_attachments(email["id"], email["account_id"]):
+        content_hash = attachment["content_hash"]
+        if not target.content_store.exists(content_hash):
+            if not source.content_store.exists(content_hash):
+                continue  # Contenu déjà effacé côté source : la référence ne serait plus lisible
+            with source.content_store.open(content_hash) as f:
+                target.content_store.put_stream(iter(lambda: f.read(CHUNK_SIZE), b""))
+        attachments.append({field: attachment.get(field) for field in ATTACHMENT_FIELDS})
+    return attachments
+
+def _copy_emails(source, target, emails, checkpoint, stats):
+    """Écrit un lot d'emails, avec leurs pièces jointes, sous les IDs de comptes de la cible"""
+    if not emails:
+        return
+    rows = []
+    for email in emails:
+        account_id = checkpoint.account_map.get(email["account_id"])
+        if account_id is None:
+            continue  # Compte source introuvable : email compté comme ignoré
+        row = {field: email.get(field) for field in EMAIL_FIELDS}
+        row["account_id"] = account_id
+        row["attachments"] = _copy_attachments(source, target, email)
+        rows.append(row)
+    saved_ids = target.save_received_emails_batch(rows) if rows else []
+    copied = sum(1 for saved_id in saved_ids if saved_id)
+    skipped = len(emails) - copied
+    stats["emails"] += copied
+    stats["skipped"] += skipped
+    checkpoint.emails_copied += copied
+    checkpoint.emails_skipped += skipped
+    checkpoint.last_email_id = emails[-1]["id"]
+    checkpoint.save()
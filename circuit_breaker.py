@@ -0,0 +1,208 @@
+import json
+import os
+import threading
+
+from locking import InterProcessLock
+
+CLOSED = "fermé"
+OPEN = "ouvert"
+RECOVERING = "reprise"
+
+class CircuitBreaker:
+    """Disjoncteur de la base MySQL, surveillé par un thread de santé
+
+    Après `failure_threshold` échecs de connexion consécutifs (ou une sonde de
+    santé ratée), le circuit s'ouvre : allow() répond False immédiatement, sans
+    attendre de délai de connexion. Le thread sonde alors la base toutes les
+    `retry_interval` secondes ; dès qu'elle répond, `on_recover()` est appelé
+    (rejeu des écritures en attente, depuis ce même thread, seul autorisé à
+    utiliser la base pendant la reprise) puis le circuit se referme. Circuit
+    fermé, une sonde toutes les `health_interval` secondes détecte la panne
+    avant le prochain appel (0 : pas de sonde).
+    """
+
+    def __init__(self, probe, on_recover=None, on_state_change=None, failure_threshold=2,
+                 retry_interval=2.0, health_interval=10.0, recovery_lock=None):
+        self.probe = probe
+        self.on_recover = on_recover
+        # Tenu pendant le rejeu et jusqu'à la fermeture : aucun ajout ne peut s'intercaler
+        self.recovery_lock = recovery_lock or threading.RLock()
+        self.on_state_change = on_state_change
+        self.failure_threshold = failure_threshold
+        self.retry_interval = retry_interval
+        self.health_interval = health_interval
+        self.state = CLOSED
+        self.stats = {"opened": 0, "recovered": 0, "rejected": 0, "probes": 0}
+        self._failures = 0
+        self._lock = threading.Lock()
+        self._wake_event = threading.Event()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def allow(self):
+        """Indique si l'appelant peut utiliser la base maintenant"""
+        if self.state == CLOSED:
+            return True
+        if self.state == RECOVERING and threading.current_thread() is self._thread:
+            return True
+        self.stats["rejected"] += 1
+        return False
+
+    def record_success(self):
+        if self._failures:
+            with self._lock:
+                self._failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            should_open = self.state == CLOSED and self._failures >= self.failure_threshold
+        if should_open:
+            self._set_state(OPEN)
+
+    def confirm_failure(self):
+        """Sonde immédiate après une erreur d'écriture : ouvre le circuit si la base ne répond plus"""
+        if self.state == CLOSED and not self._probe():
+            self._set_state(OPEN)
+        return self.state
+
+    def _set_state(self, state):
+        with self._lock:
+            if self.state == state:
+                return
+            self.state = state
+            if state == OPEN:
+                self.stats["opened"] += 1
+            elif state == CLOSED:
+                self._failures = 0
+        if state == OPEN:
+            self._wake_event.set()
+        if self.on_state_change:
+            try:
+                self.on_state_change(state)
+            except Exception:
+                pass
+
+    def _probe(self):
+        self.stats["probes"] += 1
+        try:
+            return bool(self.probe())
+        except Exception:
+            return False
+
+    def check_once(self):
+        """Une sonde : referme le circuit (après rejeu) ou l'ouvre selon la réponse"""
+        if self.state == CLOSED:
+            if not self._probe():
+                self._set_state(OPEN)
+            return self.state
+        if not self._probe():
+            return self.state
+        with self.recovery_lock:
+            self._set_state(RECOVERING)
+            try:
+                if self.on_recover:
+                    self.on_recover()
+            except Exception:
+                # Rejeu interrompu (nouvelle panne) : le reste attend la prochaine reprise
+                self._set_state(OPEN)
+                return self.state
+            self.stats["recovered"] += 1
+            self._set_state(CLOSED)
+        return self.state
+
+    def _run(self):
+        """Boucle du thread de santé"""
+        while not self._stop_event.is_set():
+            interval = self.health_interval if self.state == CLOSED else self.retry_interval
+            if interval:
+                self._wake_event.wait(interval)
+            else:
+                self._wake_event.wait()
+            self._wake_event.clear()
+            if self._stop_event.is_set():
+                break
+            if self.state == CLOSED and not self.health_interval:
+                continue
+            self.check_once()
+
+    def start(self):
+        """Démarre la surveillance en arrière-plan"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="mysql-health", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        self._wake_event.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+
+class OfflineJournal:
+    """File durable des écritures différées pendant une panne (une ligne JSON par écriture)
+
+    Chaque ajout est écrit et synchronisé sur disque avant de rendre la main :
+    une écriture acceptée survit à un arrêt brutal. Le fichier est partagé
+    entre processus sous verrou ; n'importe quel processus peut le rejouer.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = InterProcessLock(path + ".lock")
+
+    def append(self, op, payloads):
+        """Ajoute les écritures `payloads` (une entrée chacune) en une seule synchronisation disque"""
+        lines = "".join(json.dumps({"op": op, "data": payload}, default=str, ensure_ascii=False) + "\n"
+                        for payload in payloads)
+        with self.lock:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(lines)
+                f.flush()
+                os.fsync(f.fileno())
+
+    def read(self):
+        """Entrées en attente, dans l'ordre d'ajout (ligne tronquée finale ignorée)"""
+        entries = []
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entries.append(json.loads(line))
+                    except ValueError:
+                        continue
+        except FileNotFoundError:
+            pass
+        return entries
+
+    def pending(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                return sum(1 for _ in f)
+        except FileNotFoundError:
+            return 0
+
+    def truncate(self, remaining):
+        """Remplace le journal par les entrées restant à rejouer"""
+        if not remaining:
+            if os.path.exists(self.path):
+                os.remove(self.path)
+            return
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for entry in remaining:
+                f.write(json.dumps(entry, default=str, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+def replay_groups(entries):
+    """Regroupe les entrées consécutives de même opération : [(op, [données])]"""
+    groups = []
+    for entry in entries:
+        if groups and groups[-1][0] == entry["op"]:
+            groups[-1][1].append(entry["data"])
+        else:
+            groups.append((entry["op"], [entry["data"]]))
+    return groups
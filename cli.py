@@ -0,0 +1,389 @@
+import sys
+import os
+import json
+import time
+import signal
+import argparse
+import threading
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+if current_dir not in sys.path:
+    sys.path.insert(0, current_dir)
+
+import storage as storage_module
+import mail_api
+import exporters
+import profiling
+import providers
+
+# Codes de sortie (2 est réservé par argparse aux erreurs d'usage)
+EXIT_OK = 0
+EXIT_PARTIAL = 1
+EXIT_STORAGE_UNAVAILABLE = 3
+EXIT_FAILURE = 4
+
+# Levé par SIGINT/SIGTERM ; les pauses des boucles l'attendent pour s'interrompre aussitôt
+_stop_event = threading.Event()
+
+def _request_stop(signum, frame):
+    _stop_event.set()
+
+def emit(record):
+    """Écrit un enregistrement JSON par ligne sur la sortie standard"""
+    sys.stdout.write(json.dumps(record, default=str, ensure_ascii=False) + "\n")
+    sys.stdout.flush()
+
+def log(message):
+    """Messages humains sur la sortie d'erreur, pour ne pas polluer le flux JSON"""
+    sys.stderr.write(message + "\n")
+    sys.stderr.flush()
+
+def open_storage(args):
+    """Ouvre le stockage selon les options globales"""
+    storage = storage_module.MariaDBStorage(
+        force_mysql=args.require_mysql,
+        write_behind=getattr(args, 'write_behind', False),
+        backend=args.backend
+    )
+    if args.require_mysql and not storage.is_mysql_connected():
+        log(storage.get_status_message())
+        return None
+    mail_api.set_storage(storage)
+    return storage
+
+def resolve_account_ids(storage, emails):
+    """Convertit une liste d'adresses en IDs (tous les comptes si vide)"""
+    if not emails:
+        # Fournisseurs alternés : les threads de synchronisation répartissent la charge
+        return [account['id'] for account in mail_api.dispatcher.interleave(storage.get_all_accounts())]
+    account_ids = []
+    for email in emails:
+        account = storage.get_account_by_email(email)
+        if not account:
+            raise ValueError(f"Compte {email} non trouvé")
+        account_ids.append(account['id'])
+    return account_ids
+
+def cmd_status(storage, args):
+    emit({
+        "type": "status",
+        "backend": storage.backend.name,
+        "message": storage.get_status_message(),
+        "schema_version": storage.get_schema_version(),
+        "providers": mail_api.dispatcher.get_stats(),
+        "circuit": storage.get_offline_status(),
+        "replicas": storage.get_replica_status()
+    })
+    return EXIT_OK
+
+def cmd_create(storage, args):
+    created = 0
+    with profiling.cycle("create"), ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        for account in executor.map(lambda _: mail_api.create_account(args.provider), range(args.count)):
+            if account:
+                created += 1
+                emit({"type": "account", "id": account.get('db_id'), "email": account.get('address'),
+                      "provider": account.get('provider')})
+            else:
+                emit({"type": "error", "operation": "create"})
+    emit({"type": "summary", "operation": "create", "requested": args.count, "created": created,
+          "providers": mail_api.dispatcher.get_stats()})
+    if created == args.count:
+        return EXIT_OK
+    return EXIT_PARTIAL if created else EXIT_FAILURE
+
+def _sync_once(storage, args, account_ids, coordinator=None):
+    """Un cycle de synchronisation ; retourne (nouveaux messages, comptes, secondes)"""
+    started = time.perf_counter()
+    if coordinator:
+        total_new = coordinator.sync_all(account_ids=account_ids)
+        emit({"type": "shards", "stats": coordinator.get_stats()})
+    else:
+        total_new = 0
+        with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+            results = executor.map(mail_api.fetch_and_store_messages, account_ids)
+            for account_id, new_count in zip(account_ids, results):
+                total_new += new_count
+                if new_count:
+                    emit({"type": "sync", "account_id": account_id, "new": new_count})
+    storage.flush()
+    return total_new, len(account_ids), time.perf_counter() - started
+
+def start_token_refresher(storage):
+    """Mode démon : tokens renouvelés en arrière-plan avant leur échéance"""
+    import token_refresher
+    return token_refresher.start_from_config(storage)
+
+def cmd_sync(storage, args):
+    account_ids = resolve_account_ids(storage, args.account)
+    coordinator = None
+    refresher = start_token_refresher(storage) if args.loop else None
+    if args.processes:
+        if storage.backend.name == "memory":
+            raise ValueError("Le stockage en mémoire n'est pas partagé entre processus (--processes)")
+        import sync_workers
+        coordinator = sync_workers.ShardedSyncCoordinator(storage, args.processes)
+    try:
+        while True:
+            with profiling.cycle("sync"):
+                total_new, accounts, elapsed = _sync_once(storage, args, account_ids, coordinator)
+            emit({
+                "type": "summary",
+                "operation": "sync",
+                "accounts": accounts,
+                "new": total_new,
+                "seconds": round(elapsed, 3),
+                "accounts_per_second": round(accounts / elapsed, 2) if elapsed else None
+            })
+            if not args.loop or _stop_event.wait(args.interval):
+                break
+            if not args.account:
+                account_ids = resolve_account_ids(storage, None)
+    finally:
+        if coordinator:
+            coordinator.stop()
+        if refresher:
+            refresher.stop()
+    return EXIT_OK
+
+def cmd_tail(storage, args):
+    account_ids = resolve_account_ids(storage, args.account)
+    filter_ids = set(account_ids) if args.account else None
+    last_id = 0 if args.from_start else storage.get_last_email_id()
+    refresher = None if args.once else start_token_refresher(storage)
+    try:
+        while not _stop_event.is_set():
+            for account_id in account_ids:
+                mail_api.fetch_and_store_messages(account_id)
+            storage.flush()
+            while True:
+                emails = storage.get_received_emails_after(last_id, limit=500)
+                for email in emails:
+                    last_id = email['id']
+                    if filter_ids is None or email['account_id'] in filter_ids:
+                        emit(dict(email, type="email"))
+                if len(emails) < 500:
+                    break
+            if args.once or _stop_event.wait(args.interval):
+                break
+            if not args.account:
+                account_ids = resolve_account_ids(storage, None)
+    finally:
+        if refresher:
+            refresher.stop()
+    return EXIT_OK
+
+def cmd_export(storage, args):
+    account_ids = resolve_account_ids(storage, args.account) if args.account else [None]
+    exporter = exporters.EXPORTERS[args.format]
+    output = open(args.output, 'w', encoding='utf-8', newline='\n') if args.output else sys.stdout
+    count = 0
+    started = time.perf_counter()
+    try:
+        for account_id in account_ids:
+            count += exporter(storage.iter_received_emails(account_id=account_id), output)
+    finally:
+        if args.output:
+            output.close()
+    if args.output:
+        emit({
+            "type": "summary",
+            "operation": "export",
+            "format": args.format,
+            "emails": count,
+            "seconds": round(time.perf_counter() - started, 3),
+            "output": args.output
+        })
+    return EXIT_OK
+
+def cmd_wait(storage, args):
+    account_ids = resolve_account_ids(storage, [args.account])
+    sender = (args.sender or "").lower()
+    subject = (args.subject or "").lower()
+
+    def matches(email):
+        return (sender in (email.get('sender') or "").lower()
+                and subject in (email.get('subject') or "").lower())
+
+    email = mail_api.wait_for_message(account_ids[0], matches, timeout=args.timeout)
+    storage.flush()
+    if not email:
+        emit({"type": "timeout", "account": args.account, "timeout": args.timeout})
+        return EXIT_PARTIAL
+    emit(dict(email, type="email"))
+    return EXIT_OK
+
+def cmd_code(storage, args):
+    account_ids = resolve_account_ids(storage, [args.account])
+    if args.links:
+        for link in storage.get_links(account_ids[0], domain=args.domain, sender=args.sender, limit=args.limit):
+            emit(dict(link, type="link"))
+        return EXIT_OK
+    code = storage.get_latest_code(account_ids[0], sender=args.sender)
+    if not code:
+        emit({"type": "error", "message": "aucun code"})
+        return EXIT_PARTIAL
+    emit(dict(code, type="code"))
+    return EXIT_OK
+
+def _parse_date(value):
+    return datetime.fromisoformat(value) if value else None
+
+def cmd_search(storage, args):
+    account_ids = resolve_account_ids(storage, [args.account]) if args.account else [None]
+    started = time.perf_counter()
+    page = storage.search_emails(args.query, account_id=account_ids[0], since=_parse_date(args.since),
+                                 until=_parse_date(args.until), limit=args.limit, offset=args.offset)
+    for result in page["results"]:
+        # Sans --body, l'aperçu suffit : le corps et son texte ne sont pas lus
+        email = {key: result["email"][key] for key in result["email"]
+                 if args.body or key not in ("body", "body_text")}
+        email.update(type="email", score=result["score"])
+        emit(email)
+    emit({"type": "summary", "operation": "search", "total": page["total"], "offset": args.offset,
+          "returned": len(page["results"]), "seconds": round(time.perf_counter() - started, 4)})
+    return EXIT_OK if page["total"] else EXIT_PARTIAL
+
+def cmd_transfer(storage, args):
+    import backend_transfer
+    if args.source == args.target:
+        raise ValueError("Source et cible identiques")
+    source = storage_module.MariaDBStorage(backend=args.source, local_data_file=args.local_file)
+    try:
+        target = storage_module.MariaDBStorage(backend=args.target, local_data_file=args.local_file)
+        try:
+            for side in (source, target):
+                if not side.use_local_storage and not side.is_mysql_connected():
+                    raise ValueError(side.get_status_message())
+            checkpoint = args.checkpoint or f"transfer_{args.source}_to_{args.target}.checkpoint.json"
+            stats = backend_transfer.transfer(
+                source, target,
+                batch_size=args.batch_size,
+                checkpoint_path=checkpoint,
+                progress=lambda progress: emit(dict(progress, type="progress"))
+            )
+        finally:
+            target.close()
+    finally:
+        source.close()
+    emit(dict(stats, type="summary", operation="transfer", checkpoint=checkpoint))
+    return EXIT_OK
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog="cli.py",
+        description="Générateur de mails en ligne de commande (sortie JSON, une ligne par enregistrement)"
+    )
+    parser.add_argument("--require-mysql", action="store_true",
+                        help="échoue (code 3) au lieu de basculer sur le stockage local")
+    parser.add_argument("--backend", choices=storage_module.BACKENDS,
+                        help="moteur de stockage (défaut : MySQL, repli local) ; "
+                             "memory : éphémère, perdu à la fin de la commande")
+    parser.add_argument("--profile", nargs="?", const="spans", metavar="MODES",
+                        help="profilage : spans, cprofile, tracemalloc (séparés par des virgules) ou all ; "
+                             "traces écrites dans profiles/ (GENERATEUR_PROFILE_DIR)")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    status = subparsers.add_parser("status", help="état du stockage")
+    status.set_defaults(handler=cmd_status)
+
+    create = subparsers.add_parser("create", help="crée N comptes Mail.tm")
+    create.add_argument("-n", "--count", type=int, default=1)
+    create.add_argument("-c", "--concurrency", type=int, default=4)
+    create.add_argument("--provider", choices=sorted(providers.PROVIDER_CLASSES),
+                        help="fournisseur imposé (réparti selon latence et débit par défaut)")
+    create.set_defaults(handler=cmd_create)
+
+    sync = subparsers.add_parser("sync", help="synchronise les boîtes (toutes par défaut)")
+    sync.add_argument("-a", "--account", action="append", help="adresse à synchroniser (répétable)")
+    sync.add_argument("-c", "--concurrency", type=int, default=8, help="threads de synchronisation")
+    sync.add_argument("-p", "--processes", type=int, default=0,
+                      help="nombre de processus (workers shardés) au lieu des threads")
+    sync.add_argument("--loop", action="store_true", help="mode démon : boucle jusqu'à SIGTERM/SIGINT")
+    sync.add_argument("--interval", type=float, default=30)
+    sync.add_argument("--write-behind", action="store_true", help="écritures groupées")
+    sync.set_defaults(handler=cmd_sync)
+
+    tail = subparsers.add_parser("tail", help="affiche les nouveaux emails au fil de l'eau")
+    tail.add_argument("-a", "--account", action="append")
+    tail.add_argument("--interval", type=float, default=5)
+    tail.add_argument("--from-start", action="store_true", help="inclut les emails déjà stockés")
+    tail.add_argument("--once", action="store_true", help="un seul passage")
+    tail.set_defaults(handler=cmd_tail)
+
+    export = subparsers.add_parser("export", help="exporte les emails stockés (flux, mémoire constante)")
+    export.add_argument("-a", "--account", action="append")
+    export.add_argument("-f", "--format", choices=sorted(exporters.EXPORTERS), default="jsonl")
+    export.add_argument("-o", "--output", help="fichier de sortie (stdout par défaut)")
+    export.set_defaults(handler=cmd_export)
+
+    wait = subparsers.add_parser("wait", help="attend un nouveau message (code 1 au délai dépassé)")
+    wait.add_argument("-a", "--account", required=True)
+    wait.add_argument("--sender", help="sous-chaîne de l'expéditeur")
+    wait.add_argument("--subject", help="sous-chaîne du sujet")
+    wait.add_argument("--timeout", type=float, default=60)
+    wait.set_defaults(handler=cmd_wait)
+
+    code = subparsers.add_parser("code", help="dernier code de vérification ou liens extraits d'un compte")
+    code.add_argument("-a", "--account", required=True)
+    code.add_argument("--sender", help="adresse ou domaine de l'expéditeur")
+    code.add_argument("--links", action="store_true", help="liste les liens au lieu du code")
+    code.add_argument("--domain", help="domaine des liens")
+    code.add_argument("--limit", type=int, default=20)
+    code.set_defaults(handler=cmd_code)
+
+    search = subparsers.add_parser("search", help="recherche plein texte (sujet, expéditeur, corps)")
+    search.add_argument("query")
+    search.add_argument("-a", "--account", help="limite la recherche à une adresse")
+    search.add_argument("--since", help="date ISO de début (incluse)")
+    search.add_argument("--until", help="date ISO de fin (exclue)")
+    search.add_argument("--limit", type=int, default=20)
+    search.add_argument("--offset", type=int, default=0)
+    search.add_argument("--body", action="store_true", help="inclut le corps des emails")
+    search.set_defaults(handler=cmd_search)
+
+    transfer = subparsers.add_parser("transfer", help="copie en masse entre stockage local et MySQL")
+    transfer.add_argument("--from", dest="source", choices=("local", "mysql"), default="local")
+    transfer.add_argument("--to", dest="target", choices=("local", "mysql"), default="mysql")
+    transfer.add_argument("--batch-size", type=int, default=1000)
+    transfer.add_argument("--checkpoint", help="fichier de reprise (relancer avec le même fichier pour reprendre)")
+    transfer.add_argument("--local-file", default="local_emails.json")
+    transfer.set_defaults(handler=cmd_transfer, uses_storage=False)
+
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.profile:
+        # Transmis aux processus de synchronisation par l'environnement
+        os.environ[profiling.ENV_VAR] = args.profile
+    profiling.install_from_env()
+    if getattr(args, 'loop', False) or args.command == "tail":
+        # Modes démon : fin propre du cycle en cours puis vidage des écritures
+        signal.signal(signal.SIGINT, _request_stop)
+        signal.signal(signal.SIGTERM, _request_stop)
+
+    # transfer ouvre lui-même sa source et sa cible
+    storage = None
+    if getattr(args, 'uses_storage', True):
+        storage = open_storage(args)
+        if not storage:
+            emit({"type": "error", "message": "stockage indisponible"})
+            return EXIT_STORAGE_UNAVAILABLE
+
+    try:
+        return args.handler(storage, args)
+    except ValueError as e:
+        emit({"type": "error", "message": str(e)})
+        return EXIT_FAILURE
+    except Exception as e:
+        emit({"type": "error", "message": f"{type(e).__name__}: {e}"})
+        return EXIT_FAILURE
+    finally:
+        if storage:
+            storage.close()
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,120 @@
+import hashlib
+import os
+import shutil
+import threading
+import time
+
+try:
+    from config import ATTACHMENTS_DIR
+except ImportError:
+    ATTACHMENTS_DIR = "attachments"
+
+try:
+    from config import ATTACHMENT_MAX_BYTES
+except ImportError:
+    ATTACHMENT_MAX_BYTES = 50 * 1024 * 1024
+
+CHUNK_SIZE = 64 * 1024
+
+class ContentStore:
+    """Stockage de fichiers adressés par contenu (SHA-256) sur disque
+
+    Les contenus arrivent par morceaux (put_stream) : ils sont hachés et écrits
+    au fil de l'eau dans un fichier temporaire, puis renommés sous
+    `<racine>/<2 car.>/<2 car.>/<hash>`. La mémoire utilisée ne dépend pas de
+    la taille du fichier et un contenu identique n'est stocké qu'une fois.
+    """
+
+    def __init__(self, root=ATTACHMENTS_DIR, max_bytes=ATTACHMENT_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.tmp_dir = os.path.join(root, "tmp")
+
+    def path(self, content_hash):
+        return os.path.join(self.root, content_hash[:2], content_hash[2:4], content_hash)
+
+    def exists(self, content_hash):
+        return bool(content_hash) and os.path.exists(self.path(content_hash))
+
+    def put_stream(self, chunks):
+        """Écrit un flux de morceaux (bytes) ; retourne (hash, taille) ou None si trop volumineux"""
+        os.makedirs(self.tmp_dir, exist_ok=True)
+        tmp_path = os.path.join(self.tmp_dir, f"{os.getpid()}.{threading.get_ident()}.part")
+        digest = hashlib.sha256()
+        size = 0
+        try:
+            with open(tmp_path, 'wb') as f:
+                for chunk in chunks:
+                    if not chunk:
+                        continue
+                    size += len(chunk)
+                    if self.max_bytes and size > self.max_bytes:
+                        raise OverflowError(size)
+                    digest.update(chunk)
+                    f.write(chunk)
+            content_hash = digest.hexdigest()
+            target = self.path(content_hash)
+            if os.path.exists(target):
+                os.remove(tmp_path)
+            else:
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                os.replace(tmp_path, target)
+            return content_hash, size
+        except OverflowError:
+            os.remove(tmp_path)
+            return None
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def put_bytes(self, content):
+        """Écrit un contenu déjà en mémoire, par morceaux"""
+        return self.put_stream(content[i:i + CHUNK_SIZE] for i in range(0, len(content), CHUNK_SIZE))
+
+    def open(self, content_hash):
+        """Ouvre le contenu en lecture binaire (lecture à la demande, rien n'est chargé d'avance)"""
+        return open(self.path(content_hash), 'rb')
+
+    def export(self, content_hash, filename, directory):
+        """Copie le contenu sous son nom d'origine (pour l'ouvrir avec l'application associée)"""
+        os.makedirs(directory, exist_ok=True)
+        safe_name = os.path.basename(filename or content_hash) or content_hash
+        target = os.path.join(directory, safe_name)
+        with self.open(content_hash) as source, open(target, 'wb') as destination:
+            shutil.copyfileobj(source, destination, CHUNK_SIZE)
+        return target
+
+    def iter_hashes(self):
+        """Parcourt les contenus stockés : (hash, chemin)"""
+        if not os.path.isdir(self.root):
+            return
+        for level1 in os.listdir(self.root):
+            first = os.path.join(self.root, level1)
+            if level1 == "tmp" or not os.path.isdir(first):
+                continue
+            for level2 in os.listdir(first):
+                second = os.path.join(first, level2)
+                if not os.path.isdir(second):
+                    continue
+                for name in os.listdir(second):
+                    yield name, os.path.join(second, name)
+
+    def sweep(self, referenced, min_age_seconds=3600):
+        """Supprime les contenus non référencés
+
+        Un fichier récent est épargné : il peut avoir été téléchargé juste
+        avant l'enregistrement de la ligne qui le référence.
+        """
+        cutoff = time.time() - min_age_seconds
+        removed = 0
+        for content_hash, path in list(self.iter_hashes()):
+            if content_hash in referenced:
+                continue
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+                    removed += 1
+            except OSError:
+                continue
+        return removed
@@ -0,0 +1,69 @@
+import json
+import re
+from datetime import datetime
+from email.header import Header
+from email.utils import format_datetime
+
+from extraction import is_html
+
+_FROM_LINE = re.compile(r"^(>*From )", re.MULTILINE)
+
+def export_jsonl(emails, fp):
+    """Écrit un email JSON par ligne ; mémoire constante quelle que soit la taille de l'itérable"""
+    count = 0
+    for email in emails:
+        fp.write(json.dumps(dict(email), default=str, ensure_ascii=False) + "\n")
+        count += 1
+    return count
+
+def _header(value):
+    """Encode un en-tête non ASCII (RFC 2047)"""
+    value = str(value or "")
+    try:
+        value.encode('ascii')
+        return value
+    except UnicodeEncodeError:
+        return Header(value, 'utf-8').encode()
+
+def format_mbox_message(email):
+    """Formate un email stocké en message mbox (variante mboxrd)"""
+    received_at = email.get('received_at')
+    if not isinstance(received_at, datetime):
+        try:
+            received_at = datetime.fromisoformat(str(received_at))
+        except ValueError:
+            received_at = datetime.now()
+    sender = email.get('sender') or 'inconnu'
+    body = email.get('body') or ''
+    html = email.get('is_html')
+    content_type = "text/html" if (is_html(body) if html is None else html) else "text/plain"
+
+    lines = [
+        f"From {sender.replace(' ', '_')} {received_at.strftime('%a %b %d %H:%M:%S %Y')}",
+        f"From: {_header(sender)}",
+        f"To: {_header(email.get('recipient'))}",
+        f"Subject: {_header(email.get('subject'))}",
+        f"Date: {format_datetime(received_at)}",
+        f"Message-ID: <{email.get('message_id') or email.get('id')}@generateur>",
+        "MIME-Version: 1.0",
+        f"Content-Type: {content_type}; charset=utf-8",
+        "Content-Transfer-Encoding: 8bit",
+        "",
+        # mboxrd : toute ligne commençant par ">*From " reçoit un ">" supplémentaire
+        _FROM_LINE.sub(r">\1", body.replace("\r\n", "\n")),
+        ""
+    ]
+    return "\n".join(lines) + "\n"
+
+def export_mbox(emails, fp):
+    """Écrit les emails au format mbox, un message à la fois"""
+    count = 0
+    for email in emails:
+        fp.write(format_mbox_message(email))
+        count += 1
+    return count
+
+EXPORTERS = {
+    "jsonl": export_jsonl,
+    "mbox": export_mbox,
+}
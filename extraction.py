@@ -0,0 +1,174 @@
+import re
+from html import unescape
+from html.parser import HTMLParser
+from urllib.parse import urlsplit
+
+MAX_CODES = 10
+MAX_URLS = 50
+
+_URL_RE = re.compile(r"https?://[^\s<>\"'()\[\]{}]+", re.IGNORECASE)
+# Pas de chiffre, lettre ou séparateur collé : exclut décimales, heures, références d'URL
+_CODE_RE = re.compile(r"(?<![\w/#=&%-])(?<!\d[.,:])(\d{3}[ -]\d{3}|\d{4,8})(?![\w/%-])(?![.,:]\d)")
+_KEYWORD_RE = re.compile(
+    r"code|otp|pin|passcode|verif|vérif|confirm|security|sécurité|token|one[- ]time",
+    re.IGNORECASE
+)
+_HTML_HINT = re.compile(r"<\s*(html|body|div|p|table|br|a|span)\b", re.IGNORECASE)
+_BLOCK_TAGS = {"br", "p", "div", "tr", "td", "th", "li", "table", "h1", "h2", "h3", "h4", "h5", "h6"}
+# Distance maximale (en caractères) entre un code et un mot-clé pour le privilégier
+KEYWORD_WINDOW = 80
+# Longueur de l'aperçu affiché dans les listes
+PREVIEW_LENGTH = 160
+
+class _HTMLTextExtractor(HTMLParser):
+    """Extrait le texte visible et les liens d'un corps HTML"""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts = []
+        self.links = []
+        self._skip = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in ("script", "style", "head"):
+            self._skip += 1
+        elif tag == "a":
+            href = dict(attrs).get("href")
+            if href:
+                self.links.append(href)
+            self.parts.append(" ")
+        elif tag in _BLOCK_TAGS:
+            self.parts.append("\n")
+
+    def handle_endtag(self, tag):
+        if tag in ("script", "style", "head") and self._skip:
+            self._skip -= 1
+        elif tag == "a":
+            self.parts.append(" ")
+        elif tag in _BLOCK_TAGS:
+            self.parts.append("\n")
+
+    def handle_data(self, data):
+        if not self._skip:
+            self.parts.append(data)
+
+def is_html(body):
+    """Détecte grossièrement un corps HTML"""
+    return bool(body and _HTML_HINT.search(body[:2048]))
+
+def html_to_text(body):
+    """Convertit un corps HTML en texte brut et retourne (texte, liens href)"""
+    parser = _HTMLTextExtractor()
+    try:
+        parser.feed(body)
+        parser.close()
+    except Exception:
+        return unescape(re.sub(r"<[^>]+>", " ", body)), []
+    return "".join(parser.parts), parser.links
+
+def normalize_text(text):
+    """Espaces resserrés sur chaque ligne, au plus une ligne vide entre deux paragraphes"""
+    lines = []
+    for line in text.replace("\r\n", "\n").split("\n"):
+        line = " ".join(line.split())
+        if line or (lines and lines[-1]):
+            lines.append(line)
+    return "\n".join(lines).strip()
+
+def preview_text(text):
+    """Aperçu d'une ligne (PREVIEW_LENGTH caractères au plus)"""
+    words = " ".join(text[:PREVIEW_LENGTH * 4].split())
+    if len(words) <= PREVIEW_LENGTH:
+        return words
+    return words[:PREVIEW_LENGTH - 1].rstrip() + "…"
+
+def message_metadata(body):
+    """Texte brut, aperçu, taille et nature d'un corps, calculés une fois à l'ingestion
+
+    `body_text` n'est renseigné que pour un corps HTML : le texte d'un corps
+    brut est le corps lui-même. `body_size` est en octets (UTF-8).
+    """
+    body = body or ""
+    html = is_html(body)
+    text = normalize_text(html_to_text(body)[0]) if html else None
+    return {
+        "body_text": text,
+        "preview": preview_text(text if html else body),
+        "body_size": len(body.encode('utf-8', errors='surrogatepass')),
+        "is_html": html
+    }
+
+def _clean_url(url):
+    """Retire la ponctuation finale capturée par erreur"""
+    return url.rstrip(".,;:!?'\")]}>")
+
+def url_domain(url):
+    """Domaine (minuscules, sans www.) d'une URL"""
+    try:
+        host = urlsplit(url).hostname or ""
+    except ValueError:
+        return ""
+    return host[4:] if host.startswith("www.") else host
+
+def sender_domain(sender):
+    """Domaine d'une adresse d'expéditeur"""
+    if not sender or "@" not in sender:
+        return ""
+    return sender.rsplit("@", 1)[1].strip(" >").lower()
+
+def extract_artifacts(subject, body):
+    """Extrait codes numériques et URLs d'un email, une seule fois à l'ingestion
+
+    Retourne une liste de dictionnaires {kind, value, domain, position}. Les codes
+    proches d'un mot-clé (code, OTP, vérification...) sont classés en premier :
+    position 0 désigne le code le plus probable.
+    """
+    body = body or ""
+    links = []
+    if is_html(body):
+        text, links = html_to_text(body)
+    else:
+        text = body
+    text = f"{subject or ''}\n{text}"
+
+    urls = []
+    seen = set()
+    for url in links + _URL_RE.findall(text):
+        url = _clean_url(unescape(url))
+        if not url.lower().startswith(("http://", "https://")) or url in seen:
+            continue
+        seen.add(url)
+        urls.append(url)
+        if len(urls) >= MAX_URLS:
+            break
+
+    # Les chiffres contenus dans les URLs ne sont pas des codes
+    text_without_urls = _URL_RE.sub(" ", text)
+    keywords = [(m.start(), m.end()) for m in _KEYWORD_RE.finditer(text_without_urls)]
+    candidates = []
+    seen_codes = set()
+    for match in _CODE_RE.finditer(text_without_urls):
+        code = re.sub(r"[ -]", "", match.group(1))
+        if code in seen_codes:
+            continue
+        seen_codes.add(code)
+        # Le mot-clé précède généralement le code : un mot-clé placé après pèse trois fois moins
+        distance = min(
+            (match.start() - end if end <= match.start() else (start - match.end()) * 3
+             for start, end in keywords),
+            default=KEYWORD_WINDOW + 1
+        )
+        near_keyword = distance <= KEYWORD_WINDOW
+        looks_like_year = len(code) == 4 and 1900 <= int(code) <= 2099
+        candidates.append((not near_keyword, looks_like_year, distance, match.start(), code))
+    candidates.sort()
+
+    artifacts = [
+        {"kind": "code", "value": code, "domain": None, "position": position}
+        for position, (*_, code) in enumerate(candidates[:MAX_CODES])
+    ]
+    artifacts.extend(
+        {"kind": "url", "value": url, "domain": url_domain(url), "position": position}
+        for position, url in enumerate(urls)
+    )
+    return artifacts
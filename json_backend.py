@@ -0,0 +1,800 @@
+import bisect
+import heapq
+import json
+import os
+from collections import Counter
+from datetime import datetime, timedelta
+
+import migrations
+from extraction import message_metadata
+from records import Account, ReceivedEmail
+from locking import InterProcessLock, atomic_write_json
+from local_store import ShardedLocalStore
+from search_index import LocalSearchIndex
+from storage_backend import StorageBackend, content_hash
+
+try:
+    from config import LOCAL_STORAGE_LAYOUT
+except ImportError:
+    LOCAL_STORAGE_LAYOUT = "sharded"
+
+class JsonBackend(StorageBackend):
+    """Stockage local en fichiers JSON, sans serveur (repli quand MySQL est indisponible)
+
+    Les écritures passent par un verrou inter-processus et un remplacement
+    atomique des fichiers ; les lectures s'en passent.
+    """
+
+    name = "local"
+
+    def __init__(self, local_data_file="local_emails.json"):
+        super().__init__()
+        self.local_data_file = local_data_file
+        # Verrou des écritures locales (threads et processus) ; les lectures s'en passent
+        self._local_lock = InterProcessLock(self.local_data_file + ".lock")
+        # "sharded" : index + un fichier par compte ; "single" : ancien fichier unique
+        self._sharded_store = ShardedLocalStore(local_data_file) if LOCAL_STORAGE_LAYOUT == "sharded" else None
+        # Index inversé de la recherche plein texte
+        self.search_index = None
+        # Index trié des adresses pour search_accounts
+        self._account_index = None
+
+    def open(self):
+        """Crée ou migre le stockage local et construit son index de recherche au besoin"""
+        with self._local_lock:
+            self._migrate_local_storage()
+            self.search_index = LocalSearchIndex(os.path.splitext(self.local_data_file)[0] + ".d/search")
+            if not self.search_index.exists():
+                data = self._load_local_data()
+                blobs = data.get("blobs", {})
+                self.search_index.rebuild(
+                    dict(email, body=(blobs.get(email.get("body_hash")) or {}).get("content"))
+                    for email in data["emails"]
+                )
+        return True, None
+
+    def _migrate_local_storage(self):
+        """Crée le stockage local ou lui applique les migrations manquantes (sous _local_lock)"""
+        store = self._sharded_store
+        if store and store.exists() and not store.is_sharded():
+            with open(self.local_data_file, 'r') as f:
+                store.convert(json.load(f))
+        if store and store.exists():
+            # Seul l'index est lu au démarrage, sauf migration à appliquer
+            if store.load(account_ids=()).get("schema_version", 0) >= migrations.LATEST_VERSION:
+                return
+        if not os.path.exists(self.local_data_file):
+            initial_data = {
+                "accounts": [],
+                "emails": [],
+                "blobs": {},
+                "next_account_id": 1,
+                "next_email_id": 1
+            }
+            self._save_local_data(initial_data)
+        
+        data = self._load_local_data()
+        if migrations.apply_local_migrations(data):
+            self._save_local_data(data)
+
+    def _load_local_data(self, account_ids=None):
+        """Charge les données locales
+
+        En disposition répartie, seuls les fichiers des comptes `account_ids`
+        sont lus (tous si None, aucun pour un tuple vide : index seul). Avec le
+        fichier unique, tout est toujours chargé.
+        """
+        if self._sharded_store:
+            return self._sharded_store.load(account_ids)
+        try:
+            with open(self.local_data_file, 'r') as f:
+                return json.load(f)
+        except:
+            return {"accounts": [], "emails": [], "blobs": {}, "next_account_id": 1, "next_email_id": 1}
+
+    def _save_local_data(self, data):
+        """Sauvegarde les données locales (remplacement atomique, sous _local_lock)"""
+        if self._sharded_store:
+            self._sharded_store.save(data)
+        else:
+            atomic_write_json(self.local_data_file, data)
+
+    def get_schema_version(self):
+        """Retourne la version de schéma appliquée"""
+        return self._load_local_data(account_ids=()).get("schema_version", 0)
+
+    def save_account(self, email, password, pooled=False, provider="mailtm"):
+        """Sauvegarde un compte (`pooled` : mis en réserve, invisible jusqu'à son attribution ;
+        `provider` : fournisseur propriétaire de l'adresse)"""
+        with self._local_lock:
+            data = self._load_local_data(account_ids=())
+            existing_account = next((acc for acc in data["accounts"] if acc["email"] == email), None)
+            if existing_account:
+                existing_account["password"] = password
+                account_id = existing_account["id"]
+            else:
+                account_id = data["next_account_id"]
+                data["accounts"].append({
+                    "id": account_id,
+                    "email": email,
+                    "password": password,
+                    "token": None,
+                    "token_expires_at": None,
+                    "created_at": datetime.now().isoformat(),
+                    "pooled": pooled,
+                    "provider": provider
+                })
+                data["next_account_id"] += 1
+            self._save_local_data(data)
+            return account_id
+
+    def save_accounts_batch(self, accounts):
+        """Sauvegarde un lot de comptes complets (email, password, token, dates)"""
+        if not accounts:
+            return {}
+        with self._local_lock:
+            data = self._load_local_data(account_ids=())
+            by_email = {acc["email"]: acc for acc in data["accounts"]}
+            for account in accounts:
+                existing = by_email.get(account["email"])
+                if existing:
+                    existing["password"] = account.get("password")
+                    if account.get("token"):
+                        existing["token"] = account["token"]
+                        existing["token_expires_at"] = self._local_datetime_str(account.get("token_expires_at"))
+                    continue
+                record = {
+                    "id": data["next_account_id"],
+                    "email": account["email"],
+                    "password": account.get("password"),
+                    "token": account.get("token"),
+                    "token_expires_at": self._local_datetime_str(account.get("token_expires_at")),
+                    "created_at": self._local_datetime_str(account.get("created_at")) or datetime.now().isoformat(),
+                    "provider": account.get("provider") or "mailtm"
+                }
+                data["accounts"].append(record)
+                by_email[record["email"]] = record
+                data["next_account_id"] += 1
+            self._save_local_data(data)
+            return {account["email"]: by_email[account["email"]]["id"] for account in accounts}
+
+    def iter_accounts(self, chunk_size=500):
+        """Parcourt tous les comptes, secrets compris, par ordre d'ID croissant"""
+        data = self._load_local_data(account_ids=())
+        for account in sorted(data["accounts"], key=lambda x: x["id"]):
+            yield Account.from_row(account)
+        return
+
+    def save_token(self, account_id, token, expires_at):
+        """Sauvegarde un token"""
+        with self._local_lock:
+            data = self._load_local_data(account_ids=())
+            for account in data["accounts"]:
+                if account["id"] == account_id:
+                    account["token"] = token
+                    account["token_expires_at"] = expires_at.isoformat()
+                    break
+            self._save_local_data(data)
+
+    def save_tokens_batch(self, tokens):
+        """Sauvegarde plusieurs tokens en une écriture : liste de (account_id, token, expires_at)"""
+        if not tokens:
+            return
+        with self._local_lock:
+            data = self._load_local_data(account_ids=())
+            by_id = {account_id: (token, expires_at) for account_id, token, expires_at in tokens}
+            for account in data["accounts"]:
+                if account["id"] in by_id:
+                    token, expires_at = by_id[account["id"]]
+                    account["token"] = token
+                    account["token_expires_at"] = self._local_datetime_str(expires_at)
+            self._save_local_data(data)
+
+    def touch_account(self, account_id, used_at):
+        """Enregistre la dernière utilisation réelle d'un compte"""
+        with self._local_lock:
+            data = self._load_local_data(account_ids=())
+            for account in data["accounts"]:
+                if account["id"] == account_id:
+                    account["last_used_at"] = self._local_datetime_str(used_at)
+                    self._save_local_data(data)
+                    break
+
+    def get_accounts_needing_token(self, refresh_before, active_since, limit=500, providers=None):
+        """Comptes actifs dont le token manque ou expire avant `refresh_before`"""
+        if providers is not None and not providers:
+            return []
+        data = self._load_local_data(account_ids=())
+        accounts = []
+        for account in data["accounts"]:
+            if providers is not None and account.get("provider", "mailtm") not in providers:
+                continue
+            expires_at = self._parse_local_datetime(account.get("token_expires_at"))
+            reference = self._parse_local_datetime(account.get("last_used_at") or account.get("created_at"))
+            if reference and reference < active_since:
+                continue
+            if account.get("token") and expires_at and expires_at >= refresh_before:
+                continue
+            accounts.append({
+                "id": account["id"],
+                "email": account["email"],
+                "password": account.get("password"),
+                "token_expires_at": expires_at,
+                "provider": account.get("provider", "mailtm")
+            })
+        accounts.sort(key=lambda acc: (acc["token_expires_at"] is not None, acc["token_expires_at"] or datetime.min))
+        return accounts[:limit]
+
+    def get_valid_token(self, account_id, min_validity_seconds=0):
+        """Récupère un token valide encore au moins `min_validity_seconds` secondes"""
+        threshold = datetime.now() + timedelta(seconds=min_validity_seconds)
+        data = self._load_local_data(account_ids=())
+        for account in data["accounts"]:
+            if account["id"] == account_id and account.get("token"):
+                expires_str = account.get("token_expires_at")
+                if expires_str:
+                    expires_at = datetime.fromisoformat(expires_str)
+                    if expires_at > threshold:
+                        return account["token"]
+        return None
+
+    def clear_token(self, account_id):
+        """Supprime un token"""
+        with self._local_lock:
+            data = self._load_local_data(account_ids=())
+            for account in data["accounts"]:
+                if account["id"] == account_id:
+                    account["token"] = None
+                    account["token_expires_at"] = None
+                    break
+            self._save_local_data(data)
+
+    def get_all_accounts(self):
+        """Récupère tous les comptes attribués (hors réserve)"""
+        data = self._load_local_data(account_ids=())
+        return [Account.from_row(acc) for acc in data["accounts"] if not acc.get("pooled")]
+
+    def search_accounts(self, text, limit=20):
+        """Comptes attribués dont l'adresse commence par `text`, puis ceux qui la contiennent"""
+        text = (text or "").strip().lower()
+        keys, accounts = self._local_account_index()
+        start = bisect.bisect_left(keys, (text,))
+        found = []
+        for email, account_id in keys[start:]:
+            if not email.startswith(text) or len(found) >= limit:
+                break
+            found.append(account_id)
+        if len(found) < limit and text:
+            for email, account_id in keys:
+                if text in email and not email.startswith(text):
+                    found.append(account_id)
+                    if len(found) >= limit:
+                        break
+        return [Account(**{field: accounts[account_id].get(field)
+                           for field in ("id", "email", "created_at", "provider")})
+                for account_id in found]
+
+    def _local_account_index(self):
+        """Adresses triées (minuscules, ID) des comptes attribués, et comptes par ID
+
+        Réutilisé tant que le fichier d'index n'a pas changé ; après une
+        écriture qui ne touche pas à la liste des comptes (emails, tokens), seul
+        le dictionnaire des comptes est rafraîchi, sans nouveau tri.
+        """
+        try:
+            stat = os.stat(self.local_data_file)
+            file_key = (stat.st_mtime_ns, stat.st_size)
+        except OSError:
+            file_key = None
+        cached = self._account_index
+        if cached and file_key and cached[0] == file_key:
+            return cached[2], cached[3]
+        data = self._load_local_data(account_ids=())
+        accounts = {acc["id"]: acc for acc in data["accounts"] if not acc.get("pooled")}
+        membership = (data.get("next_account_id"), len(accounts), len(data["accounts"]))
+        if cached and cached[1] == membership:
+            keys = cached[2]
+        else:
+            keys = sorted((acc["email"].lower(), account_id) for account_id, acc in accounts.items())
+        self._account_index = (file_key, membership, keys, accounts)
+        return keys, accounts
+
+    def get_pooled_accounts(self, limit=100):
+        """Comptes en réserve, les plus anciens d'abord"""
+        data = self._load_local_data(account_ids=())
+        return [Account.from_row(acc) for acc in data["accounts"] if acc.get("pooled")][:limit]
+
+    def claim_pooled_account(self, account_id):
+        """Sort un compte de la réserve ; False s'il a déjà été attribué (autre processus)"""
+        with self._local_lock:
+            data = self._load_local_data(account_ids=())
+            account = next((acc for acc in data["accounts"] if acc["id"] == account_id), None)
+            if not account or not account.get("pooled"):
+                return False
+            account["pooled"] = False
+            self._save_local_data(data)
+            return True
+
+    def get_account_by_email(self, email):
+        """Récupère un compte par email"""
+        data = self._load_local_data(account_ids=())
+        return Account.from_row(next((acc for acc in data["accounts"] if acc["email"] == email), None))
+
+    def get_account_by_id(self, account_id):
+        """Récupère un compte par ID"""
+        data = self._load_local_data(account_ids=())
+        return Account.from_row(next((acc for acc in data["accounts"] if acc["id"] == account_id), None))
+
+    def _acquire_local_blob(self, data, content):
+        """Référence un blob local (création si absent) et retourne son empreinte"""
+        blobs = data.setdefault("blobs", {})
+        blob_hash = content_hash(content)
+        blob = blobs.get(blob_hash)
+        if blob:
+            blob["ref_count"] += 1
+        else:
+            blobs[blob_hash] = {"content": content or "", "ref_count": 1}
+        return blob_hash
+
+    def _release_local_blobs(self, data, blob_hashes):
+        """Décrémente les références locales et supprime les blobs devenus orphelins"""
+        blobs = data.setdefault("blobs", {})
+        for blob_hash, count in Counter(h for h in blob_hashes if h).items():
+            blob = blobs.get(blob_hash)
+            if not blob:
+                continue
+            blob["ref_count"] -= count
+            if blob["ref_count"] <= 0:
+                del blobs[blob_hash]
+
+    def _email_blob_hashes(self, emails):
+        """Empreintes des blobs référencés par des emails (corps et texte brut des HTML)"""
+        return [blob_hash for email in emails
+                for blob_hash in (email.get("body_hash"), email.get("text_hash")) if blob_hash]
+
+    def _resolve_local_email(self, data, email):
+        """Construit l'enregistrement d'un email local, le corps et son texte étant lus dans le blob store au premier accès"""
+        blob_hash = email.get("body_hash")
+        if not blob_hash:
+            return ReceivedEmail.from_row(email)
+        blobs = data.get("blobs", {})
+        text_hash = email.get("text_hash")
+        return ReceivedEmail(
+            body_loader=lambda: (blobs.get(blob_hash) or {}).get("content", ""),
+            text_loader=(lambda: (blobs.get(text_hash) or {}).get("content")) if text_hash else None,
+            **email
+        )
+
+    def save_received_emails(self, rows):
+        """Sauvegarde un lot d'emails en une seule écriture et retourne leurs IDs (None si doublon)"""
+        with self._local_lock:
+            data = self._load_local_data(account_ids={row["account_id"] for row in rows})
+            # Même clé de déduplication que l'index unique MySQL
+            known_ids = {(email.get("account_id"), email.get("message_id"))
+                         for email in data["emails"] if email.get("message_id")}
+            saved_ids = []
+            indexed = []
+            for row in rows:
+                message_id = row.get("message_id")
+                key = (row["account_id"], message_id)
+                if message_id and key in known_ids:
+                    saved_ids.append(None)  # Email ignoré (déjà existant)
+                    continue
+
+                received_at = row.get("received_at") or datetime.now()
+                if isinstance(received_at, datetime):
+                    received_at = received_at.isoformat()
+
+                email_id = data["next_email_id"]
+                metadata = message_metadata(row.get("body"))
+                body_text = metadata.pop("body_text")
+                email = {
+                    "id": email_id,
+                    "account_id": row["account_id"],
+                    "message_id": message_id,
+                    "sender": row.get("sender"),
+                    "recipient": row.get("recipient"),
+                    "subject": row.get("subject"),
+                    "body_hash": self._acquire_local_blob(data, row.get("body")),
+                    "received_at": received_at,
+                    **metadata
+                }
+                # Le texte brut d'un corps HTML est un blob à part, lu seulement par la vue détaillée
+                if body_text is not None:
+                    email["text_hash"] = self._acquire_local_blob(data, body_text)
+                data["emails"].append(email)
+                data.setdefault("artifacts", []).extend(
+                    self._artifact_records(email_id, row, received_at)
+                )
+                data.setdefault("attachments", []).extend(self._attachment_records(email_id, row))
+                data["next_email_id"] += 1
+                if message_id:
+                    known_ids.add(key)
+                saved_ids.append(email_id)
+                indexed.append(dict(row, id=email_id, received_at=received_at))
+            if any(saved_ids):
+                self._save_local_data(data)
+                self.search_index.add(indexed)
+            return saved_ids
+
+    def get_email_attachments(self, email_id, account_id=None):
+        """Pièces jointes et source d'un email ; `account_id` évite de chercher le fichier du compte"""
+        if account_id is not None:
+            data = self._load_local_data(account_ids=(account_id,))
+        else:
+            data = self._load_email_shard(email_id)
+        return sorted((a for a in data.get("attachments", []) if a["email_id"] == email_id),
+                      key=lambda a: (a["kind"] != "attachment", a["position"]))
+
+    def add_email_attachment(self, email_id, account_id, attachment):
+        """Rattache après coup un contenu à un email (p. ex. source .eml téléchargée à la demande)"""
+        with self._local_lock:
+            data = self._load_local_data(account_ids=(account_id,))
+            existing = [a for a in data.get("attachments", []) if a["email_id"] == email_id]
+            record = self._attachment_records(email_id, {"account_id": account_id, "attachments": [attachment]})[0]
+            record["position"] = len(existing)
+            data.setdefault("attachments", []).append(record)
+            self._save_local_data(data)
+
+    def delete_received_email(self, email_id, account_id=None):
+        """Supprime un email reçu et libère son blob ; `account_id` limite la lecture au fichier du compte"""
+        with self._local_lock:
+            if account_id is not None:
+                data = self._load_local_data(account_ids=(account_id,))
+            else:
+                data = self._load_email_shard(email_id)
+            email = next((email for email in data["emails"] if email["id"] == email_id), None)
+            if not email:
+                return False
+            data["emails"].remove(email)
+            data["artifacts"] = [a for a in data.get("artifacts", []) if a["email_id"] != email_id]
+            data["attachments"] = [a for a in data.get("attachments", []) if a["email_id"] != email_id]
+            self._release_local_blobs(data, self._email_blob_hashes([email]))
+            self.search_index.delete([email_id])
+            self._save_local_data(data)
+            return True
+
+    def _load_email_shard(self, email_id):
+        """Charge le fichier du compte qui contient l'email, repéré par les bornes d'ID de l'index"""
+        if not self._sharded_store:
+            return self._load_local_data()
+        index = self._load_local_data(account_ids=())
+        for account_id, summary in self._shard_summaries(index):
+            if summary and not (summary["emails"] and summary["min_id"] <= email_id <= summary["max_id"]):
+                continue
+            data = self._load_local_data(account_ids=(account_id,))
+            if any(email["id"] == email_id for email in data["emails"]):
+                return data
+        return index
+
+    def delete_account(self, account_id):
+        """Supprime un compte, ses emails et libère les blobs associés"""
+        with self._local_lock:
+            data = self._load_local_data(account_ids=(account_id,))
+            account = next((acc for acc in data["accounts"] if acc["id"] == account_id), None)
+            if not account:
+                return False
+            removed = [email for email in data["emails"] if email.get("account_id") == account_id]
+            data["emails"] = [email for email in data["emails"] if email.get("account_id") != account_id]
+            data["artifacts"] = [a for a in data.get("artifacts", []) if a["account_id"] != account_id]
+            data["attachments"] = [a for a in data.get("attachments", []) if a["account_id"] != account_id]
+            data["accounts"].remove(account)
+            self._release_local_blobs(data, self._email_blob_hashes(removed))
+            self.search_index.delete([email["id"] for email in removed])
+            self._save_local_data(data)
+            return True
+
+    def collect_garbage_blobs(self):
+        """Supprime les blobs qui ne sont plus référencés par aucun email et compacte l'index de recherche
+
+        Les références sont comptées fichier de compte par fichier de compte :
+        le stockage n'est jamais chargé en entier.
+        """
+        with self._local_lock:
+            references = Counter()
+            for data in self._iter_shards():
+                references.update(self._email_blob_hashes(data["emails"]))
+            data = self._load_local_data(account_ids=())
+            removed = 0
+            blobs = data.setdefault("blobs", {})
+            for blob_hash in list(blobs):
+                if references[blob_hash]:
+                    blobs[blob_hash]["ref_count"] = references[blob_hash]
+                else:
+                    del blobs[blob_hash]
+                    removed += 1
+            self._save_local_data(data)
+            # Les emails supprimés sont aussi effacés des fichiers de l'index de recherche
+            self.search_index.compact()
+            return removed
+
+    def attachment_hashes(self):
+        """Empreintes des contenus joints encore référencés"""
+        return {a["content_hash"] for data in self._iter_shards() for a in data.get("attachments", [])}
+
+    def _iter_shards(self):
+        """Données de chaque fichier de compte, l'un après l'autre (tout d'un coup avec le fichier unique)"""
+        if not self._sharded_store:
+            yield self._load_local_data()
+            return
+        index = self._load_local_data(account_ids=())
+        for account_id in self._sharded_store.shard_ids(index):
+            yield self._load_local_data(account_ids=(account_id,))
+
+    def _shard_summaries(self, index):
+        """(account_id, résumé de l'index) de chaque fichier de compte ; résumé None : contenu inconnu"""
+        summaries = index.get("shard_stats", {})
+        return [(account_id, summaries.get(str(account_id)))
+                for account_id in sorted(self._sharded_store.shard_ids(index), key=str)]
+
+    def _delete_local_emails(self, data, doomed_ids):
+        """Supprime des emails locaux par ID et libère leurs blobs"""
+        if not doomed_ids:
+            return 0
+        removed = [email for email in data["emails"] if email["id"] in doomed_ids]
+        data["emails"] = [email for email in data["emails"] if email["id"] not in doomed_ids]
+        data["artifacts"] = [a for a in data.get("artifacts", []) if a["email_id"] not in doomed_ids]
+        data["attachments"] = [a for a in data.get("attachments", []) if a["email_id"] not in doomed_ids]
+        self._release_local_blobs(data, self._email_blob_hashes(removed))
+        self.search_index.delete([email["id"] for email in removed])
+        return len(removed)
+
+    def _purge_local_emails(self, index, keep, limit, select, account_ids=None):
+        """Supprime au plus `limit` emails choisis par `select(data, n)` sans lire tout le stockage
+
+        `keep(résumé)` retient, d'après l'index, les fichiers de comptes
+        (parmi `account_ids` si donné) qui peuvent contenir des emails à
+        supprimer et retourne leur nombre au plus. Un fichier sans résumé est
+        retenu. Les fichiers sont lus par groupes couvrant ce qui reste à
+        supprimer, chaque groupe écrit avant le suivant.
+        """
+        if not self._sharded_store:
+            data = self._load_local_data()
+            deleted = self._delete_local_emails(data, select(data, limit))
+            if deleted:
+                self._save_local_data(data)
+            return deleted
+
+        pending = []
+        for account_id, summary in self._shard_summaries(index):
+            if account_ids is not None and account_id not in account_ids:
+                continue
+            weight = keep(summary) if summary else True
+            if weight:
+                pending.append((account_id, limit if weight is True else weight))
+        deleted = 0
+        while pending and deleted < limit:
+            group = []
+            covered = 0
+            while pending and covered < limit - deleted:
+                account_id, weight = pending.pop(0)
+                group.append(account_id)
+                covered += weight
+            data = self._load_local_data(account_ids=group)
+            deleted += self._delete_local_emails(data, select(data, limit - deleted))
+            # Écrit même sans suppression : les résumés des fichiers lus complètent l'index
+            self._save_local_data(data)
+        return deleted
+
+    def purge_emails_before(self, cutoff, limit=500):
+        """Supprime au plus `limit` emails reçus avant `cutoff` et retourne leur nombre"""
+        def keep(summary):
+            oldest = self._parse_local_datetime(summary.get("oldest"))
+            return summary["emails"] if oldest and oldest < cutoff else 0
+
+        def select(data, count):
+            doomed_ids = set()
+            for email in data["emails"]:
+                received_at = self._parse_local_datetime(email.get("received_at"))
+                if received_at and received_at < cutoff:
+                    doomed_ids.add(email["id"])
+                    if len(doomed_ids) >= count:
+                        break
+            return doomed_ids
+
+        with self._local_lock:
+            return self._purge_local_emails(self._load_local_data(account_ids=()), keep, limit, select)
+
+    def purge_excess_emails(self, max_per_account, limit=500):
+        """Ne conserve que les `max_per_account` emails les plus récents de chaque compte"""
+        def select(data, count):
+            by_account = {}
+            for email in data["emails"]:
+                by_account.setdefault(email.get("account_id"), []).append(email)
+            doomed_ids = set()
+            for emails in by_account.values():
+                if len(emails) <= max_per_account:
+                    continue
+                emails.sort(key=lambda x: (str(x.get("received_at")), x["id"]), reverse=True)
+                for email in emails[max_per_account:]:
+                    doomed_ids.add(email["id"])
+                    if len(doomed_ids) >= count:
+                        break
+                if len(doomed_ids) >= count:
+                    break
+            return doomed_ids
+
+        with self._local_lock:
+            return self._purge_local_emails(self._load_local_data(account_ids=()),
+                                            lambda summary: max(0, summary["emails"] - max_per_account),
+                                            limit, select)
+
+    def purge_expired_accounts(self, cutoff, limit=500, providers=None):
+        """Supprime les comptes dont le token a expiré (ou jamais obtenu) et inutilisés depuis `cutoff`"""
+        if providers is not None and not providers:
+            return 0
+        with self._local_lock:
+            index = self._load_local_data(account_ids=())
+            expired_ids = set()
+            for account in index["accounts"]:
+                if providers is not None and account.get("provider", "mailtm") not in providers:
+                    continue
+                reference = account.get("token_expires_at") or account.get("created_at")
+                reference = self._parse_local_datetime(reference)
+                last_used = self._parse_local_datetime(account.get("last_used_at") or account.get("created_at"))
+                if reference and reference < cutoff and not (last_used and last_used >= cutoff):
+                    expired_ids.add(account["id"])
+            if not expired_ids:
+                return 0
+
+            def select(data, count):
+                doomed_ids = set()
+                for email in data["emails"]:
+                    if email.get("account_id") in expired_ids:
+                        doomed_ids.add(email["id"])
+                        if len(doomed_ids) >= count:
+                            break
+                return doomed_ids
+
+            if self._sharded_store:
+                deleted = self._purge_local_emails(index, lambda summary: summary["emails"], limit, select,
+                                                   account_ids=expired_ids)
+                if deleted >= limit:
+                    return deleted
+                # Les fichiers vidés ont un résumé à 0 email dans l'index
+                data = self._load_local_data(account_ids=())
+                still_used = {int(key) for key, summary in data.get("shard_stats", {}).items()
+                              if key.isdigit() and summary["emails"]}
+            else:
+                data = self._load_local_data()
+                deleted = self._delete_local_emails(data, select(data, limit))
+                if deleted >= limit:
+                    self._save_local_data(data)
+                    return deleted
+                still_used = {email.get("account_id") for email in data["emails"]}
+            emptied = [acc for acc in data["accounts"]
+                       if acc["id"] in expired_ids and acc["id"] not in still_used]
+            emptied = emptied[:limit - deleted]
+            emptied_ids = {acc["id"] for acc in emptied}
+            data["accounts"] = [acc for acc in data["accounts"] if acc["id"] not in emptied_ids]
+            deleted += len(emptied)
+            if emptied or (deleted and not self._sharded_store):
+                self._save_local_data(data)
+            return deleted
+
+    def query_artifacts(self, account_id, kind, sender=None, domain=None, since=None, limit=1):
+        """Interroge l'index des artefacts, du plus récent au plus ancien, sans lire les corps"""
+        data = self._load_local_data(account_ids=(account_id,))
+        matches = []
+        for artifact in data.get("artifacts", []):
+            if artifact["account_id"] != account_id or artifact["kind"] != kind:
+                continue
+            if sender and "@" in sender and artifact.get("sender") != sender:
+                continue
+            if sender and "@" not in sender and artifact.get("sender_domain") != sender.lower():
+                continue
+            if domain and artifact.get("domain") != domain.lower():
+                continue
+            received_at = self._parse_local_datetime(artifact.get("received_at"))
+            if since and received_at and received_at < since:
+                continue
+            matches.append(dict(artifact, received_at=received_at))
+        matches.sort(key=lambda a: (a["received_at"] or datetime.min, a["email_id"], -a["position"]), reverse=True)
+        return matches[:limit]
+
+    def search_emails(self, query, account_id=None, since=None, until=None, limit=20, offset=0):
+        """Recherche dans l'index inversé ; seuls les fichiers des comptes de la page sont lus"""
+        total, page = self.search_index.search(
+            query, None if account_id is None else (account_id,), since, until, limit, offset
+        )
+        if not page:
+            return {"total": total, "results": []}
+        data = self._load_local_data(account_ids={page_account for _, page_account, _ in page})
+        by_id = {email["id"]: email for email in data["emails"]}
+        return {"total": total, "results": [
+            {"email": self._resolve_local_email(data, by_id[email_id]), "score": round(score, 4)}
+            for email_id, _, score in page if email_id in by_id
+        ]}
+
+    def get_all_received_emails(self):
+        """Récupère tous les emails reçus"""
+        data = self._load_local_data()
+        emails = sorted(data["emails"], key=lambda x: x["received_at"], reverse=True)
+        return [self._resolve_local_email(data, email) for email in emails]
+
+    def get_received_emails_by_account(self, account_id):
+        """Récupère les emails reçus pour un compte spécifique"""
+        data = self._load_local_data(account_ids=(account_id,))
+        emails = [email for email in data["emails"] if email.get("account_id") == account_id]
+        emails = sorted(emails, key=lambda x: x["received_at"], reverse=True)
+        return [self._resolve_local_email(data, email) for email in emails]
+
+    def iter_received_emails(self, account_id=None, chunk_size=500, after_id=0):
+        """Parcourt les emails reçus par ordre d'ID croissant
+
+        Stockage réparti : les fichiers de comptes sont fusionnés par ID et
+        chacun n'est lu qu'au moment où la fusion atteint son plus petit ID
+        (bornes de l'index), puis libéré une fois parcouru ; seuls les fichiers
+        dont les plages d'ID se recouvrent sont en mémoire ensemble. Corps
+        résolus à la demande ; `chunk_size` ne sert qu'à MySQL.
+        """
+        if account_id is not None or not self._sharded_store:
+            data = self._load_local_data(account_ids=None if account_id is None else (account_id,))
+            for email in data["emails"]:
+                if email["id"] <= after_id:
+                    continue
+                if account_id is not None and email.get("account_id") != account_id:
+                    continue
+                yield self._resolve_local_email(data, email)
+            return
+
+        index = self._load_local_data(account_ids=())
+        shards = sorted(((summary or {}).get("min_id", 0), str(shard_id), shard_id)
+                        for shard_id, summary in self._shard_summaries(index)
+                        if not summary or (summary["emails"] and summary["max_id"] > after_id))
+        heap = []
+        opened = 0
+        while opened < len(shards) or heap:
+            # Ouvre les fichiers qui peuvent contenir un ID inférieur au prochain de la fusion
+            while opened < len(shards) and (not heap or shards[opened][0] <= heap[0][0]):
+                emails = self._iter_shard_emails(shards[opened][2], after_id)
+                email = next(emails, None)
+                if email:
+                    heapq.heappush(heap, (email[0]["id"], opened, email, emails))
+                opened += 1
+            if not heap:
+                continue
+            _, position, (email, data), emails = heapq.heappop(heap)
+            yield self._resolve_local_email(data, email)
+            following = next(emails, None)
+            if following:
+                heapq.heappush(heap, (following[0]["id"], position, following, emails))
+
+    def _iter_shard_emails(self, shard_id, after_id):
+        """(email, données du fichier) d'un fichier de compte, par ID croissant au-delà de `after_id`"""
+        data = self._load_local_data(account_ids=(shard_id,))
+        for email in sorted((email for email in data["emails"] if email["id"] > after_id),
+                            key=lambda email: email["id"]):
+            yield email, data
+
+    def get_last_email_id(self):
+        """Retourne l'ID du dernier email enregistré (0 si aucun)"""
+        data = self._load_local_data(account_ids=())
+        return data.get("next_email_id", 1) - 1
+
+    def get_received_emails_after(self, last_id, account_id=None, limit=500):
+        """Récupère les emails d'ID supérieur à `last_id` (ordre croissant), pour un suivi incrémental"""
+        data = self._load_local_data(account_ids=None if account_id is None else (account_id,))
+        emails = [email for email in data["emails"]
+                  if email["id"] > last_id and (account_id is None or email.get("account_id") == account_id)]
+        emails = sorted(emails, key=lambda x: x["id"])[:limit]
+        return [self._resolve_local_email(data, email) for email in emails]
+
+    def get_received_email_by_id(self, email_id):
+        """Récupère un email par ID (seul le fichier du compte qui le contient est lu)"""
+        data = self._load_email_shard(email_id)
+        email = next((email for email in data["emails"] if email["id"] == email_id), None)
+        return self._resolve_local_email(data, email) if email else None
+
+    def get_message_ids(self, account_id):
+        """Ensemble des message_id déjà stockés pour un compte (index unique, sans lire les corps)"""
+        data = self._load_local_data(account_ids=(account_id,))
+        return {email.get("message_id") for email in data["emails"]
+                if email.get("account_id") == account_id and email.get("message_id")}
+
+    def get_received_email_by_message_id(self, account_id, message_id):
+        """Récupère un email par (account_id, message_id)"""
+        data = self._load_local_data(account_ids=(account_id,))
+        email = next((email for email in data["emails"]
+                      if email.get("account_id") == account_id and email.get("message_id") == message_id), None)
+        return self._resolve_local_email(data, email) if email else None
@@ -0,0 +1,224 @@
+import json
+import os
+import shutil
+from collections.abc import MutableMapping
+
+from locking import atomic_write_json
+
+LAYOUT = "sharded"
+# Clés réparties dans les fichiers par compte ; le reste forme l'index
+SHARD_KEYS = ("emails", "artifacts", "attachments")
+
+def _read_text(path):
+    """Contenu d'un fichier, None s'il n'existe pas"""
+    try:
+        with open(path, 'r') as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+def _write_if_changed(path, obj, previous_text, indent=None):
+    """Réécrit un fichier seulement si sa sérialisation a changé ; retourne le nouveau texte
+
+    La comparaison se fait avec le texte lu au chargement : aucune copie des
+    données n'est nécessaire pour savoir ce qui a été modifié.
+    """
+    text = json.dumps(obj, indent=indent, default=str)
+    if text == previous_text:
+        return previous_text
+    if obj:
+        atomic_write_json(path, obj, indent=indent)
+        return text
+    if os.path.exists(path):
+        os.remove(path)
+    return None
+
+class LocalData(dict):
+    """Données locales chargées, avec la trace des fichiers lus pour la sauvegarde"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.index_text = None
+        self.shard_texts = {}
+
+class BlobBuckets(MutableMapping):
+    """Blob store réparti en 256 fichiers selon le préfixe du hash, chargés à la demande"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._buckets = {}
+        self._texts = {}
+
+    def _bucket_name(self, blob_hash):
+        return (blob_hash or "__")[:2].lower()
+
+    def _bucket(self, name):
+        if name not in self._buckets:
+            text = _read_text(os.path.join(self.directory, f"{name}.json"))
+            self._texts[name] = text
+            self._buckets[name] = json.loads(text) if text else {}
+        return self._buckets[name]
+
+    def _bucket_names(self):
+        names = set(self._buckets)
+        if os.path.isdir(self.directory):
+            names.update(name[:-5] for name in os.listdir(self.directory) if name.endswith(".json"))
+        return sorted(names)
+
+    def __getitem__(self, blob_hash):
+        return self._bucket(self._bucket_name(blob_hash))[blob_hash]
+
+    def __setitem__(self, blob_hash, blob):
+        self._bucket(self._bucket_name(blob_hash))[blob_hash] = blob
+
+    def __delitem__(self, blob_hash):
+        del self._bucket(self._bucket_name(blob_hash))[blob_hash]
+
+    def __iter__(self):
+        for name in self._bucket_names():
+            yield from list(self._bucket(name))
+
+    def __len__(self):
+        return sum(len(self._bucket(name)) for name in self._bucket_names())
+
+    def save(self):
+        """Écrit les paquets chargés qui ont changé"""
+        os.makedirs(self.directory, exist_ok=True)
+        for name, bucket in self._buckets.items():
+            self._texts[name] = _write_if_changed(
+                os.path.join(self.directory, f"{name}.json"), bucket, self._texts.get(name)
+            )
+
+class ShardedLocalStore:
+    """Stockage local réparti : un index (comptes, compteurs, version de schéma),
+    un fichier par compte (emails et artefacts) et un blob store par paquets
+
+    load(account_ids) ne lit que les fichiers des comptes demandés ; un tuple
+    vide se limite à l'index, None charge tout (opérations globales). Les
+    données retournées ont la même forme qu'avec le fichier unique, de sorte
+    que le code appelant ne change pas. save() ne réécrit que les fichiers
+    modifiés : une écriture ratée n'abîme plus qu'un compte.
+    """
+
+    def __init__(self, index_path):
+        self.index_path = index_path
+        root = os.path.splitext(index_path)[0] + ".d"
+        self.shard_dir = os.path.join(root, "accounts")
+        self.blob_dir = os.path.join(root, "blobs")
+
+    def exists(self):
+        return os.path.exists(self.index_path)
+
+    def is_sharded(self):
+        """Indique si le fichier d'index est au format réparti (et non un ancien fichier unique)"""
+        text = _read_text(self.index_path)
+        if not text:
+            return False
+        try:
+            return json.loads(text).get("layout") == LAYOUT
+        except ValueError:
+            return False
+
+    def _shard_path(self, account_id):
+        return os.path.join(self.shard_dir, f"{account_id}.json")
+
+    def shard_ids(self, data):
+        """Comptes de l'index plus les fichiers présents sur disque (emails orphelins)"""
+        ids = {account["id"] for account in data["accounts"]}
+        if os.path.isdir(self.shard_dir):
+            for name in os.listdir(self.shard_dir):
+                if name.endswith(".json"):
+                    key = name[:-5]
+                    ids.add(int(key) if key.isdigit() else None)
+        return ids
+
+    def _read_shard(self, account_id):
+        text = _read_text(self._shard_path(account_id))
+        shard = json.loads(text) if text else {}
+        return text, shard
+
+    def load(self, account_ids=None):
+        """Charge l'index et les fichiers des comptes `account_ids` (tous si None)"""
+        text = _read_text(self.index_path)
+        data = LocalData(json.loads(text) if text else {
+            "accounts": [], "next_account_id": 1, "next_email_id": 1
+        })
+        data.index_text = text
+        data.setdefault("accounts", [])
+        for key in SHARD_KEYS:
+            data[key] = []
+
+        ids = self.shard_ids(data) if account_ids is None else set(account_ids)
+        for account_id in ids:
+            shard_text, shard = self._read_shard(account_id)
+            data.shard_texts[account_id] = shard_text
+            for key in SHARD_KEYS:
+                data[key].extend(shard.get(key, []))
+        if len(ids) > 1:
+            # Même ordre (ID croissant) que le fichier unique
+            data["emails"].sort(key=lambda email: email["id"])
+        data["blobs"] = BlobBuckets(self.blob_dir)
+        return data
+
+    def save(self, data):
+        """Écrit l'index puis les fichiers de comptes et paquets de blobs modifiés"""
+        if not isinstance(data, LocalData):
+            data = LocalData(data)
+
+        shards = {account_id: {key: [] for key in SHARD_KEYS} for account_id in data.shard_texts}
+        for key in SHARD_KEYS:
+            for item in data.get(key, []):
+                account_id = item.get("account_id")
+                if account_id not in shards:
+                    # Compte non chargé : on complète son fichier existant au lieu de l'écraser
+                    data.shard_texts[account_id], existing = self._read_shard(account_id)
+                    shards[account_id] = {k: existing.get(k, []) for k in SHARD_KEYS}
+                shards[account_id][key].append(item)
+        self._update_summaries(data, shards)
+
+        index = {key: value for key, value in data.items() if key not in SHARD_KEYS and key != "blobs"}
+        index["layout"] = LAYOUT
+        # L'index (compteurs d'ID) passe en premier : une interruption ne peut pas faire réutiliser un ID
+        data.index_text = _write_if_changed(self.index_path, index, data.index_text, indent=2)
+
+        os.makedirs(self.shard_dir, exist_ok=True)
+        for account_id, shard in shards.items():
+            payload = shard if any(shard.values()) else {}
+            data.shard_texts[account_id] = _write_if_changed(
+                self._shard_path(account_id), payload, data.shard_texts.get(account_id)
+            )
+
+        blobs = data.get("blobs")
+        if isinstance(blobs, BlobBuckets):
+            blobs.save()
+        elif blobs:
+            buckets = BlobBuckets(self.blob_dir)
+            buckets.update(blobs)
+            buckets.save()
+            data["blobs"] = buckets
+
+    def _update_summaries(self, data, shards):
+        """Résumé dans l'index des fichiers de comptes écrits (nombre d'emails, plus ancien, bornes d'ID)
+
+        Les purges et suppressions y choisissent les fichiers à lire sans les
+        ouvrir tous ; un fichier sans email n'a que son nombre (0).
+        """
+        summaries = data.setdefault("shard_stats", {})
+        for account_id, shard in shards.items():
+            emails = shard["emails"]
+            if not emails:
+                summaries[str(account_id)] = {"emails": 0}
+                continue
+            ids = [email["id"] for email in emails]
+            summaries[str(account_id)] = {
+                "emails": len(emails),
+                "oldest": min(str(email.get("received_at")) for email in emails),
+                "min_id": min(ids),
+                "max_id": max(ids)
+            }
+
+    def convert(self, single_file_data):
+        """Répartit un ancien fichier unique ; l'original est conservé en .single.bak"""
+        if os.path.exists(self.index_path):
+            shutil.copy2(self.index_path, self.index_path + ".single.bak")
+        self.save(single_file_data)
@@ -0,0 +1,98 @@
+import json
+import os
+import threading
+import time
+
+if os.name == 'nt':
+    import msvcrt
+
+    def _lock_handle(handle):
+        """Verrou exclusif Windows sur le premier octet du fichier"""
+        handle.seek(0)
+        while True:
+            try:
+                msvcrt.locking(handle.fileno(), msvcrt.LK_LOCK, 1)
+                return
+            except OSError:
+                # LK_LOCK abandonne après ~10 s : on réessaie jusqu'à obtention
+                time.sleep(0.05)
+
+    def _unlock_handle(handle):
+        handle.seek(0)
+        msvcrt.locking(handle.fileno(), msvcrt.LK_UNLCK, 1)
+else:
+    import fcntl
+
+    def _lock_handle(handle):
+        """Verrou exclusif POSIX (flock) sur le fichier"""
+        fcntl.flock(handle.fileno(), fcntl.LOCK_EX)
+
+    def _unlock_handle(handle):
+        fcntl.flock(handle.fileno(), fcntl.LOCK_UN)
+
+class InterProcessLock:
+    """Verrou ré-entrant, exclusif entre threads et entre processus
+
+    Le verrou inter-processus repose sur un fichier compagnon ; il n'est pris
+    qu'au premier niveau d'imbrication d'un thread donné.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._thread_lock = threading.RLock()
+        self._depth = 0
+        self._handle = None
+
+    def acquire(self):
+        self._thread_lock.acquire()
+        if self._depth == 0:
+            try:
+                handle = open(self.path, 'a+')
+                try:
+                    _lock_handle(handle)
+                except Exception:
+                    handle.close()
+                    raise
+                self._handle = handle
+            except Exception:
+                self._thread_lock.release()
+                raise
+        self._depth += 1
+
+    def release(self):
+        self._depth -= 1
+        if self._depth == 0:
+            try:
+                _unlock_handle(self._handle)
+            finally:
+                self._handle.close()
+                self._handle = None
+        self._thread_lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+        return False
+
+def atomic_write_json(path, data, indent=2):
+    """Écrit un fichier JSON via un fichier temporaire puis os.replace
+
+    Les lecteurs sans verrou voient toujours soit l'ancienne, soit la nouvelle
+    version complète, jamais un fichier partiellement écrit.
+    """
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f, indent=indent, default=str)
+        f.flush()
+        os.fsync(f.fileno())
+    for attempt in range(20):
+        try:
+            os.replace(tmp_path, path)
+            return
+        except PermissionError:
+            # Windows refuse le remplacement tant qu'un lecteur garde le fichier ouvert
+            time.sleep(0.05 * (attempt + 1))
+    os.replace(tmp_path, path)
@@ -6,122 +6,167 @@ if current_dir not in sys.path:
     sys.path.insert(0, current_dir)
 
 import requests
-import json
-import random
-import string
-from datetime import datetime, timedelta
+import time
+import threading
+from collections import deque
+from datetime import datetime, timezone
+
+import providers
+
+try:
+    from config import TOKEN_MIN_VALIDITY_SECONDS
+except ImportError:
+    TOKEN_MIN_VALIDITY_SECONDS = 30
 
 try:
-    from config import API
+    from config import WAIT_METRICS_WINDOW
 except ImportError:
-    API = "https://api.mail.tm"
+    WAIT_METRICS_WINDOW = 200
+
+try:
+    from config import STORE_RAW_SOURCES
+except ImportError:
+    # Une requête de plus par message : sources .eml téléchargées à la demande par défaut
+    STORE_RAW_SOURCES = False
 
 storage = None
+reservoir = None
+dispatcher = providers.build_dispatcher()
 
 def set_storage(storage_instance):
     global storage
     storage = storage_instance
 
-def create_account():
+def set_reservoir(reservoir_instance):
+    """Branche une réserve de comptes pré-créés (account_pool) sur create_account"""
+    global reservoir
+    reservoir = reservoir_instance
+
+def provider_for(account):
+    """Fournisseur propriétaire d'un compte stocké"""
+    return dispatcher.get(account.get('provider') if account else None)
+
+def mark_account_used(account_id):
+    """Note l'utilisation d'un compte (garde son token renouvelé) ; sans effet en cas d'échec"""
+    if not storage:
+        return
+    try:
+        storage.mark_account_used(account_id)
+    except Exception:
+        pass
+
+def token_providers():
+    """Noms des fournisseurs dont les comptes ont besoin d'un token"""
+    return [name for name, provider in dispatcher.providers.items() if provider.requires_token]
+
+# Fonctions Mail.tm historiques, conservées pour les appelants existants
+
+def get_domains():
+    """Domaines Mail.tm, mis en cache DOMAINS_CACHE_SECONDS secondes"""
+    return dispatcher.get("mailtm").get_domains()
+
+token_expiry = providers.MailTmProvider.token_expiry
+
+def request_token(address, password, provider=None):
+    """Obtient un token (Mail.tm par défaut) ; retourne (token, échéance) ou None"""
+    return dispatcher.get(provider).authenticate(address, password)
+
+def create_account(provider=None):
+    """Retourne un compte prêt : pris dans la réserve si elle en a un, sinon créé à la demande
+
+    La réserve sert les demandes sans `provider` et celles de son propre
+    fournisseur ; sinon le Dispatcher choisit (latence, budget de débit).
+    """
+    if reservoir and provider in (None, reservoir.provider):
+        account = reservoir.take()
+        if account:
+            # Créé parfois longtemps avant : son activité commence à l'attribution
+            mark_account_used(account['db_id'])
+            return account
+    return create_fresh_account(provider=provider)
+
+def create_fresh_account(pooled=False, provider=None):
+    """Crée, authentifie et enregistre un compte (`pooled` : mis en réserve)
+
+    Si le fournisseur choisi échoue, les autres sont essayés dans l'ordre du
+    Dispatcher ; un `provider` explicite n'est pas remplacé.
+    """
     if not storage:
         return None
-        
+
+    candidates = [dispatcher.get(provider)] if provider else dispatcher.candidates()
+    for mail_provider in candidates:
+        if not mail_provider:
+            continue
+        try:
+            account = _create_with(mail_provider, pooled)
+        except Exception:
+            account = None
+        if account:
+            return account
+    return None
+
+def _create_with(mail_provider, pooled):
     try:
-        domains_response = requests.get(f"{API}/domains", timeout=10)
-        if domains_response.status_code != 200:
-            return None
-            
-        domains_data = domains_response.json()
-        
-        if 'hydra:member' in domains_data:
-            domains = domains_data['hydra:member']
-        elif isinstance(domains_data, list):
-            domains = domains_data
-        else:
-            return None
-        
-        if not domains:
-            return None
-            
-        domain = domains[0]['domain']
-        
-        username = ''.join(random.choices(string.ascii_lowercase + string.digits, k=10))
-        email = f"{username}@{domain}"
-        password = ''.join(random.choices(string.ascii_letters + string.digits, k=12))
-        
-        create_data = {
-            "address": email,
-            "password": password
-        }
-        
-        headers = {
-            "Content-Type": "application/json",
-            "Accept": "application/json"
-        }
-        
-        create_response = requests.post(f"{API}/accounts", json=create_data, headers=headers, timeout=15)
-        
-        if create_response.status_code != 201:
-            return None
-            
-        account_data = create_response.json()
-        
+        account_data = mail_provider.create_mailbox()
+    except requests.RequestException:
+        return None
+    if not account_data:
+        return None
+    email = account_data['address']
+    password = account_data.pop('password', None)
+
+    # Token demandé avant les écritures : compte et token sont enregistrés sur une seule connexion
+    token_info = None
+    if mail_provider.requires_token:
         try:
-            account_id = storage.save_account(email, password)
+            token_info = mail_provider.authenticate(email, password)
+        except requests.RequestException:
+            token_info = None
+
+    with storage.session():
+        try:
+            account_id = storage.save_account(email, password, pooled=pooled, provider=mail_provider.name)
             account_data['db_id'] = account_id
+            account_data['provider'] = mail_provider.name
         except Exception:
             return None
-        
-        token_data = {
-            "address": email,
-            "password": password
-        }
-        
-        token_response = requests.post(f"{API}/token", json=token_data, headers=headers, timeout=10)
-        
-        if token_response.status_code == 200:
-            token_info = token_response.json()
+
+        if token_info:
             try:
-                storage.save_token(account_id, token_info['token'])
+                storage.save_token(account_id, token_info[0], expires_at=token_info[1])
             except Exception:
                 pass
-            
-        return account_data
-        
-    except requests.RequestException:
-        return None
-    except Exception:
-        return None
 
-def refresh_token_if_needed(account_id):
+    return account_data
+
+def refresh_token_if_needed(account_id, account=None):
+    """Garantit un token valide aux comptes qui en ont besoin ; True si le compte est utilisable"""
     if not storage:
         return False
         
     try:
-        current_token = storage.get_valid_token(account_id)
+        if account is not None and not provider_for(account).requires_token:
+            return True
+
+        # Un token sur le point d'expirer est renouvelé avant d'échouer en cours de requête
+        current_token = storage.get_valid_token(account_id, min_validity_seconds=TOKEN_MIN_VALIDITY_SECONDS)
         if current_token:
             return True
         
-        account = storage.get_account_by_id(account_id)
+        if account is None:
+            account = storage.get_account_by_id(account_id)
         if not account:
             return False
+        mail_provider = provider_for(account)
+        if not mail_provider.requires_token:
+            return True
         
-        token_data = {
-            "address": account['email'],
-            "password": account['password']
-        }
-        
-        headers = {
-            "Content-Type": "application/json",
-            "Accept": "application/json"
-        }
-        
-        token_response = requests.post(f"{API}/token", json=token_data, headers=headers, timeout=10)
-        if token_response.status_code != 200:
+        token_info = mail_provider.authenticate(account['email'], account['password'])
+        if not token_info:
             return False
         
-        token_info = token_response.json()
-        storage.save_token(account_id, token_info['token'])
+        storage.save_token(account_id, token_info[0], expires_at=token_info[1])
         return True
         
     except requests.RequestException:
@@ -129,57 +174,54 @@ def refresh_token_if_needed(account_id):
     except Exception:
         return False
 
+def list_messages(token):
+    """Liste légère des messages Mail.tm (sans corps) ; None en cas d'échec"""
+    return dispatcher.get("mailtm").list_messages(None, token)
+
 def fetch_and_store_messages(account_id):
     if not storage:
         return 0
         
     try:
-        if not refresh_token_if_needed(account_id):
-            return 0
-        
-        token = storage.get_valid_token(account_id)
-        account = storage.get_account_by_id(account_id)
-        
-        if not token or not account:
-            return 0
-        
-        headers = {
-            "Authorization": f"Bearer {token}",
-            "Accept": "application/json"
-        }
-        
-        messages_response = requests.get(f"{API}/messages", headers=headers, timeout=15)
-        
-        if messages_response.status_code != 200:
-            return 0
-        
-        messages_data = messages_response.json()
+        # Lectures regroupées sur une connexion, rendue avant les appels HTTP
+        with storage.session():
+            account = storage.get_account_by_id(account_id)
+            if not account or not refresh_token_if_needed(account_id, account):
+                return 0
+            
+            mail_provider = provider_for(account)
+            token = storage.get_valid_token(account_id) if mail_provider.requires_token else None
+            if mail_provider.requires_token and not token:
+                return 0
+            
+            known_ids = storage.get_message_ids(account_id)
         
-        if 'hydra:member' in messages_data:
-            messages = messages_data['hydra:member']
-        elif isinstance(messages_data, list):
-            messages = messages_data
-        else:
+        messages = mail_provider.list_messages(account['email'], token)
+        if messages is None:
             return 0
         
-        new_messages_count = 0
-        
+        # Seuls les messages inconnus sont téléchargés en entier
+        full_messages = []
         for message in messages:
-            full_message = get_message_content(message['id'], token)
+            if message.get('id') in known_ids:
+                continue
+            full_message = _get_message(mail_provider, account, message['id'], token)
             if full_message:
+                # Pièces jointes écrites sur disque avant l'email, qui les référence
+                full_messages.append((full_message, _store_attachments(mail_provider, account, full_message, token)))
+        
+        new_messages_count = 0
+        with storage.session():
+            for full_message, attachments in full_messages:
                 try:
-                    saved_id = storage.save_received_email(
-                        account_id=account_id,
-                        sender=full_message.get('from', {}).get('address', 'Inconnu'),
-                        recipient=full_message.get('to', [{}])[0].get('address', account['email']),
-                        subject=full_message.get('subject', 'Sans sujet'),
-                        body=full_message.get('text', full_message.get('html', '')),
-                        message_id=full_message.get('id')
-                    )
+                    saved_id = storage.save_received_email(account_id=account_id, attachments=attachments,
+                                                           **mail_provider.message_fields(full_message, account))
                     if saved_id:
                         new_messages_count += 1
                 except Exception:
                     continue
+        if new_messages_count:
+            mark_account_used(account_id)
         
         return new_messages_count
         
@@ -188,19 +230,213 @@ def fetch_and_store_messages(account_id):
     except Exception:
         return 0
 
-def get_message_content(message_id, token):
+# Métriques de wait_for_message : délai entre l'arrivée chez le fournisseur et le retour
+_wait_lock = threading.Lock()
+_wait_latencies = deque(maxlen=WAIT_METRICS_WINDOW)
+_wait_stats = {"matched": 0, "timeouts": 0, "polls": 0, "bodies_fetched": 0}
+
+def _parse_api_datetime(value):
+    """Convertit une date ISO 8601 de l'API en datetime UTC (None si illisible)"""
+    if not value:
+        return None
     try:
-        headers = {
-            "Authorization": f"Bearer {token}",
-            "Accept": "application/json"
-        }
-        response = requests.get(f"{API}/messages/{message_id}", headers=headers, timeout=10)
-        
-        if response.status_code == 200:
-            return response.json()
+        parsed = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    except ValueError:
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed
+
+def _record_wait(matched, polls, bodies_fetched, latency=None):
+    with _wait_lock:
+        _wait_stats["matched" if matched else "timeouts"] += 1
+        _wait_stats["polls"] += polls
+        _wait_stats["bodies_fetched"] += bodies_fetched
+        if latency is not None:
+            _wait_latencies.append(latency)
+
+def get_wait_metrics():
+    """Statistiques de wait_for_message (latences en secondes sur les derniers appels)"""
+    with _wait_lock:
+        stats = dict(_wait_stats)
+        latencies = sorted(_wait_latencies)
+    if latencies:
+        stats["latency_p50"] = round(latencies[len(latencies) // 2], 3)
+        stats["latency_p95"] = round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))], 3)
+        stats["latency_max"] = round(latencies[-1], 3)
+    return stats
+
+def wait_for_message(account_id, predicate=None, timeout=60, initial_interval=0.25,
+                     max_interval=5.0, backoff=1.5, since=None):
+    """Bloque jusqu'à l'arrivée d'un nouveau message satisfaisant `predicate`
+
+    Seuls les messages arrivés chez le fournisseur (`createdAt`) à partir de
+    `since` (par défaut, le début de l'appel) sont considérés, même s'ils
+    précèdent la première liste obtenue ; un message sans date présent dans
+    cette première liste est tenu pour ancien. Chaque tour
+    interroge la liste légère /messages ; le corps n'est téléchargé (et stocké)
+    que pour les IDs inconnus, puis `predicate(email)` est évalué sur le dict
+    stocké (sender, recipient, subject, body, message_id). L'intervalle démarre
+    à `initial_interval` puis croît d'un facteur `backoff` jusqu'à
+    `max_interval`. Retourne l'email correspondant, complété de `latency`
+    (secondes entre l'arrivée chez le fournisseur et le retour), ou None au délai.
+    """
+    if not storage:
+        return None
+    
+    if since is None:
+        since = datetime.now(timezone.utc)
+    elif since.tzinfo is None:
+        since = since.astimezone(timezone.utc)
+    deadline = time.monotonic() + timeout
+    interval = initial_interval
+    polls = 0
+    bodies_fetched = 0
+    token = None
+    ready = False
+    account = storage.get_account_by_id(account_id)
+    if not account:
+        return None
+    mark_account_used(account_id)
+    mail_provider = provider_for(account)
+    
+    seen_ids = set()
+    listed = False
+    while True:
+        try:
+            if not ready:
+                ready = refresh_token_if_needed(account_id, account)
+                if ready and mail_provider.requires_token:
+                    token = storage.get_valid_token(account_id)
+                    ready = bool(token)
+            messages = mail_provider.list_messages(account['email'], token) if ready else None
+        except requests.RequestException:
+            messages = None
+        polls += 1
+        
+        if messages is None:
+            ready = False  # Jeton expiré ou erreur passagère : renouvelé au tour suivant
         else:
+            stored_ids = None
+            first_listing = not listed
+            listed = True
+            for message in messages:
+                message_id = message.get('id')
+                if message_id in seen_ids:
+                    continue
+                seen_ids.add(message_id)
+                arrived_at = _parse_api_datetime(message.get('createdAt'))
+                # Sans date, seule la première liste fait foi de ce qui précède l'appel
+                previous = arrived_at < since if arrived_at else first_listing
+                if previous:
+                    continue
+                if stored_ids is None:
+                    stored_ids = storage.get_message_ids(account_id)
+                
+                if message_id in stored_ids:
+                    # Déjà stocké par une synchronisation concurrente
+                    email = storage.get_received_email_by_message_id(account_id, message_id)
+                else:
+                    full_message = _get_message(mail_provider, account, message_id, token)
+                    if not full_message:
+                        seen_ids.discard(message_id)  # Nouvelle tentative au tour suivant
+                        continue
+                    bodies_fetched += 1
+                    email = mail_provider.message_fields(full_message, account)
+                    attachments = _store_attachments(mail_provider, account, full_message, token)
+                    try:
+                        saved_id = storage.save_received_email(account_id=account_id, attachments=attachments, **email)
+                    except Exception:
+                        saved_id = None
+                    email["account_id"] = account_id
+                    if saved_id is not True:
+                        email["id"] = saved_id
+                
+                if email and (predicate is None or predicate(email)):
+                    latency = None
+                    if arrived_at:
+                        latency = max(0.0, (datetime.now(timezone.utc) - arrived_at).total_seconds())
+                    _record_wait(True, polls, bodies_fetched, latency)
+                    return dict(email, latency=latency, polls=polls)
+        
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            _record_wait(False, polls, bodies_fetched)
+            return None
+        time.sleep(min(interval, remaining))
+        interval = min(interval * backoff, max_interval)
+
+def _get_message(mail_provider, account, message_id, token):
+    try:
+        return mail_provider.get_message(account['email'], message_id, token)
+    except requests.RequestException:
+        return None
+    except Exception:
+        return None
+
+def _stream_to_store(chunks, **metadata):
+    """Écrit un flux dans content_store ; métadonnées de pièce jointe, ou None"""
+    if chunks is None:
+        return None
+    stored = storage.content_store.put_stream(chunks)
+    if not stored:
+        return None  # Au-delà de ATTACHMENT_MAX_BYTES
+    content_hash, size = stored
+    return dict(metadata, size=size, content_hash=content_hash)
+
+def _store_attachments(mail_provider, account, full_message, token):
+    """Télécharge par morceaux les pièces jointes (et la source si STORE_RAW_SOURCES) d'un message"""
+    stored = []
+    for attachment in mail_provider.attachments(full_message):
+        try:
+            metadata = _stream_to_store(
+                mail_provider.stream_attachment(account['email'], attachment, token),
+                kind="attachment", filename=attachment.get('filename'), content_type=attachment.get('content_type')
+            )
+        except Exception:
+            metadata = None
+        if metadata:
+            stored.append(metadata)
+    if STORE_RAW_SOURCES:
+        message_id = full_message.get('id')
+        try:
+            metadata = _stream_to_store(
+                mail_provider.stream_source(account['email'], message_id, token, full_message=full_message),
+                kind="source", filename=f"{message_id}.eml", content_type="message/rfc822"
+            )
+        except Exception:
+            metadata = None
+        if metadata:
+            stored.append(metadata)
+    return stored
+
+def download_source(email):
+    """Télécharge à la demande la source .eml d'un email stocké et la rattache ; métadonnées ou None"""
+    if not storage or not email.get('message_id'):
+        return None
+    try:
+        account = storage.get_account_by_id(email['account_id'])
+        if not account or not refresh_token_if_needed(account['id'], account):
             return None
+        mail_provider = provider_for(account)
+        token = storage.get_valid_token(account['id']) if mail_provider.requires_token else None
+        metadata = _stream_to_store(
+            mail_provider.stream_source(account['email'], email['message_id'], token),
+            kind="source", filename=f"{email['message_id']}.eml", content_type="message/rfc822"
+        )
+        if metadata:
+            storage.add_email_attachment(email['id'], account['id'], metadata)
+        return metadata
     except requests.RequestException:
         return None
     except Exception:
-        return None
\ No newline at end of file
+        return None
+
+def get_message_content(message_id, token):
+    """Message complet Mail.tm, ou None"""
+    try:
+        return dispatcher.get("mailtm").get_message(None, message_id, token)
+    except requests.RequestException:
+        return None
+    except Exception:
+        return None
@@ -1,6 +1,9 @@
 import sys
 import os
+import subprocess
+import tempfile
 import traceback
+from datetime import datetime
 
 current_dir = os.path.dirname(os.path.abspath(__file__))
 if current_dir not in sys.path:
@@ -17,10 +20,26 @@ except ImportError as e:
     messagebox.showerror("Erreur", "Module customtkinter manquant. Installez avec: pip install customtkinter")
     sys.exit(1)
 
+import profiling
+
+# Comptes affichés au plus dans la fenêtre de restauration
+RESTORE_PAGE_SIZE = 20
+
 storage = None
 create_account = None
 fetch_and_store_messages = None
 refresh_token_if_needed = None
+mark_account_used = None
+download_source = None
+retention_engine = None
+token_refresher = None
+account_reservoir = None
+
+try:
+    # Avant l'import des fonctions de mail_api, pour qu'elles soient instrumentées
+    profiling.install_from_env()
+except Exception as e:
+    pass
 
 try:
     import storage as storage_module
@@ -28,16 +47,36 @@ try:
 except Exception as e:
     storage = None
 
+try:
+    import retention
+    retention_engine = retention.start_from_config(storage)
+except Exception as e:
+    retention_engine = None
+
 try:
     import mail_api
     create_account = getattr(mail_api, 'create_account', None)
     fetch_and_store_messages = getattr(mail_api, 'fetch_and_store_messages', None)
     refresh_token_if_needed = getattr(mail_api, 'refresh_token_if_needed', None)
+    mark_account_used = getattr(mail_api, 'mark_account_used', None)
+    download_source = getattr(mail_api, 'download_source', None)
     if hasattr(mail_api, 'set_storage') and storage:
         mail_api.set_storage(storage)
 except Exception as e:
     pass
 
+try:
+    import token_refresher as token_refresher_module
+    token_refresher = token_refresher_module.start_from_config(storage)
+except Exception as e:
+    token_refresher = None
+
+try:
+    import account_pool
+    account_reservoir = account_pool.start_from_config(storage)
+except Exception as e:
+    account_reservoir = None
+
 class MailGeneratorApp(ctk.CTk):
     def __init__(self):
         super().__init__()
@@ -115,12 +154,13 @@ class MailGeneratorApp(ctk.CTk):
         self.token_info_label = ctk.CTkLabel(tab, text="", font=ctk.CTkFont(size=12))
         self.token_info_label.pack(pady=10)
 
-    def create_tm_email(self):
+    def create_tm_email(self, provider="mailtm"):
         if not create_account:
             messagebox.showerror("Erreur", "Module mail_api non disponible")
             return
             
-        account = create_account()
+        with profiling.cycle("create"):
+            account = create_account(provider=provider)
         
         if not account:
             messagebox.showerror("Erreur", "Impossible de créer le compte")
@@ -145,7 +185,8 @@ class MailGeneratorApp(ctk.CTk):
             return
             
         try:
-            accounts = storage.get_all_accounts()
+            # Première page seulement : la liste suit ensuite la saisie
+            accounts = storage.search_accounts("", limit=RESTORE_PAGE_SIZE + 1)
             if not accounts:
                 messagebox.showinfo("Information", "Aucun compte sauvegardé")
                 return
@@ -153,22 +194,54 @@ class MailGeneratorApp(ctk.CTk):
             # Créer une fenêtre de sélection
             restore_window = ctk.CTkToplevel(self)
             restore_window.title("Restaurer un compte")
-            restore_window.geometry("500x300")
+            restore_window.geometry("500x400")
             
             label = ctk.CTkLabel(restore_window, text="Sélectionnez un compte à restaurer:")
             label.pack(pady=10)
             
+            search_var = ctk.StringVar()
+            search_entry = ctk.CTkEntry(restore_window, width=460, textvariable=search_var,
+                                        placeholder_text="Tapez une partie de l'adresse...")
+            search_entry.pack(padx=20)
+            search_entry.focus()
+            
             # Liste des comptes
-            accounts_frame = ctk.CTkScrollableFrame(restore_window, width=460, height=200)
+            accounts_frame = ctk.CTkScrollableFrame(restore_window, width=460, height=260)
             accounts_frame.pack(pady=10, padx=20)
             
-            for account in accounts:
-                account_btn = ctk.CTkButton(
-                    accounts_frame,
-                    text=f"{account['email']} (créé le {account.get('created_at', 'N/A')})",
-                    command=lambda acc=account: self.do_restore_account(acc, restore_window)
-                )
-                account_btn.pack(pady=5, fill="x")
+            state = {"pending": None}
+            
+            def show(page):
+                for widget in accounts_frame.winfo_children():
+                    widget.destroy()
+                for account in page[:RESTORE_PAGE_SIZE]:
+                    account_btn = ctk.CTkButton(
+                        accounts_frame,
+                        text=f"{account['email']} (créé le {account.get('created_at', 'N/A')})",
+                        command=lambda acc=account: self.do_restore_account(acc, restore_window)
+                    )
+                    account_btn.pack(pady=5, fill="x")
+                if not page:
+                    ctk.CTkLabel(accounts_frame, text="Aucun compte ne correspond").pack(pady=10)
+                elif len(page) > RESTORE_PAGE_SIZE:
+                    ctk.CTkLabel(accounts_frame, text=f"{RESTORE_PAGE_SIZE} premiers comptes affichés : précisez la recherche",
+                                 font=ctk.CTkFont(size=11)).pack(pady=5)
+            
+            def search():
+                state["pending"] = None
+                try:
+                    show(storage.search_accounts(search_var.get(), limit=RESTORE_PAGE_SIZE + 1))
+                except Exception as e:
+                    messagebox.showerror("Erreur", f"Erreur lors de la recherche: {e}")
+            
+            def on_change(*args):
+                # Une requête par pause de frappe, pas une par touche
+                if state["pending"]:
+                    restore_window.after_cancel(state["pending"])
+                state["pending"] = restore_window.after(150, search)
+            
+            search_var.trace_add("write", on_change)
+            show(accounts)
                 
         except Exception as e:
             messagebox.showerror("Erreur", f"Erreur lors de la récupération des comptes: {e}")
@@ -181,6 +254,8 @@ class MailGeneratorApp(ctk.CTk):
         try:
             success = refresh_token_if_needed(account['id'])
             if success:
+                if mark_account_used:
+                    mark_account_used(account['id'])
                 self.tm_var.set(account['email'])
                 messagebox.showinfo("Succès", f"Compte {account['email']} restauré avec succès")
                 window.destroy()
@@ -193,9 +268,20 @@ class MailGeneratorApp(ctk.CTk):
     def init_maildrop_tab(self):
         tab = self.sub_tabview.tab("Maildrop")
         
-        info_label = ctk.CTkLabel(tab, text="Fonctionnalité Maildrop en développement", 
-                                 font=ctk.CTkFont(size=16, weight="bold"))
-        info_label.pack(pady=50)
+        self.md_create_btn = ctk.CTkButton(tab, text="Créer une adresse Maildrop", width=250, fg_color="#4A90E2",
+                                           command=lambda: self.create_tm_email(provider="maildrop"))
+        self.md_create_btn.pack(pady=10)
+
+        # Même compte connecté que l'onglet Mail.tm : la consultation suit le fournisseur du compte
+        self.md_entry = ctk.CTkEntry(tab, width=400, height=35, textvariable=self.tm_var, state="readonly")
+        self.md_entry.pack(pady=5)
+
+        self.md_copy_btn = ctk.CTkButton(tab, text="📋 Copier l'email", command=self.copy_tm_email)
+        self.md_copy_btn.pack(pady=5)
+
+        info_label = ctk.CTkLabel(tab, text="Boîte publique : sans mot de passe, lisible par quiconque connaît l'adresse",
+                                  font=ctk.CTkFont(size=12))
+        info_label.pack(pady=20)
 
     def init_consult_tab(self):
         tab = self.tabview.tab("Consulter Mails")
@@ -212,6 +298,21 @@ class MailGeneratorApp(ctk.CTk):
                                  command=self.clear_emails)
         clear_btn.pack(side="left", padx=10, pady=10)
         
+        # Recherche plein texte (sujet, expéditeur, corps)
+        self.search_var = ctk.StringVar()
+        self.search_all_var = ctk.BooleanVar(value=False)
+        search_entry = ctk.CTkEntry(controls_frame, width=300, textvariable=self.search_var,
+                                    placeholder_text="Rechercher dans les emails...")
+        search_entry.pack(side="left", padx=10, pady=10)
+        search_entry.bind("<Return>", lambda event: self.load_emails())
+        
+        search_btn = ctk.CTkButton(controls_frame, text="🔍 Rechercher", width=120,
+                                   command=self.load_emails)
+        search_btn.pack(side="left", padx=5, pady=10)
+        
+        ctk.CTkCheckBox(controls_frame, text="Tous les comptes",
+                        variable=self.search_all_var).pack(side="left", padx=10, pady=10)
+        
         # Liste des emails
         self.emails_frame = ctk.CTkScrollableFrame(tab, width=1050, height=500)
         self.emails_frame.pack(pady=10, padx=10, fill="both", expand=True)
@@ -236,7 +337,8 @@ class MailGeneratorApp(ctk.CTk):
                 return
                 
             if fetch_and_store_messages:
-                new_count = fetch_and_store_messages(account['id'])
+                with profiling.cycle("sync"):
+                    new_count = fetch_and_store_messages(account['id'])
                 if new_count > 0:
                     messagebox.showinfo("Actualisation", f"{new_count} nouveaux emails récupérés")
                 else:
@@ -254,6 +356,10 @@ class MailGeneratorApp(ctk.CTk):
             widget.destroy()
             
     def load_emails(self):
+        with profiling.span("load_emails", "gui"):
+            self._load_emails()
+
+    def _load_emails(self):
         if not storage:
             no_storage_label = ctk.CTkLabel(self.emails_frame, 
                                            text="❌ Système de stockage non disponible",
@@ -264,6 +370,11 @@ class MailGeneratorApp(ctk.CTk):
         try:
             self.clear_emails()
             
+            query = self.search_var.get().strip()
+            if query and self.search_all_var.get():
+                self.show_search_results(query, None)
+                return
+            
             connected_email = self.tm_var.get().strip()
             if not connected_email:
                 no_account_label = ctk.CTkLabel(self.emails_frame, 
@@ -280,6 +391,10 @@ class MailGeneratorApp(ctk.CTk):
                 no_account_label.pack(pady=20)
                 return
             
+            if query:
+                self.show_search_results(query, account['id'])
+                return
+            
             emails = storage.get_received_emails_by_account(account['id'])
             
             if not emails:
@@ -289,23 +404,7 @@ class MailGeneratorApp(ctk.CTk):
                 no_email_label.pack(pady=20)
                 return
                 
-            for email in emails[:50]:
-                email_frame = ctk.CTkFrame(self.emails_frame)
-                email_frame.pack(fill="x", padx=5, pady=5)
-                
-                subject = email.get('subject', 'Sans sujet')[:60]
-                sender = email.get('sender', 'Expéditeur inconnu')
-                date = str(email.get('received_at', 'Date inconnue'))[:19]
-                
-                info_text = f"📧 {subject} | De: {sender} | {date}"
-                
-                email_label = ctk.CTkLabel(email_frame, text=info_text, 
-                                          font=ctk.CTkFont(size=12))
-                email_label.pack(side="left", padx=10, pady=5)
-                
-                view_btn = ctk.CTkButton(email_frame, text="Voir", width=60,
-                                        command=lambda e=email: self.view_email_detail(e))
-                view_btn.pack(side="right", padx=10, pady=5)
+            self.show_email_rows(emails[:50])
                 
         except Exception as e:
             error_label = ctk.CTkLabel(self.emails_frame, 
@@ -313,6 +412,43 @@ class MailGeneratorApp(ctk.CTk):
                                       font=ctk.CTkFont(size=14))
             error_label.pack(pady=20)
     
+    def show_search_results(self, query, account_id):
+        page = storage.search_emails(query, account_id=account_id, limit=50)
+        summary = f"{page['total']} résultat(s) pour « {query} »"
+        if page['total'] > len(page['results']):
+            summary += f" — {len(page['results'])} plus pertinents affichés"
+        ctk.CTkLabel(self.emails_frame, text=summary, font=ctk.CTkFont(size=13, weight="bold")).pack(
+            anchor="w", padx=10, pady=5)
+        self.show_email_rows([result['email'] for result in page['results']])
+    
+    def show_email_rows(self, emails):
+        for email in emails:
+            email_frame = ctk.CTkFrame(self.emails_frame)
+            email_frame.pack(fill="x", padx=5, pady=5)
+            
+            subject = email.get('subject', 'Sans sujet')[:60]
+            sender = email.get('sender', 'Expéditeur inconnu')
+            date = str(email.get('received_at', 'Date inconnue'))[:19]
+            
+            info_text = f"📧 {subject} | De: {sender} | {date}"
+            
+            text_frame = ctk.CTkFrame(email_frame, fg_color="transparent")
+            text_frame.pack(side="left", fill="x", expand=True, padx=10, pady=5)
+            
+            email_label = ctk.CTkLabel(text_frame, text=info_text, 
+                                      font=ctk.CTkFont(size=12))
+            email_label.pack(anchor="w")
+            
+            # Aperçu calculé à l'ingestion : la liste n'a pas à lire les corps
+            if email.get('preview'):
+                preview_label = ctk.CTkLabel(text_frame, text=email['preview'],
+                                            font=ctk.CTkFont(size=11), text_color="gray")
+                preview_label.pack(anchor="w")
+            
+            view_btn = ctk.CTkButton(email_frame, text="Voir", width=60,
+                                    command=lambda e=email: self.view_email_detail(e))
+            view_btn.pack(side="right", padx=10, pady=5)
+    
     def view_email_detail(self, email):
         detail_window = ctk.CTkToplevel(self)
         detail_window.title("Détail de l'email")
@@ -334,11 +470,69 @@ class MailGeneratorApp(ctk.CTk):
         content_frame = ctk.CTkScrollableFrame(detail_window, width=650, height=350)
         content_frame.pack(pady=10, padx=10, fill="both", expand=True)
         
-        content_text = email.get('body', 'Contenu non disponible')
+        # Texte brut précalculé pour les corps HTML, le corps lui-même sinon
+        content_text = email.get('body_text') or email.get('body') or 'Contenu non disponible'
         content_label = ctk.CTkLabel(content_frame, text=content_text, 
                                     font=ctk.CTkFont(size=12), wraplength=600,
                                     justify="left")
         content_label.pack(anchor="w", padx=10, pady=10)
+        
+        self.show_email_attachments(detail_window, email)
+
+    def show_email_attachments(self, window, email):
+        """Liste des pièces jointes : seules les métadonnées sont lues, le fichier à l'ouverture"""
+        if not storage or email.get('id') is None:
+            return
+        try:
+            attachments = storage.get_email_attachments(email['id'], email.get('account_id'))
+        except Exception:
+            attachments = []
+        
+        files_frame = ctk.CTkFrame(window)
+        files_frame.pack(fill="x", padx=10, pady=(0, 10))
+        
+        source = None
+        for attachment in attachments:
+            if attachment['kind'] == "source":
+                source = attachment
+                continue
+            size_kb = (attachment.get('size') or 0) / 1024
+            row = ctk.CTkFrame(files_frame)
+            row.pack(fill="x", padx=5, pady=2)
+            ctk.CTkLabel(row, text=f"📎 {attachment.get('filename') or 'pièce jointe'} ({size_kb:.1f} Ko)").pack(
+                side="left", padx=10)
+            ctk.CTkButton(row, text="Ouvrir", width=80,
+                          command=lambda a=attachment: self.open_stored_file(a)).pack(side="right", padx=5)
+        
+        ctk.CTkButton(files_frame, text="📄 Ouvrir la source .eml", width=200,
+                      command=lambda: self.open_email_source(email, source)).pack(anchor="w", padx=5, pady=5)
+
+    def open_email_source(self, email, source=None):
+        if source is None:
+            if not download_source:
+                messagebox.showerror("Erreur", "Module mail_api non disponible")
+                return
+            source = download_source(email)
+            if not source:
+                messagebox.showerror("Erreur", "Source du message indisponible")
+                return
+        self.open_stored_file(source)
+
+    def open_stored_file(self, attachment):
+        """Copie le contenu sous son nom d'origine dans un dossier temporaire puis l'ouvre"""
+        try:
+            path = storage.content_store.export(
+                attachment['content_hash'], attachment.get('filename'),
+                os.path.join(tempfile.gettempdir(), "generateur_mails", attachment['content_hash'][:12])
+            )
+            if sys.platform.startswith("win"):
+                os.startfile(path)
+            elif sys.platform == "darwin":
+                subprocess.Popen(["open", path])
+            else:
+                subprocess.Popen(["xdg-open", path])
+        except Exception as e:
+            messagebox.showerror("Erreur", f"Impossible d'ouvrir le fichier: {e}")
 
     def init_tokens_tab(self):
         tab = self.tabview.tab("Gestion Tokens")
@@ -374,8 +568,10 @@ class MailGeneratorApp(ctk.CTk):
                 return
                 
             active_tokens = 0
+            now = datetime.now()
             for account in accounts:
-                token = storage.get_valid_token(account['id'])
+                # Échéance déjà convertie dans l'enregistrement : pas de relecture par compte
+                token = account.has_valid_token(now)
                 
                 account_frame = ctk.CTkFrame(self.tokens_frame)
                 account_frame.pack(fill="x", padx=5, pady=5)
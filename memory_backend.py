@@ -0,0 +1,498 @@
+import bisect
+import threading
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+from itertools import islice
+
+import migrations
+from extraction import message_metadata
+from records import Account, ReceivedEmail
+from search_index import MemorySearchIndex
+from storage_backend import StorageBackend, content_hash
+
+class MemoryBackend(StorageBackend):
+    """Stockage éphémère en mémoire, indexé pour les accès courants
+
+    Pour les boîtes jetables dont rien ne doit survivre au processus, et
+    comme référence des mesures de performance des autres moteurs. Chaque
+    accès par clé (ID, adresse, message_id, compte) passe par un
+    dictionnaire ; les adresses sont tenues triées pour search_accounts et
+    les IDs d'emails pour les suivis incrémentaux. Un verrou unique
+    sérialise écritures et lectures ; rien n'est partagé entre processus.
+    """
+
+    name = "memory"
+
+    def __init__(self):
+        super().__init__()
+        self._lock = threading.RLock()
+        self._accounts = {}
+        self._account_ids = {}
+        # (adresse en minuscules, ID) des comptes attribués, triés
+        self._address_index = []
+        # Comptes en réserve, dans l'ordre de création (dict ordonné)
+        self._pooled = {}
+        self._emails = {}
+        # IDs d'emails croissants (suivi incrémental par bisection)
+        self._email_ids = []
+        self._emails_by_account = defaultdict(dict)
+        self._message_index = {}
+        # Corps dédupliqués : empreinte -> [contenu, références]
+        self._blobs = {}
+        self._artifacts = defaultdict(list)
+        self._attachments = defaultdict(list)
+        self.search_index = MemorySearchIndex()
+        self._next_account_id = 1
+        self._next_email_id = 1
+
+    def open(self):
+        self.status_message = "Stockage en mémoire"
+        return True, None
+
+    def get_schema_version(self):
+        """Pas de schéma persistant : toujours à jour"""
+        return migrations.LATEST_VERSION
+
+    # --- Comptes
+
+    def _insert_account(self, record):
+        """Enregistre un nouveau compte (sous _lock) et retourne son ID"""
+        account_id = self._next_account_id
+        self._next_account_id += 1
+        record["id"] = account_id
+        self._accounts[account_id] = record
+        self._account_ids[record["email"]] = account_id
+        if record.get("pooled"):
+            self._pooled[account_id] = None
+        else:
+            bisect.insort(self._address_index, (record["email"].lower(), account_id))
+        return account_id
+
+    def _remove_account(self, account):
+        """Retire un compte de tous les index (sous _lock), sans ses emails"""
+        del self._accounts[account["id"]]
+        self._account_ids.pop(account["email"], None)
+        if self._pooled.pop(account["id"], False) is None:
+            return
+        key = (account["email"].lower(), account["id"])
+        position = bisect.bisect_left(self._address_index, key)
+        if position < len(self._address_index) and self._address_index[position] == key:
+            del self._address_index[position]
+
+    def save_account(self, email, password, pooled=False, provider="mailtm"):
+        """Sauvegarde un compte ; un compte existant voit seulement son mot de passe mis à jour"""
+        with self._lock:
+            account_id = self._account_ids.get(email)
+            if account_id is not None:
+                self._accounts[account_id]["password"] = password
+                return account_id
+            return self._insert_account({
+                "email": email,
+                "password": password,
+                "token": None,
+                "token_expires_at": None,
+                "created_at": datetime.now(),
+                "pooled": pooled,
+                "provider": provider
+            })
+
+    def save_accounts_batch(self, accounts):
+        """Sauvegarde un lot de comptes complets (email, password, token, dates)"""
+        if not accounts:
+            return {}
+        with self._lock:
+            saved = {}
+            for account in accounts:
+                account_id = self._account_ids.get(account["email"])
+                if account_id is not None:
+                    existing = self._accounts[account_id]
+                    existing["password"] = account.get("password")
+                    if account.get("token"):
+                        existing["token"] = account["token"]
+                        existing["token_expires_at"] = self._parse_local_datetime(account.get("token_expires_at"))
+                else:
+                    account_id = self._insert_account({
+                        "email": account["email"],
+                        "password": account.get("password"),
+                        "token": account.get("token"),
+                        "token_expires_at": self._parse_local_datetime(account.get("token_expires_at")),
+                        "created_at": self._parse_local_datetime(account.get("created_at")) or datetime.now(),
+                        "pooled": False,
+                        "provider": account.get("provider") or "mailtm"
+                    })
+                saved[account["email"]] = account_id
+            return saved
+
+    def iter_accounts(self, chunk_size=500):
+        """Parcourt tous les comptes, secrets compris, par ordre d'ID croissant"""
+        with self._lock:
+            accounts = [Account.from_row(account) for account in self._accounts.values()]
+        yield from accounts
+
+    def save_token(self, account_id, token, expires_at):
+        """Sauvegarde un token"""
+        with self._lock:
+            account = self._accounts.get(account_id)
+            if account:
+                account["token"] = token
+                account["token_expires_at"] = self._parse_local_datetime(expires_at)
+
+    def save_tokens_batch(self, tokens):
+        """Sauvegarde plusieurs tokens : liste de (account_id, token, expires_at)"""
+        with self._lock:
+            for account_id, token, expires_at in tokens or ():
+                self.save_token(account_id, token, expires_at)
+
+    def clear_token(self, account_id):
+        """Supprime un token"""
+        self.save_token(account_id, None, None)
+
+    def touch_account(self, account_id, used_at):
+        """Enregistre la dernière utilisation réelle d'un compte"""
+        with self._lock:
+            account = self._accounts.get(account_id)
+            if account:
+                account["last_used_at"] = self._parse_local_datetime(used_at)
+
+    def get_accounts_needing_token(self, refresh_before, active_since, limit=500, providers=None):
+        """Comptes actifs dont le token manque ou expire avant `refresh_before`"""
+        if providers is not None and not providers:
+            return []
+        accounts = []
+        with self._lock:
+            for account in self._accounts.values():
+                if providers is not None and account.get("provider", "mailtm") not in providers:
+                    continue
+                expires_at = account.get("token_expires_at")
+                reference = account.get("last_used_at") or account.get("created_at")
+                if reference and reference < active_since:
+                    continue
+                if account.get("token") and expires_at and expires_at >= refresh_before:
+                    continue
+                accounts.append({
+                    "id": account["id"],
+                    "email": account["email"],
+                    "password": account.get("password"),
+                    "token_expires_at": expires_at,
+                    "provider": account.get("provider", "mailtm")
+                })
+        accounts.sort(key=lambda acc: (acc["token_expires_at"] is not None, acc["token_expires_at"] or datetime.min))
+        return accounts[:limit]
+
+    def get_valid_token(self, account_id, min_validity_seconds=0):
+        """Récupère un token valide encore au moins `min_validity_seconds` secondes"""
+        account = self._accounts.get(account_id)
+        if not account or not account.get("token") or not account.get("token_expires_at"):
+            return None
+        threshold = datetime.now() + timedelta(seconds=min_validity_seconds)
+        return account["token"] if account["token_expires_at"] > threshold else None
+
+    def get_all_accounts(self):
+        """Récupère tous les comptes attribués (hors réserve)"""
+        with self._lock:
+            return [Account.from_row(account) for account in self._accounts.values() if not account.get("pooled")]
+
+    def search_accounts(self, text, limit=20):
+        """Comptes attribués dont l'adresse commence par `text` (bisection), puis ceux qui la contiennent"""
+        text = (text or "").strip().lower()
+        with self._lock:
+            keys = self._address_index
+            start = bisect.bisect_left(keys, (text,))
+            found = []
+            for email, account_id in islice(keys, start, None):
+                if not email.startswith(text) or len(found) >= limit:
+                    break
+                found.append(account_id)
+            if len(found) < limit and text:
+                for email, account_id in keys:
+                    if text in email and not email.startswith(text):
+                        found.append(account_id)
+                        if len(found) >= limit:
+                            break
+            return [Account(**{field: self._accounts[account_id].get(field)
+                               for field in ("id", "email", "created_at", "provider")})
+                    for account_id in found]
+
+    def get_pooled_accounts(self, limit=100):
+        """Comptes en réserve, les plus anciens d'abord"""
+        with self._lock:
+            return [Account.from_row(self._accounts[account_id]) for account_id in islice(self._pooled, limit)]
+
+    def claim_pooled_account(self, account_id):
+        """Sort un compte de la réserve ; False s'il a déjà été attribué"""
+        with self._lock:
+            if self._pooled.pop(account_id, False) is not None:
+                return False
+            account = self._accounts[account_id]
+            account["pooled"] = False
+            bisect.insort(self._address_index, (account["email"].lower(), account_id))
+            return True
+
+    def get_account_by_email(self, email):
+        """Récupère un compte par email"""
+        return Account.from_row(self._accounts.get(self._account_ids.get(email)))
+
+    def get_account_by_id(self, account_id):
+        """Récupère un compte par ID"""
+        return Account.from_row(self._accounts.get(account_id))
+
+    def delete_account(self, account_id):
+        """Supprime un compte, ses emails et libère les blobs associés"""
+        with self._lock:
+            account = self._accounts.get(account_id)
+            if not account:
+                return False
+            self._delete_emails(list(self._emails_by_account.get(account_id, ())))
+            self._remove_account(account)
+            return True
+
+    def purge_expired_accounts(self, cutoff, limit=500, providers=None):
+        """Supprime les comptes dont le token a expiré (ou jamais obtenu) et inutilisés depuis `cutoff`, emails d'abord"""
+        if providers is not None and not providers:
+            return 0
+        with self._lock:
+            expired = [account for account in self._accounts.values()
+                       if (providers is None or account.get("provider", "mailtm") in providers)
+                       and (account.get("token_expires_at") or account.get("created_at") or cutoff) < cutoff
+                       and (account.get("last_used_at") or account.get("created_at") or cutoff) < cutoff]
+            doomed_ids = []
+            for account in expired:
+                doomed_ids.extend(islice(self._emails_by_account.get(account["id"], ()), limit - len(doomed_ids)))
+                if len(doomed_ids) >= limit:
+                    break
+            deleted = self._delete_emails(doomed_ids)
+            for account in expired:
+                if deleted >= limit:
+                    break
+                if account["id"] not in self._emails_by_account:
+                    self._remove_account(account)
+                    deleted += 1
+            return deleted
+
+    # --- Emails
+
+    def _email_record(self, email):
+        blob = self._blobs.get(email["body_hash"])
+        return ReceivedEmail(body=blob[0] if blob else "", **email)
+
+    def save_received_emails(self, rows):
+        """Sauvegarde un lot d'emails et retourne leurs IDs (None si doublon)"""
+        with self._lock:
+            saved_ids = []
+            indexed = []
+            for row in rows:
+                account_id = row["account_id"]
+                message_id = row.get("message_id")
+                if message_id and (account_id, message_id) in self._message_index:
+                    saved_ids.append(None)  # Email ignoré (déjà existant)
+                    continue
+
+                received_at = self._parse_local_datetime(row.get("received_at")) or datetime.now()
+                email_id = self._next_email_id
+                self._next_email_id += 1
+                body = row.get("body") or ""
+                blob_hash = content_hash(body)
+                blob = self._blobs.setdefault(blob_hash, [body, 0])
+                blob[1] += 1
+                email = {
+                    "id": email_id,
+                    "account_id": account_id,
+                    "message_id": message_id,
+                    "sender": row.get("sender"),
+                    "recipient": row.get("recipient"),
+                    "subject": row.get("subject"),
+                    "body_hash": blob_hash,
+                    "received_at": received_at,
+                    **message_metadata(body)
+                }
+                self._emails[email_id] = email
+                self._email_ids.append(email_id)
+                self._emails_by_account[account_id][email_id] = email
+                if message_id:
+                    self._message_index[(account_id, message_id)] = email_id
+                self._artifacts[account_id].extend(self._artifact_records(email_id, row, received_at))
+                attachments = self._attachment_records(email_id, row)
+                if attachments:
+                    self._attachments[email_id] = attachments
+                saved_ids.append(email_id)
+                indexed.append(dict(row, id=email_id, received_at=received_at))
+            self.search_index.add(indexed)
+            return saved_ids
+
+    def _delete_emails(self, email_ids):
+        """Supprime des emails et tout ce qui les indexe (sous _lock) ; retourne leur nombre"""
+        removed = []
+        for email_id in email_ids:
+            email = self._emails.pop(email_id, None)
+            if email is None:
+                continue
+            removed.append(email)
+            account_id = email["account_id"]
+            by_account = self._emails_by_account[account_id]
+            del by_account[email_id]
+            if not by_account:
+                del self._emails_by_account[account_id]
+            if email.get("message_id"):
+                self._message_index.pop((account_id, email["message_id"]), None)
+            self._attachments.pop(email_id, None)
+            blob = self._blobs.get(email["body_hash"])
+            if blob:
+                blob[1] -= 1
+                if blob[1] <= 0:
+                    del self._blobs[email["body_hash"]]
+            position = bisect.bisect_left(self._email_ids, email_id)
+            del self._email_ids[position]
+        if not removed:
+            return 0
+        doomed = {email["id"] for email in removed}
+        for account_id in {email["account_id"] for email in removed}:
+            artifacts = [a for a in self._artifacts.get(account_id, ()) if a["email_id"] not in doomed]
+            if artifacts:
+                self._artifacts[account_id] = artifacts
+            else:
+                self._artifacts.pop(account_id, None)
+        self.search_index.delete(doomed)
+        return len(removed)
+
+    def get_email_attachments(self, email_id, account_id=None):
+        """Pièces jointes et source d'un email (métadonnées)"""
+        with self._lock:
+            return sorted((dict(a) for a in self._attachments.get(email_id, ())),
+                          key=lambda a: (a["kind"] != "attachment", a["position"]))
+
+    def add_email_attachment(self, email_id, account_id, attachment):
+        """Rattache après coup un contenu à un email"""
+        with self._lock:
+            existing = self._attachments[email_id]
+            record = self._attachment_records(email_id, {"account_id": account_id, "attachments": [attachment]})[0]
+            record["position"] = len(existing)
+            existing.append(record)
+
+    def attachment_hashes(self):
+        """Empreintes des contenus joints encore référencés"""
+        with self._lock:
+            return {a["content_hash"] for records in self._attachments.values() for a in records}
+
+    def delete_received_email(self, email_id, account_id=None):
+        """Supprime un email reçu et libère son blob"""
+        with self._lock:
+            return self._delete_emails([email_id]) > 0
+
+    def collect_garbage_blobs(self):
+        """Recompte les références des blobs et supprime les orphelins"""
+        with self._lock:
+            references = Counter(email["body_hash"] for email in self._emails.values())
+            removed = 0
+            for blob_hash in list(self._blobs):
+                if references[blob_hash]:
+                    self._blobs[blob_hash][1] = references[blob_hash]
+                else:
+                    del self._blobs[blob_hash]
+                    removed += 1
+            return removed
+
+    def purge_emails_before(self, cutoff, limit=500):
+        """Supprime au plus `limit` emails reçus avant `cutoff` et retourne leur nombre"""
+        with self._lock:
+            doomed_ids = list(islice((email_id for email_id, email in self._emails.items()
+                                      if email["received_at"] < cutoff), limit))
+            return self._delete_emails(doomed_ids)
+
+    def purge_excess_emails(self, max_per_account, limit=500):
+        """Ne conserve que les `max_per_account` emails les plus récents de chaque compte"""
+        with self._lock:
+            doomed_ids = []
+            for emails in self._emails_by_account.values():
+                if len(emails) <= max_per_account:
+                    continue
+                ranked = sorted(emails.values(), key=lambda x: (x["received_at"], x["id"]), reverse=True)
+                doomed_ids.extend(email["id"] for email in ranked[max_per_account:])
+                if len(doomed_ids) >= limit:
+                    break
+            return self._delete_emails(doomed_ids[:limit])
+
+    def query_artifacts(self, account_id, kind, sender=None, domain=None, since=None, limit=1):
+        """Codes ou liens extraits d'un compte, du plus récent au plus ancien"""
+        matches = []
+        with self._lock:
+            for artifact in self._artifacts.get(account_id, ()):
+                if artifact["kind"] != kind:
+                    continue
+                if sender and "@" in sender and artifact.get("sender") != sender:
+                    continue
+                if sender and "@" not in sender and artifact.get("sender_domain") != sender.lower():
+                    continue
+                if domain and artifact.get("domain") != domain.lower():
+                    continue
+                if since and artifact["received_at"] < since:
+                    continue
+                matches.append(dict(artifact))
+        matches.sort(key=lambda a: (a["received_at"], a["email_id"], -a["position"]), reverse=True)
+        return matches[:limit]
+
+    def search_emails(self, query, account_id=None, since=None, until=None, limit=20, offset=0):
+        """Recherche plein texte dans l'index inversé en mémoire"""
+        with self._lock:
+            total, page = self.search_index.search(
+                query, None if account_id is None else (account_id,), since, until, limit, offset
+            )
+            return {"total": total, "results": [
+                {"email": self._email_record(self._emails[email_id]), "score": round(score, 4)}
+                for email_id, _, score in page if email_id in self._emails
+            ]}
+
+    def get_all_received_emails(self):
+        """Récupère tous les emails reçus"""
+        with self._lock:
+            emails = sorted(self._emails.values(), key=lambda x: x["received_at"], reverse=True)
+            return [self._email_record(email) for email in emails]
+
+    def get_received_emails_by_account(self, account_id):
+        """Récupère les emails reçus pour un compte spécifique"""
+        with self._lock:
+            emails = sorted(self._emails_by_account.get(account_id, {}).values(),
+                            key=lambda x: x["received_at"], reverse=True)
+            return [self._email_record(email) for email in emails]
+
+    def iter_received_emails(self, account_id=None, chunk_size=500, after_id=0):
+        """Parcourt les emails reçus par ordre d'ID croissant, paquet par paquet"""
+        last_id = after_id
+        while True:
+            chunk = self.get_received_emails_after(last_id, account_id=account_id, limit=chunk_size)
+            if not chunk:
+                return
+            yield from chunk
+            last_id = chunk[-1]["id"]
+
+    def get_last_email_id(self):
+        """Retourne l'ID du dernier email enregistré (0 si aucun)"""
+        return self._next_email_id - 1
+
+    def get_received_emails_after(self, last_id, account_id=None, limit=500):
+        """Récupère les emails d'ID supérieur à `last_id` (ordre croissant)"""
+        with self._lock:
+            if account_id is not None:
+                emails = [email for email_id, email in self._emails_by_account.get(account_id, {}).items()
+                          if email_id > last_id][:limit]
+            else:
+                start = bisect.bisect_right(self._email_ids, last_id)
+                emails = [self._emails[email_id] for email_id in self._email_ids[start:start + limit]]
+            return [self._email_record(email) for email in emails]
+
+    def get_received_email_by_id(self, email_id):
+        """Récupère un email par ID"""
+        with self._lock:
+            email = self._emails.get(email_id)
+            return self._email_record(email) if email else None
+
+    def get_message_ids(self, account_id):
+        """Ensemble des message_id déjà stockés pour un compte"""
+        with self._lock:
+            return {email["message_id"] for email in self._emails_by_account.get(account_id, {}).values()
+                    if email["message_id"]}
+
+    def get_received_email_by_message_id(self, account_id, message_id):
+        """Récupère un email par (account_id, message_id)"""
+        with self._lock:
+            email_id = self._message_index.get((account_id, message_id))
+            return self._email_record(self._emails[email_id]) if email_id is not None else None
@@ -0,0 +1,351 @@
+from datetime import datetime
+
+from extraction import message_metadata
+from storage_backend import content_hash
+
+# Verrou nommé MySQL pour que deux instances ne migrent pas en même temps
+MIGRATION_LOCK = "generateur_schema_migrations"
+# Taille des lots des reprises de données calculées en Python
+BACKFILL_BATCH = 500
+
+def _fetch_scalar(cursor, query, params=()):
+    """Exécute une requête et retourne la première colonne de la première ligne"""
+    cursor.execute(query, params)
+    rows = cursor.fetchall()
+    return rows[0][0] if rows else None
+
+def _table_exists(cursor, table):
+    """Vérifie l'existence d'une table dans la base courante"""
+    return bool(_fetch_scalar(cursor, """
+        SELECT COUNT(*) FROM information_schema.TABLES
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s
+    """, (table,)))
+
+def _column_exists(cursor, table, column):
+    """Vérifie l'existence d'une colonne"""
+    return bool(_fetch_scalar(cursor, """
+        SELECT COUNT(*) FROM information_schema.COLUMNS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND COLUMN_NAME = %s
+    """, (table, column)))
+
+def _index_exists(cursor, table, index):
+    """Vérifie l'existence d'un index (CREATE INDEX IF NOT EXISTS n'existe pas sous MySQL)"""
+    return bool(_fetch_scalar(cursor, """
+        SELECT COUNT(*) FROM information_schema.STATISTICS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND INDEX_NAME = %s
+    """, (table, index)))
+
+def _add_column(cursor, table, column, definition):
+    """Ajoute une colonne si elle est absente"""
+    if not _column_exists(cursor, table, column):
+        cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+def _create_index(cursor, table, index, columns, unique=False):
+    """Crée un index s'il est absent"""
+    if not _index_exists(cursor, table, index):
+        kind = "UNIQUE INDEX" if unique else "INDEX"
+        cursor.execute(f"CREATE {kind} {index} ON {table}({columns})")
+
+# --- Étapes MySQL ---------------------------------------------------------
+
+def _mysql_initial_schema(cursor):
+    """Tables accounts, received_emails et blobs avec leurs index historiques"""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS accounts (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            email VARCHAR(255) NOT NULL UNIQUE,
+            password VARCHAR(255),
+            token TEXT,
+            token_expires_at DATETIME,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+    """)
+
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS received_emails (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            account_id INT,
+            message_id VARCHAR(255),
+            sender VARCHAR(255),
+            recipient VARCHAR(255),
+            subject VARCHAR(500),
+            body LONGTEXT,
+            body_hash CHAR(64),
+            received_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (account_id) REFERENCES accounts(id) ON DELETE CASCADE
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+    """)
+
+    # Blob store adressé par contenu (corps partagés entre emails)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS blobs (
+            hash CHAR(64) NOT NULL PRIMARY KEY,
+            content LONGTEXT,
+            size INT NOT NULL DEFAULT 0,
+            ref_count INT NOT NULL DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+    """)
+
+    # Bases créées avant le blob store
+    _add_column(cursor, "received_emails", "body_hash", "CHAR(64) AFTER body")
+
+    _create_index(cursor, "received_emails", "idx_unique_message", "account_id, message_id", unique=True)
+    _create_index(cursor, "received_emails", "idx_sender_subject", "account_id, sender, subject")
+    _create_index(cursor, "received_emails", "idx_received_at", "received_at")
+    _create_index(cursor, "received_emails", "idx_body_hash", "body_hash")
+
+def _mysql_account_timeline_index(cursor):
+    """Index pour WHERE account_id=%s ORDER BY received_at DESC sans tri en mémoire"""
+    _create_index(cursor, "received_emails", "idx_account_received", "account_id, received_at, id")
+
+def _mysql_message_id_index(cursor):
+    """Index de recherche directe par message_id"""
+    _create_index(cursor, "received_emails", "idx_message_id", "message_id")
+
+def _mysql_email_artifacts(cursor):
+    """Table annexe des codes et liens extraits à l'ingestion"""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS email_artifacts (
+            id BIGINT AUTO_INCREMENT PRIMARY KEY,
+            email_id INT NOT NULL,
+            account_id INT NOT NULL,
+            kind VARCHAR(8) NOT NULL,
+            value VARCHAR(2048) NOT NULL,
+            domain VARCHAR(255),
+            sender VARCHAR(255),
+            sender_domain VARCHAR(255),
+            position SMALLINT NOT NULL DEFAULT 0,
+            received_at TIMESTAMP NULL DEFAULT NULL,
+            INDEX idx_artifact_account (account_id, kind, received_at),
+            INDEX idx_artifact_sender (account_id, kind, sender, received_at),
+            INDEX idx_artifact_sender_domain (account_id, kind, sender_domain, received_at),
+            INDEX idx_artifact_domain (account_id, kind, domain, received_at),
+            INDEX idx_artifact_email (email_id)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+    """)
+
+def _mysql_token_expiry_index(cursor):
+    """Index pour la recherche des tokens à renouveler"""
+    _create_index(cursor, "accounts", "idx_token_expires", "token_expires_at")
+
+def _mysql_account_pool(cursor):
+    """Drapeau des comptes pré-créés en réserve (account_pool)"""
+    _add_column(cursor, "accounts", "pooled", "TINYINT(1) NOT NULL DEFAULT 0")
+    _create_index(cursor, "accounts", "idx_pooled", "pooled, id")
+
+def _mysql_account_provider(cursor):
+    """Fournisseur propriétaire de chaque compte (Mail.tm pour les comptes existants)"""
+    _add_column(cursor, "accounts", "provider", "VARCHAR(32) NOT NULL DEFAULT 'mailtm'")
+    _create_index(cursor, "accounts", "idx_provider", "provider")
+
+def _mysql_email_attachments(cursor):
+    """Métadonnées des pièces jointes et sources .eml (contenu dans content_store)"""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS email_attachments (
+            id BIGINT AUTO_INCREMENT PRIMARY KEY,
+            email_id INT NOT NULL,
+            account_id INT NOT NULL,
+            kind VARCHAR(16) NOT NULL DEFAULT 'attachment',
+            filename VARCHAR(255),
+            content_type VARCHAR(127),
+            size BIGINT,
+            content_hash CHAR(64) NOT NULL,
+            position INT NOT NULL DEFAULT 0,
+            INDEX idx_attachment_email (email_id),
+            INDEX idx_attachment_account (account_id),
+            INDEX idx_attachment_hash (content_hash)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+    """)
+
+def _mysql_email_search(cursor):
+    """Texte des emails indexé en plein texte, rempli à partir des emails existants
+
+    Table à part : une table partitionnée (received_emails) n'accepte pas
+    d'index FULLTEXT, et les corps sont partagés dans le blob store.
+    """
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS email_search (
+            email_id INT NOT NULL PRIMARY KEY,
+            account_id INT NOT NULL,
+            received_at TIMESTAMP NULL DEFAULT NULL,
+            sender VARCHAR(255),
+            subject VARCHAR(500),
+            body MEDIUMTEXT,
+            INDEX idx_search_account (account_id, received_at),
+            INDEX idx_search_received (received_at),
+            FULLTEXT INDEX ft_search_all (subject, sender, body),
+            FULLTEXT INDEX ft_search_subject (subject)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+    """)
+    cursor.execute("""
+        INSERT IGNORE INTO email_search (email_id, account_id, received_at, sender, subject, body)
+        SELECT e.id, e.account_id, e.received_at, e.sender, e.subject, LEFT(COALESCE(b.content, e.body), 100000)
+        FROM received_emails e
+        LEFT JOIN blobs b ON b.hash = e.body_hash
+        WHERE e.account_id IS NOT NULL
+    """)
+
+def _mysql_account_email_index(cursor):
+    """Recherche d'adresses par préfixe parmi les comptes attribués (LIKE 'abc%' ORDER BY email)"""
+    _create_index(cursor, "accounts", "idx_pooled_email", "pooled, email")
+
+def _mysql_account_last_used(cursor):
+    """Dernière utilisation réelle d'un compte (message reçu, ouverture), critère d'activité"""
+    _add_column(cursor, "accounts", "last_used_at", "DATETIME NULL AFTER created_at")
+
+def _mysql_email_preview(cursor):
+    """Texte brut des corps HTML, aperçu, taille et drapeau HTML, complétés par lots pour les emails existants"""
+    _add_column(cursor, "received_emails", "body_text", "MEDIUMTEXT NULL AFTER body_hash")
+    _add_column(cursor, "received_emails", "preview", "VARCHAR(255) NULL AFTER body_text")
+    _add_column(cursor, "received_emails", "body_size", "INT UNSIGNED NULL AFTER preview")
+    _add_column(cursor, "received_emails", "is_html", "TINYINT(1) NOT NULL DEFAULT 0 AFTER body_size")
+    last_id = 0
+    while True:
+        cursor.execute("""
+            SELECT e.id, COALESCE(b.content, e.body) FROM received_emails e
+            LEFT JOIN blobs b ON b.hash = e.body_hash
+            WHERE e.id > %s AND e.preview IS NULL
+            ORDER BY e.id LIMIT %s
+        """, (last_id, BACKFILL_BATCH))
+        rows = cursor.fetchall()
+        if not rows:
+            break
+        updates = []
+        for email_id, body in rows:
+            metadata = message_metadata(body)
+            updates.append((metadata["body_text"], metadata["preview"], metadata["body_size"],
+                            metadata["is_html"], email_id))
+        cursor.executemany(
+            "UPDATE received_emails SET body_text=%s, preview=%s, body_size=%s, is_html=%s WHERE id=%s",
+            updates
+        )
+        last_id = rows[-1][0]
+
+# --- Étapes locales -------------------------------------------------------
+
+def _local_initial_schema(data):
+    """Complète les clés attendues d'un fichier local"""
+    data.setdefault("accounts", [])
+    data.setdefault("emails", [])
+    data.setdefault("blobs", {})
+    data.setdefault("next_account_id", max((acc["id"] for acc in data["accounts"]), default=0) + 1)
+    data.setdefault("next_email_id", max((email["id"] for email in data["emails"]), default=0) + 1)
+
+def _local_email_artifacts(data):
+    """Liste annexe des codes et liens extraits"""
+    data.setdefault("artifacts", [])
+
+def _local_email_attachments(data):
+    """Liste annexe des pièces jointes"""
+    data.setdefault("attachments", [])
+
+def _local_account_provider(data):
+    """Fournisseur des comptes existants"""
+    for account in data["accounts"]:
+        account.setdefault("provider", "mailtm")
+
+def _local_account_last_used(data):
+    """Dernière utilisation des comptes existants (inconnue)"""
+    for account in data["accounts"]:
+        account.setdefault("last_used_at", None)
+
+def _local_shard_summaries(data):
+    """Résumé par compte dans l'index réparti, calculé à l'écriture qui suit la migration (données chargées en entier)"""
+    data.setdefault("shard_stats", {})
+
+def _local_email_preview(data):
+    """Aperçu, taille et drapeau HTML des emails existants ; texte brut des HTML en blob (text_hash)"""
+    blobs = data.setdefault("blobs", {})
+    for email in data["emails"]:
+        if "preview" in email:
+            continue
+        metadata = message_metadata((blobs.get(email.get("body_hash")) or {}).get("content"))
+        body_text = metadata.pop("body_text")
+        if body_text is not None:
+            text_hash = content_hash(body_text)
+            blob = blobs.get(text_hash)
+            if blob:
+                blob["ref_count"] += 1
+            else:
+                blobs[text_hash] = {"content": body_text, "ref_count": 1}
+            email["text_hash"] = text_hash
+        email.update(metadata)
+
+# (version, description, étape MySQL, étape locale) — ordre strictement croissant,
+# chaque étape doit pouvoir être rejouée sans effet sur une base déjà à jour
+MIGRATIONS = [
+    (1, "Schéma initial et blob store", _mysql_initial_schema, _local_initial_schema),
+    (2, "Index (account_id, received_at, id)", _mysql_account_timeline_index, None),
+    (3, "Index sur message_id", _mysql_message_id_index, None),
+    (4, "Codes et liens extraits (email_artifacts)", _mysql_email_artifacts, _local_email_artifacts),
+    (5, "Index sur accounts.token_expires_at", _mysql_token_expiry_index, None),
+    (6, "Réserve de comptes pré-créés (accounts.pooled)", _mysql_account_pool, None),
+    (7, "Fournisseur de chaque compte (accounts.provider)", _mysql_account_provider, _local_account_provider),
+    (8, "Pièces jointes et sources .eml (email_attachments)", _mysql_email_attachments, _local_email_attachments),
+    (9, "Recherche plein texte (email_search, index FULLTEXT)", _mysql_email_search, None),
+    (10, "Index (pooled, email) pour la recherche d'adresses", _mysql_account_email_index, None),
+    (11, "Texte brut, aperçu, taille et type des emails", _mysql_email_preview, _local_email_preview),
+    (12, "Dernière utilisation des comptes (accounts.last_used_at)", _mysql_account_last_used, _local_account_last_used),
+    (13, "Résumé des fichiers de comptes dans l'index local", None, _local_shard_summaries),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+def get_mysql_version(cursor):
+    """Retourne la version de schéma MySQL appliquée (0 si aucune)"""
+    if not _table_exists(cursor, "schema_version"):
+        return 0
+    return _fetch_scalar(cursor, "SELECT MAX(version) FROM schema_version") or 0
+
+def apply_mysql_migrations(conn, cursor):
+    """Applique dans l'ordre les migrations MySQL manquantes et retourne les versions appliquées"""
+    if not _fetch_scalar(cursor, "SELECT GET_LOCK(%s, 30)", (MIGRATION_LOCK,)):
+        raise Exception("Verrou de migration indisponible")
+
+    try:
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version INT NOT NULL PRIMARY KEY,
+                description VARCHAR(255),
+                applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+        """)
+        current = get_mysql_version(cursor)
+        applied = []
+        for version, description, mysql_step, _ in MIGRATIONS:
+            if version <= current:
+                continue
+            if mysql_step:
+                mysql_step(cursor)
+            cursor.execute(
+                "INSERT INTO schema_version (version, description) VALUES (%s, %s)",
+                (version, description)
+            )
+            conn.commit()
+            applied.append(version)
+        return applied
+    finally:
+        _fetch_scalar(cursor, "SELECT RELEASE_LOCK(%s)", (MIGRATION_LOCK,))
+
+def apply_local_migrations(data):
+    """Applique les migrations locales manquantes sur les données chargées
+
+    Retourne les versions appliquées ; une liste vide signifie que les données
+    n'ont pas été modifiées.
+    """
+    current = data.get("schema_version", 0)
+    applied = []
+    for version, description, _, local_step in MIGRATIONS:
+        if version <= current:
+            continue
+        if local_step:
+            local_step(data)
+        data["schema_version"] = version
+        data.setdefault("schema_history", []).append({
+            "version": version,
+            "description": description,
+            "applied_at": datetime.now().isoformat()
+        })
+        applied.append(version)
+    return applied
@@ -0,0 +1,2115 @@
+import sys
+import time
+import socket
+import threading
+from datetime import datetime, timedelta
+from collections import Counter
+from contextlib import contextmanager
+
+import migrations
+from extraction import message_metadata
+from records import Account, ReceivedEmail
+from circuit_breaker import CircuitBreaker, OfflineJournal, replay_groups, CLOSED, OPEN
+from search_index import index_text, mysql_boolean_query
+from storage_backend import StorageBackend, content_hash
+
+# Détection d'environnement compilé
+IS_COMPILED = getattr(sys, 'frozen', False)
+
+# Gestion intelligente des drivers MySQL selon l'environnement
+if IS_COMPILED:
+    # En environnement compilé, forcer PyMySQL
+    try:
+        import pymysql
+        import pymysql.cursors
+        pymysql.install_as_MySQLdb()
+        MYSQL_AVAILABLE = True
+        USING_PYMYSQL = True
+    except ImportError as e:
+        MYSQL_AVAILABLE = False
+        USING_PYMYSQL = False
+else:
+    # En environnement normal, essayer mysql-connector d'abord
+    try:
+        import mysql.connector
+        from mysql.connector import pooling, Error as MySQLError
+        MYSQL_AVAILABLE = True
+        USING_PYMYSQL = False
+    except ImportError:
+        try:
+            import pymysql
+            import pymysql.cursors
+            pymysql.install_as_MySQLdb()
+            MYSQL_AVAILABLE = True
+            USING_PYMYSQL = True
+        except ImportError as e:
+            MYSQL_AVAILABLE = False
+            USING_PYMYSQL = False
+
+if MYSQL_AVAILABLE and USING_PYMYSQL:
+    IntegrityError = pymysql.err.IntegrityError
+elif MYSQL_AVAILABLE:
+    IntegrityError = mysql.connector.IntegrityError
+else:
+    class IntegrityError(Exception):
+        """Substitut utilisé lorsqu'aucun driver MySQL n'est disponible"""
+
+try:
+    from config import DB_HOST, DB_PORT, DB_USER, DB_PASSWORD, DB_NAME
+except ImportError:
+    # Configuration par défaut (remplacez par vos vraies valeurs)
+    DB_HOST = "localhost"
+    DB_PORT = 3306
+    DB_USER = "root"
+    DB_PASSWORD = ""
+    DB_NAME = "generateur"
+
+try:
+    from config import DB_POOL_SIZE
+except ImportError:
+    DB_POOL_SIZE = 5
+
+try:
+    from config import DB_POOL_TIMEOUT
+except ImportError:
+    DB_POOL_TIMEOUT = 10
+
+try:
+    from config import DB_PREPARED_STATEMENTS
+except ImportError:
+    DB_PREPARED_STATEMENTS = True
+
+try:
+    from config import DB_CIRCUIT_BREAKER
+except ImportError:
+    DB_CIRCUIT_BREAKER = True
+
+try:
+    from config import DB_FAILURE_THRESHOLD, DB_HEALTH_CHECK_INTERVAL, DB_RETRY_INTERVAL, DB_HEALTH_CHECK_TIMEOUT
+except ImportError:
+    DB_FAILURE_THRESHOLD = 2
+    DB_HEALTH_CHECK_INTERVAL = 10
+    DB_RETRY_INTERVAL = 2
+    DB_HEALTH_CHECK_TIMEOUT = 2
+
+try:
+    from config import DB_OFFLINE_QUEUE_FILE
+except ImportError:
+    DB_OFFLINE_QUEUE_FILE = "mysql_offline_queue.jsonl"
+
+try:
+    from config import DB_READ_REPLICAS
+except ImportError:
+    # Réplicas de lecture : "hôte:port" ou {"host", "port", ["user", "password", "database", "pool_size"]}
+    DB_READ_REPLICAS = []
+
+try:
+    from config import DB_REPLICA_MAX_LAG, DB_REPLICA_CHECK_INTERVAL, DB_READ_YOUR_WRITES_WINDOW
+except ImportError:
+    DB_REPLICA_MAX_LAG = 5
+    DB_REPLICA_CHECK_INTERVAL = 15
+    # Secondes pendant lesquelles les lectures restent sur le primaire après une écriture
+    DB_READ_YOUR_WRITES_WINDOW = 5
+
+# Taille des lots lors du rejeu des écritures mises en file pendant une panne
+OFFLINE_REPLAY_BATCH = 500
+
+# Colonnes des emails reçus, le corps étant résolu depuis le blob store
+EMAIL_SELECT = """
+    SELECT e.id, e.account_id, e.message_id, e.sender, e.recipient, e.subject,
+           COALESCE(b.content, e.body) AS body, e.body_hash, e.received_at,
+           e.body_text, e.preview, e.body_size, e.is_html
+    FROM received_emails e
+    LEFT JOIN blobs b ON b.hash = e.body_hash
+"""
+
+# Mêmes colonnes sans le corps ni son texte, chargés à la demande (listes)
+EMAIL_LIST_SELECT = """
+    SELECT e.id, e.account_id, e.message_id, e.sender, e.recipient, e.subject,
+           e.body_hash, e.received_at, e.preview, e.body_size, e.is_html
+    FROM received_emails e
+"""
+
+class MySQLConnectionManager:
+    """Gestionnaire de connexion MySQL robuste avec diagnostic et reconnexion"""
+    
+    def __init__(self, host=None, port=None, user=None, password=None, database=None,
+                 pool_size=None, pool_name="generateur_pool", connect_timeout=15):
+        # Serveur primaire par défaut ; les réplicas ont leur propre gestionnaire
+        self.host = host or DB_HOST
+        self.port = int(port or DB_PORT)
+        self.user = user if user is not None else DB_USER
+        self.password = password if password is not None else DB_PASSWORD
+        self.database = database or DB_NAME
+        self.pool_size = pool_size or DB_POOL_SIZE
+        self.pool_name = pool_name
+        self.connect_timeout = connect_timeout
+        self.connection_pool = None
+        self.last_connection_test = None
+        self.connection_status = "non_testé"
+        self._pool_lock = threading.Lock()
+        # Disjoncteur branché par MariaDBStorage une fois MySQL choisi
+        self.breaker = None
+        # Réplicas de lecture (voir get_read_connection)
+        self.replicas = []
+        self._replica_index = 0
+        self._replica_lock = threading.Lock()
+        self._last_write = 0.0
+        
+    def test_network_connectivity(self):
+        """Test la connectivité réseau vers le serveur"""
+        try:
+            sock = socket.create_connection((self.host, self.port), timeout=min(10, self.connect_timeout))
+            sock.close()
+            return True
+        except:
+            return False
+    
+    def test_mysql_connection(self):
+        """Test la connexion MySQL avec diagnostics détaillés"""
+        if not MYSQL_AVAILABLE:
+            return False, "module_manquant"
+        
+        if not self.test_network_connectivity():
+            return False, "connectivité_réseau"
+        
+        try:
+            if USING_PYMYSQL:
+                import pymysql
+                conn = pymysql.connect(
+                    host=self.host,
+                    port=self.port,
+                    user=self.user,
+                    password=self.password,
+                    database=self.database,
+                    connect_timeout=self.connect_timeout,
+                    autocommit=True,
+                    charset='utf8mb4'
+                )
+            else:
+                import mysql.connector
+                conn = mysql.connector.connect(
+                    host=self.host,
+                    port=self.port,
+                    user=self.user,
+                    password=self.password,
+                    database=self.database,
+                    connect_timeout=self.connect_timeout,
+                    autocommit=True,
+                    charset='utf8mb4',
+                    use_unicode=True,
+                    auth_plugin='mysql_native_password'
+                )
+            
+            # Test simple de requête
+            cursor = conn.cursor()
+            cursor.execute("SELECT 1")
+            result = cursor.fetchone()
+            cursor.close()
+            conn.close()
+            
+            if result and result[0] == 1:
+                self.connection_status = "connecté"
+                self.last_connection_test = datetime.now()
+                return True, "succès"
+            else:
+                return False, "test_requête_échoué"
+                
+        except Exception as e:
+            return False, "erreur_mysql"
+    
+    def create_connection_pool(self):
+        """Crée un pool de connexions MySQL"""
+        try:
+            if USING_PYMYSQL:
+                # PyMySQL ne supporte pas les pools natifs, on simulera
+                self.connection_pool = "pymysql_simple"
+                return True
+            else:
+                import mysql.connector.pooling
+                config = {
+                    'host': self.host,
+                    'port': self.port,
+                    'user': self.user,
+                    'password': self.password,
+                    'database': self.database,
+                    'pool_name': self.pool_name,
+                    'pool_size': self.pool_size,
+                    'pool_reset_session': True,
+                    'autocommit': True,
+                    'charset': 'utf8mb4',
+                    'use_unicode': True,
+                    'auth_plugin': 'mysql_native_password'
+                }
+                
+                self.connection_pool = mysql.connector.pooling.MySQLConnectionPool(**config)
+                return True
+        except Exception as e:
+            return False
+    
+    def ping(self, timeout=DB_HEALTH_CHECK_TIMEOUT):
+        """Sonde de santé rapide (réseau puis SELECT 1, délais courts) ; recrée le pool si besoin"""
+        if not MYSQL_AVAILABLE:
+            return False
+        try:
+            socket.create_connection((self.host, self.port), timeout=timeout).close()
+            conn = self._connect(timeout)
+            cursor = conn.cursor()
+            cursor.execute("SELECT 1")
+            cursor.fetchall()
+            cursor.close()
+            conn.close()
+        except Exception:
+            return False
+        if not self.connection_pool:
+            with self._pool_lock:
+                if not self.connection_pool and not self.create_connection_pool():
+                    return False
+        self.last_connection_test = datetime.now()
+        return True
+
+    def _connect(self, timeout):
+        """Connexion directe hors pool"""
+        if USING_PYMYSQL:
+            import pymysql
+            return pymysql.connect(
+                host=self.host,
+                port=self.port,
+                user=self.user,
+                password=self.password,
+                database=self.database,
+                connect_timeout=timeout,
+                autocommit=True,
+                charset='utf8mb4'
+            )
+        import mysql.connector
+        return mysql.connector.connect(
+            host=self.host,
+            port=self.port,
+            user=self.user,
+            password=self.password,
+            database=self.database,
+            connect_timeout=timeout,
+            autocommit=True,
+            charset='utf8mb4',
+            use_unicode=True,
+            auth_plugin='mysql_native_password'
+        )
+
+    def get_connection(self):
+        """Obtient une connexion du pool
+
+        Disjoncteur ouvert, retourne None immédiatement au lieu d'attendre les
+        délais de connexion ; les échecs de connexion lui sont signalés.
+        """
+        breaker = self.breaker
+        if breaker and not breaker.allow():
+            return None
+        
+        if not self.connection_pool:
+            with self._pool_lock:
+                # Double vérification : un autre thread a pu créer le pool entre-temps
+                if not self.connection_pool:
+                    success, error = self.test_mysql_connection()
+                    if not success or not self.create_connection_pool():
+                        if breaker:
+                            breaker.record_failure()
+                        return None
+        
+        try:
+            if USING_PYMYSQL:
+                conn = self._connect(15)
+            else:
+                # Pool épuisé par des threads concurrents : attendre qu'une connexion se libère
+                deadline = time.monotonic() + DB_POOL_TIMEOUT
+                while True:
+                    try:
+                        conn = self.connection_pool.get_connection()
+                        break
+                    except pooling.PoolError:
+                        # Pool saturé : la base n'est pas en cause
+                        if time.monotonic() >= deadline:
+                            return None
+                        time.sleep(0.05)
+        except Exception as e:
+            if breaker:
+                breaker.record_failure()
+            return None
+        if breaker:
+            breaker.record_success()
+        return conn
+
+    def add_replicas(self, specs):
+        """Déclare les réplicas de lecture, chacun avec son propre pool"""
+        for index, spec in enumerate(specs or ()):
+            if isinstance(spec, str):
+                host, _, port = spec.partition(":")
+                spec = {"host": host, "port": port or None}
+            self.replicas.append(ReplicaManager(
+                host=spec["host"],
+                port=spec.get("port"),
+                user=spec.get("user"),
+                password=spec.get("password"),
+                database=spec.get("database"),
+                pool_size=spec.get("pool_size"),
+                pool_name=f"generateur_replica_{index}",
+                connect_timeout=DB_HEALTH_CHECK_TIMEOUT
+            ))
+
+    def mark_write(self):
+        """Note une écriture : les lectures suivantes restent un moment sur le primaire"""
+        self._last_write = time.monotonic()
+
+    def get_read_connection(self):
+        """Connexion de lecture : un réplica sain, à tour de rôle, sinon le primaire
+
+        Pendant DB_READ_YOUR_WRITES_WINDOW secondes après une écriture de ce
+        processus, les lectures vont au primaire pour voir cette écriture
+        malgré le retard de réplication. Primaire hors service, un réplica
+        répond quand même (données éventuellement en léger retard).
+        """
+        if not self.replicas:
+            return self.get_connection()
+        if time.monotonic() - self._last_write >= DB_READ_YOUR_WRITES_WINDOW:
+            conn = self._replica_connection()
+            if conn:
+                return conn
+        conn = self.get_connection()
+        if conn is None:
+            conn = self._replica_connection()
+        return conn
+
+    def _replica_connection(self):
+        with self._replica_lock:
+            start = self._replica_index
+            self._replica_index = (start + 1) % len(self.replicas)
+        for offset in range(len(self.replicas)):
+            replica = self.replicas[(start + offset) % len(self.replicas)]
+            if not replica.usable():
+                continue
+            conn = replica.get_connection()
+            if conn:
+                replica.stats["reads"] += 1
+                return conn
+            replica.mark_down()
+        return None
+
+    def get_replica_status(self):
+        """État des réplicas : santé, retard de réplication et lectures servies"""
+        return [replica.status() for replica in self.replicas]
+
+class ReplicaManager(MySQLConnectionManager):
+    """Réplica de lecture : pool propre et sonde de santé (joignable, retard de réplication)
+
+    Un réplica injoignable, saturé ou en retard de plus de DB_REPLICA_MAX_LAG
+    secondes est écarté jusqu'à la sonde suivante (DB_REPLICA_CHECK_INTERVAL).
+    Un serveur sans réplication configurée (ou sans le droit de la consulter)
+    est considéré à jour.
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.healthy = True
+        self.lag = None
+        self.down_until = 0.0
+        self.next_check = 0.0
+        self.stats = {"reads": 0, "failures": 0}
+        self._check_lock = threading.Lock()
+
+    def usable(self):
+        now = time.monotonic()
+        if now < self.down_until:
+            return False
+        if now >= self.next_check:
+            self.check()
+        return self.healthy
+
+    def mark_down(self):
+        self.healthy = False
+        self.stats["failures"] += 1
+        self.down_until = self.next_check = time.monotonic() + DB_REPLICA_CHECK_INTERVAL
+
+    def check(self):
+        """Sonde le réplica ; un seul thread sonde, les autres gardent l'état connu"""
+        if not self._check_lock.acquire(blocking=False):
+            return self.healthy
+        try:
+            self.next_check = time.monotonic() + DB_REPLICA_CHECK_INTERVAL
+            try:
+                conn = self._connect(self.connect_timeout)
+            except Exception:
+                self.mark_down()
+                return False
+            try:
+                self.lag = self._replication_lag(conn)
+            finally:
+                conn.close()
+            self.healthy = self.lag is None or self.lag <= DB_REPLICA_MAX_LAG
+            self.last_connection_test = datetime.now()
+            return self.healthy
+        finally:
+            self._check_lock.release()
+
+    def _replication_lag(self, conn):
+        """Retard en secondes, None si inconnu, infini si la réplication est arrêtée"""
+        if USING_PYMYSQL:
+            import pymysql.cursors
+            cursor = conn.cursor(pymysql.cursors.DictCursor)
+        else:
+            cursor = conn.cursor(dictionary=True)
+        try:
+            for query in ("SHOW REPLICA STATUS", "SHOW SLAVE STATUS"):
+                try:
+                    cursor.execute(query)
+                    rows = cursor.fetchall()
+                    break
+                except Exception:
+                    continue
+            else:
+                return None
+            if not rows:
+                return None
+            row = rows[0]
+            lag = row.get("Seconds_Behind_Source", row.get("Seconds_Behind_Master"))
+            return float("inf") if lag is None else float(lag)
+        finally:
+            cursor.close()
+
+    def status(self):
+        return {
+            "host": self.host,
+            "port": self.port,
+            "healthy": self.healthy and time.monotonic() >= self.down_until,
+            "lag": None if self.lag in (None, float("inf")) else self.lag,
+            "replicating": self.lag != float("inf"),
+            "reads": self.stats["reads"],
+            "failures": self.stats["failures"]
+        }
+
+class _StatementCursor:
+    """Curseur d'une session : chaque requête distincte garde son instruction préparée
+
+    Les attributs de lecture (fetchall, fetchone, rowcount, lastrowid...) sont
+    ceux du curseur préparé de la dernière requête exécutée.
+    """
+
+    def __init__(self, session_conn, dictionary=False):
+        self._session_conn = session_conn
+        self._dictionary = dictionary
+        self._current = None
+
+    def _drain(self):
+        # Un résultat non lu bloquerait la requête suivante sur la connexion partagée
+        if self._current is not None and getattr(self._current, "with_rows", False):
+            try:
+                self._current.fetchall()
+            except Exception:
+                pass
+
+    def execute(self, query, params=()):
+        self._drain()
+        self._current = self._session_conn.prepared_cursor(query, self._dictionary)
+        return self._current.execute(query, tuple(params or ()))
+
+    def executemany(self, query, seq_params):
+        # Le curseur classique regroupe les INSERT en une seule requête multi-lignes
+        self._drain()
+        self._current = self._session_conn.raw.cursor(dictionary=self._dictionary)
+        return self._current.executemany(query, seq_params)
+
+    def close(self):
+        self._drain()
+
+    def __getattr__(self, name):
+        return getattr(self._current, name)
+
+class _SessionConnection:
+    """Connexion partagée par tous les appels d'une session (voir MariaDBStorage.session)
+
+    close() ne rend pas la connexion au pool. En mode transactionnel, les
+    transactions et validations propres à chaque méthode sont absorbées par
+    celle de la session ; une annulation marque la session en échec et lève
+    l'erreur, la session annulant alors tout son travail une seule fois.
+    """
+
+    def __init__(self, conn, transactional=False):
+        self.raw = conn
+        self.transactional = transactional
+        self.failed = False
+        self._prepared = {} if DB_PREPARED_STATEMENTS and not USING_PYMYSQL else None
+
+    def __getattr__(self, name):
+        return getattr(self.raw, name)
+
+    def cursor(self, *args, **kwargs):
+        if self._prepared is None or args or set(kwargs) - {"dictionary"}:
+            return self.raw.cursor(*args, **kwargs)
+        return _StatementCursor(self, kwargs.get("dictionary", False))
+
+    def prepared_cursor(self, query, dictionary=False):
+        """Curseur préparé mis en cache par texte de requête"""
+        key = (query, dictionary)
+        cursor = self._prepared.get(key)
+        if cursor is None:
+            try:
+                cursor = self.raw.cursor(prepared=True, dictionary=dictionary)
+            except (TypeError, ValueError, AttributeError):
+                # Connecteur sans curseur préparé dictionnaire : curseur classique
+                cursor = self.raw.cursor(dictionary=dictionary)
+            self._prepared[key] = cursor
+        return cursor
+
+    def start_transaction(self, *args, **kwargs):
+        if not self.transactional:
+            self.raw.start_transaction(*args, **kwargs)
+
+    def begin(self):
+        if not self.transactional:
+            self.raw.begin()
+
+    def commit(self):
+        if not self.transactional:
+            self.raw.commit()
+
+    def rollback(self):
+        if not self.transactional:
+            self.raw.rollback()
+            return
+        # Annuler ici déferait aussi le travail déjà fait dans la session : c'est elle qui annule
+        self.failed = True
+        error = sys.exc_info()[1]
+        if error is not None:
+            raise error
+        raise Exception("Transaction de session annulée")
+
+    def close(self):
+        pass
+
+    def release(self):
+        """Ferme les instructions préparées et rend la connexion"""
+        for cursor in (self._prepared or {}).values():
+            try:
+                cursor.close()
+            except Exception:
+                pass
+        self.raw.close()
+
+class MySQLBackend(StorageBackend):
+    """Moteur MySQL/MariaDB : pool de connexions, réplicas de lecture et file durable pendant les pannes"""
+
+    name = "mysql"
+
+    def __init__(self):
+        super().__init__()
+        self.mysql_manager = MySQLConnectionManager()
+        self.circuit_breaker = None
+        self.offline_journal = None
+        self._session_state = threading.local()
+
+    def open(self):
+        """Teste la connexion, crée ou migre les tables, branche disjoncteur et réplicas
+
+        Retourne (succès, type d'erreur de connexion).
+        """
+        success, error_type = self.mysql_manager.test_mysql_connection()
+        if not success:
+            return False, error_type
+
+        self.status_message = "Connecté à MySQL"
+
+        # Créer les tables si nécessaire
+        if not self._create_tables():
+            self.status_message = "Erreur de création des tables"
+
+        if DB_CIRCUIT_BREAKER:
+            self._enable_circuit_breaker()
+        self.mysql_manager.add_replicas(DB_READ_REPLICAS)
+        return True, None
+
+    def is_connected(self):
+        """Vérifie si MySQL est connecté"""
+        return self.mysql_manager.connection_status == "connecté"
+
+    def close(self):
+        """Arrête la surveillance du disjoncteur"""
+        if self.circuit_breaker:
+            self.circuit_breaker.stop()
+
+    def _create_tables(self):
+        """Crée ou met à jour le schéma via les migrations versionnées"""
+        conn = self.mysql_manager.get_connection()
+        if not conn:
+            return False
+        
+        try:
+            cursor = conn.cursor()
+            migrations.apply_mysql_migrations(conn, cursor)
+            self.partitioned = self._is_partitioned(cursor)
+            
+            conn.commit()
+            cursor.close()
+            conn.close()
+            return True
+            
+        except Exception as e:
+            if conn:
+                conn.close()
+            return False
+
+    def get_schema_version(self):
+        """Retourne la version de schéma appliquée"""
+        conn = self._get_connection(for_write=False)
+        if not conn:
+            raise Exception("Connexion MySQL impossible")
+
+        try:
+            cursor = conn.cursor()
+            version = migrations.get_mysql_version(cursor)
+            cursor.close()
+            conn.close()
+            return version
+        except Exception as e:
+            conn.close()
+            raise e
+
+    def save_account(self, email, password, pooled=False, provider="mailtm"):
+        """Sauvegarde un compte (`pooled` : mis en réserve, invisible jusqu'à son attribution ;
+        `provider` : fournisseur propriétaire de l'adresse)"""
+        conn = self._get_connection()
+        if not conn:
+            raise Exception("Connexion MySQL impossible")
+
+        try:
+            cursor = conn.cursor()
+            # LAST_INSERT_ID(id) : lastrowid donne aussi l'ID d'un compte existant, sans SELECT
+            cursor.execute(
+                "INSERT INTO accounts (email, password, pooled, provider) VALUES (%s, %s, %s, %s) "
+                "ON DUPLICATE KEY UPDATE id=LAST_INSERT_ID(id), password=VALUES(password)",
+                (email, password, int(pooled), provider)
+            )
+            account_id = cursor.lastrowid
+            conn.commit()
+            cursor.close()
+            conn.close()
+            return account_id
+        except Exception as e:
+            conn.close()
+            raise e
+
+    def save_accounts_batch(self, accounts):
+        """Sauvegarde un lot de comptes complets (email, password, token, dates)"""
+        if not accounts:
+            return {}
+        conn = self._get_connection()
+        if not conn:
+            raise Exception("Connexion MySQL impossible")
+
+        cursor = conn.cursor()
+        try:
+            self._begin(conn)
+            cursor.executemany(
+                """
+                INSERT INTO accounts (email, password, token, token_expires_at, created_at, provider)
+                VALUES (%s, %s, %s, %s, COALESCE(%s, CURRENT_TIMESTAMP), %s)
+                ON DUPLICATE KEY UPDATE
+                    password=VALUES(password),
+                    token=COALESCE(VALUES(token), token),
+                    token_expires_at=COALESCE(VALUES(token_expires_at), token_expires_at)
+                """,
+                [(acc["email"], acc.get("password"), acc.get("token"),
+                  self._mysql_datetime(acc.get("token_expires_at")),
+                  self._mysql_datetime(acc.get("created_at")),
+                  acc.get("provider") or "mailtm") for acc in accounts]
+            )
+            placeholders = ", ".join(["%s"] * len(accounts))
+            cursor.execute(
+                f"SELECT email, id FROM accounts WHERE email IN ({placeholders})",
+                tuple(acc["email"] for acc in accounts)
+            )
+            ids = dict(cursor.fetchall())
+            conn.commit()
+            cursor.close()
+            conn.close()
+            return ids
+        except Exception as e:
+            conn.rollback()
+            cursor.close()
+            conn.close()
+            raise e
+
+    def _mysql_datetime(self, value):
+        """Normalise une date pour MySQL (datetime ou None)"""
+        if isinstance(value, str):
+            try:
+                return datetime.fromisoformat(value)
+            except ValueError:
+                return None
+        return value
+
+    def iter_accounts(self, chunk_size=500):
+        """Parcourt tous les comptes, secrets compris, par ordre d'ID croissant"""
+        conn = self.mysql_manager.get_read_connection()
+        if not conn:
+            raise Exception("Connexion MySQL impossible")
+
+        cursor = self.get_stream_cursor(conn)
+        try:
+            cursor.execute(
+                "SELECT id, email, password, token, token_expires_at, created_at, provider FROM accounts ORDER BY id"
+            )
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                for row in rows:
+                    yield Account.from_row(row)
+        finally:
+            if not USING_PYMYSQL:
+                try:
+                    conn.consume_results()
+                except Exception:
+                    pass
+            cursor.close()
+            conn.close()
+
+    def save_token(self, account_id, token, expires_at):
+        """Sauvegarde un token (mis en file si la base est hors service)"""
+        self._write_or_queue("tokens", [(account_id, token, expires_at)],
+                             lambda: self._save_token_mysql(account_id, token, expires_at))
+
+    def _save_token_mysql(self, account_id, token, expires_at):
+        """Écriture MySQL d'un token"""
+        conn = self._get_connection()
+        if not conn:
+            raise Exception("Connexion MySQL impossible")
+        
+        try:
+            cursor = conn.cursor()
+            cursor.execute(
+                "UPDATE accounts SET token=%s, token_expires_at=%s WHERE id=%s",
+                (token, expires_at, account_id)
+            )
+            conn.commit()
+            cursor.close()
+            conn.close()
+        except Exception as e:
+            conn.close()
+            raise e
+
+    def save_tokens_batch(self, tokens):
+        """Sauvegarde plusieurs tokens en une écriture : liste de (account_id, token, expires_at)"""
+        if not tokens:
+            return
+        self._write_or_queue("tokens", [list(item) for item in tokens],
+                             lambda: self._save_tokens_batch_mysql(tokens))
+
+    def _save_tokens_batch_mysql(self, tokens):
+        """Écriture MySQL d'un lot de tokens"""
+        conn = self._get_connection()
+        if not conn:
+            raise Exception("Connexion MySQL impossible")
+        
+        try:
+            cursor = conn.cursor()
+            cursor.executemany(
+                "UPDATE accounts SET token=%s, token_expires_at=%s WHERE id=%s",
+                [(token, expires_at, account_id) for account_id, token, expires_at in tokens]
+            )
+            conn.commit()
+            cursor.close()
+            conn.close()
+        except Exception as e:
+            conn.close()
+            raise e
+
+    def touch_account(self, account_id, used_at):
+        """Enregistre la dernière utilisation réelle d'un compte"""
+        conn = self._get_connection()
+        if not conn:
+            raise Exception("Connexion MySQL impossible")
+
+        try:
+            cursor = conn.cursor()
+            cursor.execute("UPDATE accounts SET last_used_at=%s WHERE id=%s", (used_at, account_id))
+            conn.commit()
+            cursor.close()
+            conn.close()
+        except Exception as e:
+            conn.close()
+            raise e
+
+    def get_accounts_needing_token(self, refresh_before, active_since, limit=500, providers=None):
+        """Comptes actifs dont le token manque ou expire avant `refresh_before`"""
+        if providers is not None and not providers:
+            return []
+        conn = self._get_read_connection()
+        if not conn:
+            raise Exception("Connexion MySQL impossible")
+
+        try:
+            provider_filter = ""
+            params = [refresh_before, active_since]
+            if providers is not None:
+                provider_filter = f"AND provider IN ({', '.join(['%s'] * len(providers))})"
+                params.extend(providers)
+            cursor = self.get_dict_cursor(conn)
+            cursor.execute(
+                f"""
+                SELECT id, email, password, token_expires_at, provider FROM accounts
+                WHERE (token IS NULL OR token_expires_at IS NULL OR token_expires_at < %s)
+                  AND COALESCE(last_used_at, created_at) >= %s
+                  {provider_filter}
+                ORDER BY token_expires_at IS NOT NULL, token_expires_at
+                LIMIT %s
+                """,
+                tuple(params + [limit])
+            )
+            rows = cursor.fetchall()
+            cursor.close()
+            conn.close()
+            return rows
+        except Exception as e:
+            conn.close()
+            raise e
+
+    def get_valid_token(self, account_id, min_validity_seconds=0):
+        """Récupère un token valide encore au moins `min_validity_seconds` secondes"""
+        threshold = datetime.now() + timedelta(seconds=min_validity_seconds)
+        conn = self._get_read_connection()
+        if not conn:
+            raise Exception("Connexion MySQL impossible")
+
+        try:
+            cursor = self.get_dict_cursor(conn)
+            cursor.execute(
+                "SELECT token, token_expires_at FROM accounts WHERE id=%s", 
+                (account_id,)
+            )
+            result = cursor.fetchone()
+            cursor.close()
+            conn.close()
+
+            if not result or not result['token']:
+                return None
+
+            if result['token_expires_at'] and result['token_expires_at'] > threshold:
+                return result['token']
+            else:
+                return None
+        except Exception as e:
+            conn.close()
+            raise e
+
+    def clear_token(self, account_id):
+        """Supprime un token"""
+        self._write_or_queue("clear_token", [account_id], lambda: self._clear_token_mysql(account_id))
+
+    def _clear_token_mysql(self, account_id):
+        """Écriture MySQL de la suppression d'un token"""
+        conn = self._get_connection()
+        if not conn:
+            raise Exception("Connexion MySQL impossible")
+        
+        try:
+            cursor = conn.cursor()
+            cursor.execute(
+                "UPDATE accounts SET token=NULL, token_expires_at=NULL WHERE id=%s",
+                (account_id,)
+            )
+            conn.commit()
+            cursor.close()
+            conn.close()
+        except Exception as e:
+            conn.close()
+            raise e
+
+    def get_dict_cursor(self, conn):
+        """Crée un curseur de dictionnaire de manière compatible."""
+        if USING_PYMYSQL:
+            import pymysql.cursors
+            return conn.cursor(pymysql.cursors.DictCursor)
+        else:
+            return conn.cursor(dictionary=True)
+
+    def get_stream_cursor(self, conn):
+        """Crée un curseur de dictionnaire non bufferisé (lignes lues au fil de l'eau côté serveur)"""
+        if USING_PYMYSQL:
+            import pymysql.cursors
+            return conn.cursor(pymysql.cursors.SSDictCursor)
+        else:
+            return conn.cursor(dictionary=True, buffered=False)
+
+    def get_all_accounts(self):
+        """Récupère tous les comptes attribués (hors réserve)"""
+        conn = self._get_read_connection()
+        if not conn:
+            raise Exception("Connexion MySQL impossible")
+
+        try:
+            cursor = self.get_dict_cursor(conn)
+            cursor.execute("SELECT id, email, password, token, created_at, token_expires_at, provider FROM accounts WHERE pooled=0")
+            rows = cursor.fetchall()
+            cursor.close()
+            conn.close()
+            return [Account.from_row(row) for row in rows]
+        except Exception as e:
+            conn.close()
+            raise e
+
+    def search_accounts(self, text, limit=20):
+        """Comptes attribués dont l'adresse commence par `text`, puis ceux qui la contiennent"""
+        text = (text or "").strip().lower()
+        conn = self._get_read_connection()
+        if not conn:
+            raise Exception("Connexion MySQL impossible")
+
+        pattern = text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        query = "SELECT id, email, created_at, provider FROM accounts WHERE pooled=0 AND email LIKE %s"
+        try:
+            cursor = self.get_dict_cursor(conn)
+            # Préfixe : parcours de plage sur idx_pooled_email, déjà dans l'ordre
+            cursor.execute(query + " ORDER BY email LIMIT %s", (pattern + "%", limit))
+            rows = cursor.fetchall()
+            if len(rows) < limit and text:
+                cursor.execute(
+                    query + " AND email NOT LIKE %s ORDER BY email LIMIT %s",
+                    ("%" + pattern + "%", pattern + "%", limit - len(rows))
+                )
+                rows += cursor.fetchall()
+            cursor.close()
+            conn.close()
+            return [Account.from_row(row) for row in rows]
+        except Exception as e:
+            conn.close()
+            raise e
+
+    def get_pooled_accounts(self, limit=100):
+        """Comptes en réserve, les plus anciens d'abord"""
+        conn = self._get_read_connection()
+        if not conn:
+            raise Exception("Connexion MySQL impossible")
+
+        try:
+            cursor = self.get_dict_cursor(conn)
+            cursor.execute(
+                "SELECT id, email, password, token, token_expires_at, created_at, provider FROM accounts "
+                "WHERE pooled=1 ORDER BY id LIMIT %s",
+                (limit,)
+            )
+            rows = cursor.fetchall()
+            cursor.close()
+            conn.close()
+            return [Account.from_row(row) for row in rows]
+        except Exception as e:
+            conn.close()
+            raise e
+
+    def claim_pooled_account(self, account_id):
+        """Sort un compte de la réserve ; False s'il a déjà été attribué (autre processus)"""
+        conn = self._get_connection()
+        if not conn:
+            raise Exception("Connexion MySQL impossible")
+
+        try:
+            cursor = conn.cursor()
+            # Mise à jour conditionnelle : une seule attribution gagne
+            cursor.execute("UPDATE accounts SET pooled=0 WHERE id=%s AND pooled=1", (account_id,))
+            claimed = cursor.rowcount == 1
+            conn.commit()
+            cursor.close()
+            conn.close()
+            return claimed
+        except Exception as e:
+            conn.close()
+            raise e
+
+    def get_account_by_email(self, email):
+        """Récupère un compte par email"""
+        conn = self._get_read_connection()
+        if not conn:
+            raise Exception("Connexion MySQL impossible")
+
+        try:
+            cursor = self.get_dict_cursor(conn)
+            cursor.execute("SELECT * FROM accounts WHERE email=%s", (email,))
+            row = cursor.fetchone()
+            cursor.close()
+            conn.close()
+            return Account.from_row(row)
+        except Exception as e:
+            conn.close()
+            raise e
+
+    def get_account_by_id(self, account_id):
+        """Récupère un compte par ID"""
+        conn = self._get_read_connection()
+        if not conn:
+            raise Exception("Connexion MySQL impossible")
+
+        try:
+            cursor = self.get_dict_cursor(conn)
+            cursor.execute("SELECT * FROM accounts WHERE id=%s", (account_id,))
+            row = cursor.fetchone()
+            cursor.close()
+            conn.close()
+            return Account.from_row(row)
+        except Exception as e:
+            conn.close()
+            raise e
+
+    def _get_connection(self, for_write=True):
+        """Connexion de la session en cours du thread, sinon connexion propre à l'appel (primaire)"""
+        if for_write:
+            self.mysql_manager.mark_write()
+        session_conn = getattr(self._session_state, "conn", None)
+        if session_conn is not None:
+            return session_conn
+        return self.mysql_manager.get_connection()
+
+    def _get_read_connection(self):
+        """Connexion des lectures seules : session en cours, sinon réplica (voir get_read_connection)"""
+        session_conn = getattr(self._session_state, "conn", None)
+        if session_conn is not None:
+            return session_conn
+        return self.mysql_manager.get_read_connection()
+
+    def get_replica_status(self):
+        """État des réplicas de lecture (liste vide sans réplica)"""
+        return self.mysql_manager.get_replica_status()
+
+    def _enable_circuit_breaker(self):
+        """Branche le disjoncteur et sa file durable ; rejoue une file laissée par une exécution précédente"""
+        self.offline_journal = OfflineJournal(DB_OFFLINE_QUEUE_FILE)
+        self.circuit_breaker = CircuitBreaker(
+            self.mysql_manager.ping,
+            on_recover=self._replay_offline_writes,
+            on_state_change=self._on_circuit_state,
+            failure_threshold=DB_FAILURE_THRESHOLD,
+            retry_interval=DB_RETRY_INTERVAL,
+            health_interval=DB_HEALTH_CHECK_INTERVAL,
+            recovery_lock=self.offline_journal.lock
+        )
+        self.mysql_manager.breaker = self.circuit_breaker
+        if self.offline_journal.pending():
+            try:
+                self._replay_offline_writes()
+            except Exception:
+                pass  # Nouvel essai à la prochaine reprise
+        self.circuit_breaker.start()
+
+    def _on_circuit_state(self, state):
+        if state == OPEN:
+            self.mysql_manager.connection_status = "hors_service"
+            self.status_message = "MySQL indisponible - écritures mises en file"
+        elif state == CLOSED:
+            self.mysql_manager.connection_status = "connecté"
+            self.status_message = "Connecté à MySQL"
+
+    def get_offline_status(self):
+        """État du disjoncteur et nombre d'écritures en attente (None sans disjoncteur)"""
+        if not self.circuit_breaker:
+            return None
+        return {
+            "state": self.circuit_breaker.state,
+            "pending_writes": self.offline_journal.pending(),
+            "stats": dict(self.circuit_breaker.stats)
+        }
+
+    def _queue_offline(self, op, payloads):
+        """Met des écritures en file durable si la base est hors service ; True si mises en file"""
+        breaker = self.circuit_breaker
+        if not breaker or breaker.allow():
+            return False
+        with self.offline_journal.lock:
+            # Reprise terminée pendant l'attente du verrou : écriture directe
+            if breaker.allow():
+                return False
+            self.offline_journal.append(op, payloads)
+        return True
+
+    def _write_or_queue(self, op, payloads, write):
+        """Exécute `write()`, ou met les écritures en file si la base est (ou tombe) hors service
+
+        Retourne le résultat de `write()`, ou True si les écritures ont été mises en file.
+        """
+        if self._queue_offline(op, payloads):
+            return True
+        try:
+            return write()
+        except Exception:
+            if self.circuit_breaker:
+                self.circuit_breaker.confirm_failure()
+            if self._queue_offline(op, payloads):
+                return True
+            raise
+
+    def _replay_offline_writes(self):
+        """Rejoue dans l'ordre, par lots, les écritures mises en file pendant une panne
+
+        Les opérations sont idempotentes (emails dédupliqués par message_id,
+        tokens écrasés) : un rejeu interrompu peut reprendre depuis le début du
+        lot en cours sans doublon.
+        """
+        journal = self.offline_journal
+        with journal.lock:
+            entries = journal.read()
+            done = 0
+            try:
+                for op, payloads in replay_groups(entries):
+                    for start in range(0, len(payloads), OFFLINE_REPLAY_BATCH):
+                        chunk = payloads[start:start + OFFLINE_REPLAY_BATCH]
+                        if op == "email":
+                            self.save_received_emails(chunk)
+                        elif op == "tokens":
+                            self._save_tokens_batch_mysql([
+                                (account_id, token, self._mysql_datetime(expires_at))
+                                for account_id, token, expires_at in chunk
+                            ])
+                        elif op == "clear_token":
+                            for account_id in chunk:
+                                self._clear_token_mysql(account_id)
+                        done += len(chunk)
+            except Exception:
+                journal.truncate(entries[done:])
+                raise
+            journal.truncate([])
+        return done
+
+    @contextmanager
+    def session(self, transactional=False):
+        """Connexion partagée par les appels du bloc (même thread) ; une seule transaction si `transactional`
+
+        Disjoncteur ouvert, une session simple s'ouvre sans connexion partagée
+        pour que ses écritures soient mises en file plutôt que perdues.
+        """
+        if getattr(self._session_state, "conn", None) is not None:
+            yield self
+            return
+        
+        conn = self.mysql_manager.get_connection()
+        if not conn:
+            if self.circuit_breaker and not transactional:
+                # Base hors service : chaque appel repasse par _write_or_queue, qui met les écritures en file
+                yield self
+                return
+            raise Exception("Connexion MySQL impossible")
+        
+        session_conn = _SessionConnection(conn, transactional)
+        self._session_state.conn = session_conn
+        try:
+            if transactional:
+                self._begin(conn)
+            yield self
+            if transactional:
+                if session_conn.failed:
+                    # Erreur interceptée par l'appelant : la session n'est pas validée pour autant
+                    raise Exception("Transaction de session annulée")
+                conn.commit()
+        except BaseException:
+            if transactional:
+                try:
+                    conn.rollback()
+                except Exception:
+                    pass
+            raise
+        finally:
+            self._session_state.conn = None
+            session_conn.release()
+            # Validation en fin de bloc : la fenêtre de lecture sur le primaire part d'ici
+            self.mysql_manager.mark_write()
+
+    def _begin(self, conn):
+        """Démarre une transaction explicite sur la connexion"""
+        if USING_PYMYSQL:
+            conn.begin()
+        else:
+            conn.start_transaction()
+
+    def _acquire_blob(self, cursor, content):
+        """Référence un blob MySQL (création si absent) et retourne son empreinte"""
+        blob_hash = content_hash(content)
+        # Cas courant : le corps existe déjà, on évite de renvoyer le contenu
+        cursor.execute("UPDATE blobs SET ref_count = ref_count + 1 WHERE hash=%s", (blob_hash,))
+        if cursor.rowcount == 0:
+            cursor.execute(
+                """
+                INSERT INTO blobs (hash, content, size, ref_count) VALUES (%s, %s, %s, 1)
+                ON DUPLICATE KEY UPDATE ref_count = ref_count + 1
+                """,
+                (blob_hash, content or "", len((content or "").encode('utf-8')))
+            )
+        return blob_hash
+
+    def _release_blobs(self, cursor, blob_hashes):
+        """Décrémente les références MySQL et supprime les blobs devenus orphelins"""
+        if isinstance(blob_hashes, Counter):
+            counts = Counter({h: c for h, c in blob_hashes.items() if h})
+        else:
+            counts = Counter(h for h in blob_hashes if h)
+        if not counts:
+            return
+        for blob_hash, count in counts.items():
+            cursor.execute(
+                "UPDATE blobs SET ref_count = ref_count - %s WHERE hash=%s",
+                (count, blob_hash)
+            )
+        placeholders = ", ".join(["%s"] * len(counts))
+        cursor.execute(
+            f"DELETE FROM blobs WHERE ref_count <= 0 AND hash IN ({placeholders})",
+            tuple(counts)
+        )
+
+    def _load_email_body(self, email_id):
+        """Lit le corps d'un email MySQL (chargement différé des listes)"""
+        conn = self._get_read_connection()
+        if not conn:
+            raise Exception("Connexion MySQL impossible")
+        
+        try:
+            cursor = conn.cursor()
+            cursor.execute(
+                "SELECT COALESCE(b.content, e.body) FROM received_emails e "
+                "LEFT JOIN blobs b ON b.hash = e.body_hash WHERE e.id=%s",
+                (email_id,)
+            )
+            rows = cursor.fetchall()
+            cursor.close()
+            conn.close()
+            return rows[0][0] if rows else None
+        except Exception as e:
+            conn.close()
+            raise e
+
+    def _load_email_text(self, email_id):
+        """Lit le texte brut précalculé d'un email HTML (chargement différé des listes)"""
+        conn = self._get_read_connection()
+        if not conn:
+            raise Exception("Connexion MySQL impossible")
+        
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT body_text FROM received_emails WHERE id=%s", (email_id,))
+            rows = cursor.fetchall()
+            cursor.close()
+            conn.close()
+            return rows[0][0] if rows else None
+        except Exception as e:
+            conn.close()
+            raise e
+
+    def _email_records(self, rows, lazy_body=False):
+        """Convertit des lignes MySQL en ReceivedEmail (corps et texte différés si `lazy_body`)"""
+        if not lazy_body:
+            return [ReceivedEmail.from_row(row) for row in rows]
+        return [
+            ReceivedEmail(
+                body_loader=lambda email_id=row["id"]: self._load_email_body(email_id),
+                text_loader=(lambda email_id=row["id"]: self._load_email_text(email_id)) if row.get("is_html") else None,
+                **row
+            )
+            for row in rows
+        ]
+
+    def _offline_email(self, row):
+        """Ligne d'email pour la file durable, datée de sa réception réelle"""
+        return dict(row, received_at=self._local_datetime_str(row.get("received_at") or datetime.now()))
+
+    def write_received_emails(self, rows):
+        """Enregistre un lot d'emails ; base hors service : mis en file (True pour chacun)"""
+        saved = self._write_or_queue("email", [self._offline_email(row) for row in rows],
+                                     lambda: self.save_received_emails(rows))
+        return [True] * len(rows) if saved is True else saved
+
+    def save_received_emails(self, rows):
+        """Sauvegarde un lot d'emails en une seule écriture et retourne leurs IDs (None si doublon)"""
+        conn = self._get_connection()
+        if not conn:
+            raise Exception("Connexion MySQL impossible")
+
+        cursor = conn.cursor()
+        try:
+            # Une seule transaction (et un seul fsync) pour tout le lot
+            self._begin(conn)
+            saved_ids = [self._insert_received_email(cursor, row) for row in rows]
+            conn.commit()
+            cursor.close()
+            conn.close()
+            return saved_ids
+        except Exception as e:
+            conn.rollback()
+            cursor.close()
+            conn.close()
+            raise e
+
+    def _insert_received_email(self, cursor, row):
+        """Insère un email dans la transaction courante et retourne son ID (None si doublon)"""
+        account_id = row["account_id"]
+        message_id = row.get("message_id")
+        body = row.get("body")
+        metadata = message_metadata(body)
+        
+        if self.partitioned and message_id:
+            # La clé unique partitionnée inclut received_at : contrôle applicatif
+            cursor.execute(
+                "SELECT id FROM received_emails WHERE account_id=%s AND message_id=%s LIMIT 1",
+                (account_id, message_id)
+            )
+            if cursor.fetchall():
+                return None
+        
+        try:
+            # L'email est inséré avant le blob : un doublon ne touche pas aux références
+            cursor.execute(
+                """
+                INSERT INTO received_emails
+                    (account_id, message_id, sender, recipient, subject, body_hash, received_at,
+                     body_text, preview, body_size, is_html)
+                VALUES (%s, %s, %s, %s, %s, %s, COALESCE(%s, CURRENT_TIMESTAMP), %s, %s, %s, %s)
+                """,
+                (account_id, message_id, row.get("sender"), row.get("recipient"),
+                 row.get("subject"), content_hash(body), self._mysql_datetime(row.get("received_at")),
+                 metadata["body_text"], metadata["preview"], metadata["body_size"], metadata["is_html"])
+            )
+        except IntegrityError:
+            return None  # Email ignoré (déjà existant), seule l'instruction est annulée
+        
+        last_id = cursor.lastrowid
+        self._acquire_blob(cursor, body)
+        artifacts = self._artifact_records(last_id, row, self._mysql_datetime(row.get("received_at")))
+        if artifacts:
+            cursor.executemany(
+                """
+                INSERT INTO email_artifacts
+                    (email_id, account_id, kind, value, domain, sender, sender_domain, position, received_at)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, COALESCE(%s, CURRENT_TIMESTAMP))
+                """,
+                [(a["email_id"], a["account_id"], a["kind"], a["value"][:2048], a["domain"],
+                  a["sender"], a["sender_domain"], a["position"], a["received_at"]) for a in artifacts]
+            )
+        self._insert_attachments(cursor, self._attachment_records(last_id, row))
+        cursor.execute(
+            """
+            INSERT INTO email_search (email_id, account_id, received_at, sender, subject, body)
+            VALUES (%s, %s, COALESCE(%s, CURRENT_TIMESTAMP), %s, %s, %s)
+            """,
+            (last_id, account_id, self._mysql_datetime(row.get("received_at")),
+             row.get("sender"), row.get("subject"), index_text(body))
+        )
+        return last_id
+
+    def _insert_attachments(self, cursor, records):
+        if records:
+            cursor.executemany(
+                """
+                INSERT INTO email_attachments
+                    (email_id, account_id, kind, filename, content_type, size, content_hash, position)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+                """,
+                [(a["email_id"], a["account_id"], a["kind"], a["filename"], a["content_type"],
+                  a["size"], a["content_hash"], a["position"]) for a in records]
+            )
+
+    def get_email_attachments(self, email_id, account_id=None):
+        """Pièces jointes et source d'un email (métadonnées)"""
+        conn = self._get_read_connection()
+        if not conn:
+            raise Exception("Connexion MySQL impossible")
+
+        try:
+            cursor = self.get_dict_cursor(conn)
+            cursor.execute(
+                """
+                SELECT email_id, account_id, kind, filename, content_type, size, content_hash, position
+                FROM email_attachments WHERE email_id=%s
+                ORDER BY kind <> 'attachment', position
+                """,
+                (email_id,)
+            )
+            rows = cursor.fetchall()
+            cursor.close()
+            conn.close()
+            return rows
+        except Exception as e:
+            conn.close()
+            raise e
+
+    def add_email_attachment(self, email_id, account_id, attachment):
+        """Rattache après coup un contenu à un email (p. ex. source .eml téléchargée à la demande)"""
+        conn = self._get_connection()
+        if not conn:
+            raise Exception("Connexion MySQL impossible")
+
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT COUNT(*) FROM email_attachments WHERE email_id=%s", (email_id,))
+            position = cursor.fetchall()[0][0]
+            record = self._attachment_records(email_id, {"account_id": account_id, "attachments": [attachment]})[0]
+            record["position"] = position
+            self._insert_attachments(cursor, [record])
+            conn.commit()
+            cursor.close()
+            conn.close()
+        except Exception as e:
+            conn.close()
+            raise e
+
+    def delete_received_email(self, email_id, account_id=None):
+        """Supprime un email reçu et libère son blob"""
+        conn = self._get_connection()
+        if not conn:
+            raise Exception("Connexion MySQL impossible")
+
+        cursor = conn.cursor()
+        try:
+            self._begin(conn)
+            cursor.execute("SELECT body_hash FROM received_emails WHERE id=%s FOR UPDATE", (email_id,))
+            rows = cursor.fetchall()
+            if not rows:
+                # Rien n'a été écrit : la validation libère le verrou sans annuler la session
+                conn.commit()
+                cursor.close()
+                conn.close()
+                return False
+            cursor.execute("DELETE FROM email_artifacts WHERE email_id=%s", (email_id,))
+            cursor.execute("DELETE FROM email_attachments WHERE email_id=%s", (email_id,))
+            cursor.execute("DELETE FROM email_search WHERE email_id=%s", (email_id,))
+            cursor.execute("DELETE FROM received_emails WHERE id=%s", (email_id,))
+            self._release_blobs(cursor, [rows[0][0]])
+            conn.commit()
+            cursor.close()
+            conn.close()
+            return True
+        except Exception as e:
+            conn.rollback()
+            cursor.close()
+            conn.close()
+            raise e
+
+    def delete_account(self, account_id):
+        """Supprime un compte, ses emails et libère les blobs associés"""
+        conn = self._get_connection()
+        if not conn:
+            raise Exception("Connexion MySQL impossible")
+
+        cursor = conn.cursor()
+        try:
+            self._begin(conn)
+            cursor.execute(
+                "SELECT body_hash FROM received_emails WHERE account_id=%s FOR UPDATE",
+                (account_id,)
+            )
+            blob_hashes = [row[0] for row in cursor.fetchall()]
+            cursor.execute("DELETE FROM email_artifacts WHERE account_id=%s", (account_id,))
+            cursor.execute("DELETE FROM email_attachments WHERE account_id=%s", (account_id,))
+            cursor.execute("DELETE FROM email_search WHERE account_id=%s", (account_id,))
+            cursor.execute("DELETE FROM received_emails WHERE account_id=%s", (account_id,))
+            self._release_blobs(cursor, blob_hashes)
+            cursor.execute("DELETE FROM accounts WHERE id=%s", (account_id,))
+            deleted = cursor.rowcount > 0
+            conn.commit()
+            cursor.close()
+            conn.close()
+            return deleted
+        except Exception as e:
+            conn.rollback()
+            cursor.close()
+            conn.close()
+            raise e
+
+    def collect_garbage_blobs(self):
+        """Supprime les blobs qui ne sont plus référencés par aucun email"""
+        conn = self._get_connection()
+        if not conn:
+            raise Exception("Connexion MySQL impossible")
+
+        try:
+            cursor = conn.cursor()
+            cursor.execute("""
+                DELETE b FROM blobs b
+                LEFT JOIN received_emails e ON e.body_hash = b.hash
+                WHERE e.id IS NULL
+            """)
+            removed = cursor.rowcount
+            conn.commit()
+            cursor.close()
+            conn.close()
+            return removed
+        except Exception as e:
+            conn.close()
+            raise e
+
+    def attachment_hashes(self):
+        """Empreintes des contenus joints encore référencés (lues sur le primaire)"""
+        conn = self._get_connection(for_write=False)
+        if not conn:
+            raise Exception("Connexion MySQL impossible")
+
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT DISTINCT content_hash FROM email_attachments")
+            hashes = {row[0] for row in cursor.fetchall()}
+            cursor.close()
+            conn.close()
+            return hashes
+        except Exception as e:
+            conn.close()
+            raise e
+
+    def _delete_email_rows(self, cursor, rows):
+        """Supprime des emails MySQL (id, body_hash) et libère leurs blobs"""
+        if not rows:
+            return 0
+        placeholders = ", ".join(["%s"] * len(rows))
+        email_ids = tuple(row[0] for row in rows)
+        cursor.execute(f"DELETE FROM email_artifacts WHERE email_id IN ({placeholders})", email_ids)
+        cursor.execute(f"DELETE FROM email_attachments WHERE email_id IN ({placeholders})", email_ids)
+        cursor.execute(f"DELETE FROM email_search WHERE email_id IN ({placeholders})", email_ids)
+        cursor.execute(f"DELETE FROM received_emails WHERE id IN ({placeholders})", email_ids)
+        self._release_blobs(cursor, [row[1] for row in rows])
+        return len(rows)
+
+    def purge_emails_before(self, cutoff, limit=500):
+        """Supprime au plus `limit` emails reçus avant `cutoff` et retourne leur nombre"""
+        conn = self._get_connection()
+        if not conn:
+            raise Exception("Connexion MySQL impossible")
+
+        cursor = conn.cursor()
+        try:
+            self._begin(conn)
+            cursor.execute(
+                """
+                SELECT id, body_hash FROM received_emails
+                WHERE received_at < %s ORDER BY received_at LIMIT %s FOR UPDATE
+                """,
+                (cutoff, limit)
+            )
+            deleted = self._delete_email_rows(cursor, cursor.fetchall())
+            conn.commit()
+            cursor.close()
+            conn.close()
+            return deleted
+        except Exception as e:
+            conn.rollback()
+            cursor.close()
+            conn.close()
+            raise e
+
+    def purge_excess_emails(self, max_per_account, limit=500):
+        """Ne conserve que les `max_per_account` emails les plus récents de chaque compte"""
+        conn = self._get_connection()
+        if not conn:
+            raise Exception("Connexion MySQL impossible")
+
+        cursor = conn.cursor()
+        try:
+            cursor.execute(
+                """
+                SELECT account_id FROM received_emails
+                GROUP BY account_id HAVING COUNT(*) > %s
+                """,
+                (max_per_account,)
+            )
+            account_ids = [row[0] for row in cursor.fetchall()]
+            deleted = 0
+            for account_id in account_ids:
+                if deleted >= limit:
+                    break
+                # Une transaction courte par compte pour ne pas verrouiller la table
+                self._begin(conn)
+                cursor.execute(
+                    """
+                    SELECT id, body_hash FROM received_emails
+                    WHERE account_id=%s ORDER BY received_at DESC, id DESC
+                    LIMIT %s OFFSET %s FOR UPDATE
+                    """,
+                    (account_id, limit - deleted, max_per_account)
+                )
+                deleted += self._delete_email_rows(cursor, cursor.fetchall())
+                conn.commit()
+            cursor.close()
+            conn.close()
+            return deleted
+        except Exception as e:
+            conn.rollback()
+            cursor.close()
+            conn.close()
+            raise e
+
+    def purge_expired_accounts(self, cutoff, limit=500, providers=None):
+        """Supprime les comptes dont le token a expiré (ou jamais obtenu) et inutilisés depuis `cutoff`"""
+        if providers is not None and not providers:
+            return 0
+        conn = self._get_connection()
+        if not conn:
+            raise Exception("Connexion MySQL impossible")
+
+        cursor = conn.cursor()
+        try:
+            provider_filter = ""
+            params = [cutoff, cutoff]
+            if providers is not None:
+                provider_filter = f"AND provider IN ({', '.join(['%s'] * len(providers))})"
+                params.extend(providers)
+            cursor.execute(
+                f"""
+                SELECT id FROM accounts
+                WHERE COALESCE(token_expires_at, created_at) < %s
+                  AND COALESCE(last_used_at, created_at) < %s
+                  {provider_filter}
+                ORDER BY id LIMIT %s
+                """,
+                tuple(params + [limit])
+            )
+            account_ids = [row[0] for row in cursor.fetchall()]
+            deleted = 0
+            for account_id in account_ids:
+                if deleted >= limit:
+                    break
+                self._begin(conn)
+                cursor.execute(
+                    "SELECT id, body_hash FROM received_emails WHERE account_id=%s LIMIT %s FOR UPDATE",
+                    (account_id, limit - deleted)
+                )
+                rows = cursor.fetchall()
+                deleted += self._delete_email_rows(cursor, rows)
+                if len(rows) < limit:
+                    cursor.execute(
+                        """
+                        DELETE FROM accounts WHERE id=%s
+                        AND NOT EXISTS (SELECT 1 FROM received_emails WHERE account_id=%s)
+                        """,
+                        (account_id, account_id)
+                    )
+                    deleted += cursor.rowcount
+                conn.commit()
+            cursor.close()
+            conn.close()
+            return deleted
+        except Exception as e:
+            conn.rollback()
+            cursor.close()
+            conn.close()
+            raise e
+
+    def _is_partitioned(self, cursor):
+        """Indique si la table received_emails est partitionnée"""
+        cursor.execute(
+            """
+            SELECT COUNT(*) FROM information_schema.PARTITIONS
+            WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'received_emails'
+            AND PARTITION_NAME IS NOT NULL
+            """
+        )
+        rows = cursor.fetchall()
+        return bool(rows and rows[0][0])
+
+    def _partition_bounds(self, months_ahead):
+        """Calcule les partitions mensuelles (nom, borne exclusive) jusqu'à `months_ahead`"""
+        month = datetime.now().replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+        bounds = []
+        for _ in range(months_ahead + 1):
+            next_month = (month + timedelta(days=32)).replace(day=1)
+            bounds.append((f"p{month.strftime('%Y%m')}", next_month))
+            month = next_month
+        return bounds
+
+    def enable_time_partitioning(self, months_ahead=3):
+        """Partitionne received_emails par mois
+
+        MySQL impose que la colonne de partitionnement figure dans toutes les clés
+        uniques et interdit les clés étrangères sur une table partitionnée : la clé
+        étrangère vers accounts est retirée et idx_unique_message inclut received_at.
+        La déduplication par (account_id, message_id) est alors vérifiée par
+        save_received_emails.
+        """
+        conn = self.mysql_manager.get_connection()
+        if not conn:
+            raise Exception("Connexion MySQL impossible")
+
+        try:
+            cursor = conn.cursor()
+            if self._is_partitioned(cursor):
+                self.partitioned = True
+                cursor.close()
+                conn.close()
+                return True
+
+            cursor.execute(
+                """
+                SELECT CONSTRAINT_NAME FROM information_schema.REFERENTIAL_CONSTRAINTS
+                WHERE CONSTRAINT_SCHEMA = DATABASE() AND TABLE_NAME = 'received_emails'
+                """
+            )
+            for (constraint_name,) in cursor.fetchall():
+                cursor.execute(f"ALTER TABLE received_emails DROP FOREIGN KEY `{constraint_name}`")
+
+            cursor.execute("""
+                ALTER TABLE received_emails
+                DROP PRIMARY KEY, ADD PRIMARY KEY (id, received_at),
+                DROP INDEX idx_unique_message,
+                ADD UNIQUE INDEX idx_unique_message (account_id, message_id, received_at)
+            """)
+
+            partitions = [
+                f"PARTITION p_old VALUES LESS THAN (UNIX_TIMESTAMP('{datetime.now():%Y-%m}-01'))"
+            ] + [
+                f"PARTITION {name} VALUES LESS THAN (UNIX_TIMESTAMP('{bound:%Y-%m-%d}'))"
+                for name, bound in self._partition_bounds(months_ahead)
+            ] + ["PARTITION p_future VALUES LESS THAN MAXVALUE"]
+            cursor.execute(
+                "ALTER TABLE received_emails PARTITION BY RANGE (UNIX_TIMESTAMP(received_at)) ("
+                + ", ".join(partitions) + ")"
+            )
+            conn.commit()
+            cursor.close()
+            conn.close()
+            self.partitioned = True
+            return True
+        except Exception as e:
+            conn.close()
+            raise e
+
+    def ensure_future_partitions(self, months_ahead=3):
+        """Crée les partitions mensuelles à venir en scindant la partition p_future"""
+        if not self.partitioned:
+            return 0
+        
+        conn = self.mysql_manager.get_connection()
+        if not conn:
+            raise Exception("Connexion MySQL impossible")
+        
+        try:
+            cursor = conn.cursor()
+            cursor.execute(
+                """
+                SELECT PARTITION_NAME FROM information_schema.PARTITIONS
+                WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'received_emails'
+                """
+            )
+            existing = {row[0] for row in cursor.fetchall()}
+            missing = [(name, bound) for name, bound in self._partition_bounds(months_ahead)
+                       if name not in existing]
+            if missing:
+                partitions = [
+                    f"PARTITION {name} VALUES LESS THAN (UNIX_TIMESTAMP('{bound:%Y-%m-%d}'))"
+                    for name, bound in missing
+                ] + ["PARTITION p_future VALUES LESS THAN MAXVALUE"]
+                cursor.execute(
+                    "ALTER TABLE received_emails REORGANIZE PARTITION p_future INTO ("
+                    + ", ".join(partitions) + ")"
+                )
+            cursor.close()
+            conn.close()
+            return len(missing)
+        except Exception as e:
+            conn.close()
+            raise e
+
+    def drop_partitions_before(self, cutoff):
+        """Supprime en temps constant les partitions mensuelles entièrement antérieures à `cutoff`"""
+        if not self.partitioned:
+            return []
+        
+        conn = self.mysql_manager.get_connection()
+        if not conn:
+            raise Exception("Connexion MySQL impossible")
+        
+        try:
+            cursor = conn.cursor()
+            cursor.execute(
+                """
+                SELECT PARTITION_NAME, PARTITION_DESCRIPTION FROM information_schema.PARTITIONS
+                WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'received_emails'
+                AND PARTITION_DESCRIPTION <> 'MAXVALUE'
+                """
+            )
+            cutoff_ts = cutoff.timestamp()
+            doomed = [name for name, description in cursor.fetchall()
+                      if float(description) <= cutoff_ts]
+            for name in doomed:
+                # Les références de blobs sont libérées avant de jeter la partition
+                self._begin(conn)
+                cursor.execute(
+                    f"SELECT body_hash, COUNT(*) FROM received_emails PARTITION ({name}) GROUP BY body_hash"
+                )
+                self._release_blobs(cursor, Counter(dict(cursor.fetchall())))
+                cursor.execute(
+                    f"""
+                    DELETE a FROM email_artifacts a
+                    JOIN received_emails PARTITION ({name}) AS e ON e.id = a.email_id
+                    """
+                )
+                cursor.execute(
+                    f"""
+                    DELETE a FROM email_attachments a
+                    JOIN received_emails PARTITION ({name}) AS e ON e.id = a.email_id
+                    """
+                )
+                cursor.execute(
+                    f"""
+                    DELETE s FROM email_search s
+                    JOIN received_emails PARTITION ({name}) AS e ON e.id = s.email_id
+                    """
+                )
+                conn.commit()
+                cursor.execute(f"ALTER TABLE received_emails DROP PARTITION {name}")
+            cursor.close()
+            conn.close()
+            return doomed
+        except Exception as e:
+            conn.close()
+            raise e
+
+    def query_artifacts(self, account_id, kind, sender=None, domain=None, since=None, limit=1):
+        """Interroge l'index des artefacts, du plus récent au plus ancien, sans lire les corps"""
+        conn = self._get_read_connection()
+        if not conn:
+            raise Exception("Connexion MySQL impossible")
+
+        query = """
+            SELECT email_id, account_id, kind, value, domain, sender, sender_domain, position, received_at
+            FROM email_artifacts WHERE account_id=%s AND kind=%s
+        """
+        params = [account_id, kind]
+        if sender:
+            query += " AND sender=%s" if "@" in sender else " AND sender_domain=%s"
+            params.append(sender if "@" in sender else sender.lower())
+        if domain:
+            query += " AND domain=%s"
+            params.append(domain.lower())
+        if since:
+            query += " AND received_at >= %s"
+            params.append(since)
+        query += " ORDER BY received_at DESC, email_id DESC, position ASC LIMIT %s"
+        params.append(limit)
+        try:
+            cursor = self.get_dict_cursor(conn)
+            cursor.execute(query, tuple(params))
+            rows = cursor.fetchall()
+            cursor.close()
+            conn.close()
+            return rows
+        except Exception as e:
+            conn.close()
+            raise e
+
+    def search_emails(self, query, account_id=None, since=None, until=None, limit=20, offset=0):
+        """Recherche plein texte dans le sujet, l'expéditeur et le corps, pour un compte ou tous"""
+        boolean_query = mysql_boolean_query(query)
+        if not boolean_query:
+            return {"total": 0, "results": []}
+
+        conn = self._get_read_connection()
+        if not conn:
+            raise Exception("Connexion MySQL impossible")
+
+        where = "MATCH(s.subject, s.sender, s.body) AGAINST (%s IN BOOLEAN MODE)"
+        params = [boolean_query]
+        if account_id is not None:
+            where += " AND s.account_id=%s"
+            params.append(account_id)
+        if since:
+            where += " AND s.received_at >= %s"
+            params.append(since)
+        if until:
+            where += " AND s.received_at < %s"
+            params.append(until)
+        try:
+            cursor = conn.cursor()
+            cursor.execute(
+                f"""
+                SELECT s.email_id,
+                       MATCH(s.subject, s.sender, s.body) AGAINST (%s IN BOOLEAN MODE)
+                       + 2 * MATCH(s.subject) AGAINST (%s IN BOOLEAN MODE) AS score
+                FROM email_search s WHERE {where}
+                ORDER BY score DESC, s.received_at DESC, s.email_id DESC LIMIT %s OFFSET %s
+                """,
+                (boolean_query, boolean_query, *params, limit, offset)
+            )
+            ranked = cursor.fetchall()
+            if offset == 0 and len(ranked) < limit:
+                total = len(ranked)
+            else:
+                cursor.execute(f"SELECT COUNT(*) FROM email_search s WHERE {where}", tuple(params))
+                total = cursor.fetchall()[0][0]
+            cursor.close()
+            rows = {}
+            if ranked:
+                cursor = self.get_dict_cursor(conn)
+                placeholders = ", ".join(["%s"] * len(ranked))
+                cursor.execute(EMAIL_LIST_SELECT + f" WHERE e.id IN ({placeholders})",
+                               tuple(email_id for email_id, _ in ranked))
+                rows = {email["id"]: email for email in self._email_records(cursor.fetchall(), lazy_body=True)}
+                cursor.close()
+            conn.close()
+            return {"total": total, "results": [
+                {"email": rows[email_id], "score": round(float(score), 4)}
+                for email_id, score in ranked if email_id in rows
+            ]}
+        except Exception as e:
+            conn.close()
+            raise e
+
+    def get_all_received_emails(self):
+        """Récupère tous les emails reçus"""
+        conn = self._get_read_connection()
+        if not conn:
+            raise Exception("Connexion MySQL impossible")
+
+        try:
+            cursor = self.get_dict_cursor(conn)
+            cursor.execute(EMAIL_LIST_SELECT + " ORDER BY e.received_at DESC")
+            rows = cursor.fetchall()
+            cursor.close()
+            conn.close()
+            return self._email_records(rows, lazy_body=True)
+        except Exception as e:
+            conn.close()
+            raise e
+
+    def get_received_emails_by_account(self, account_id):
+        """Récupère les emails reçus pour un compte spécifique"""
+        conn = self._get_read_connection()
+        if not conn:
+            raise Exception("Connexion MySQL impossible")
+
+        try:
+            cursor = self.get_dict_cursor(conn)
+            cursor.execute(EMAIL_LIST_SELECT + " WHERE e.account_id=%s ORDER BY e.received_at DESC", (account_id,))
+            rows = cursor.fetchall()
+            cursor.close()
+            conn.close()
+            return self._email_records(rows, lazy_body=True)
+        except Exception as e:
+            conn.close()
+            raise e
+
+    def iter_received_emails(self, account_id=None, chunk_size=500, after_id=0):
+        """Parcourt les emails reçus par ordre d'ID croissant, sans tout charger en mémoire
+
+        Curseur côté serveur lu par paquets de `chunk_size` ; la connexion
+        reste occupée tant que le générateur n'est pas épuisé ou fermé.
+        """
+        conn = self.mysql_manager.get_read_connection()
+        if not conn:
+            raise Exception("Connexion MySQL impossible")
+
+        cursor = self.get_stream_cursor(conn)
+        try:
+            if account_id is None:
+                cursor.execute(EMAIL_SELECT + " WHERE e.id > %s ORDER BY e.id", (after_id,))
+            else:
+                cursor.execute(
+                    EMAIL_SELECT + " WHERE e.account_id=%s AND e.id > %s ORDER BY e.id",
+                    (account_id, after_id)
+                )
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                for row in rows:
+                    yield ReceivedEmail.from_row(row)
+        finally:
+            # Arrêt anticipé : le reste du résultat doit être lu avant de rendre la connexion
+            if not USING_PYMYSQL:
+                try:
+                    conn.consume_results()
+                except Exception:
+                    pass
+            cursor.close()
+            conn.close()
+
+    def get_last_email_id(self):
+        """Retourne l'ID du dernier email enregistré (0 si aucun)"""
+        conn = self._get_read_connection()
+        if not conn:
+            raise Exception("Connexion MySQL impossible")
+
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT COALESCE(MAX(id), 0) FROM received_emails")
+            rows = cursor.fetchall()
+            cursor.close()
+            conn.close()
+            return rows[0][0]
+        except Exception as e:
+            conn.close()
+            raise e
+
+    def get_received_emails_after(self, last_id, account_id=None, limit=500):
+        """Récupère les emails d'ID supérieur à `last_id` (ordre croissant), pour un suivi incrémental"""
+        conn = self._get_read_connection()
+        if not conn:
+            raise Exception("Connexion MySQL impossible")
+
+        try:
+            cursor = self.get_dict_cursor(conn)
+            if account_id is None:
+                cursor.execute(EMAIL_SELECT + " WHERE e.id > %s ORDER BY e.id LIMIT %s", (last_id, limit))
+            else:
+                cursor.execute(
+                    EMAIL_SELECT + " WHERE e.account_id=%s AND e.id > %s ORDER BY e.id LIMIT %s",
+                    (account_id, last_id, limit)
+                )
+            rows = cursor.fetchall()
+            cursor.close()
+            conn.close()
+            return self._email_records(rows)
+        except Exception as e:
+            conn.close()
+            raise e
+
+    def get_received_email_by_id(self, email_id):
+        """Récupère un email par ID"""
+        conn = self._get_read_connection()
+        if not conn:
+            raise Exception("Connexion MySQL impossible")
+
+        try:
+            cursor = self.get_dict_cursor(conn)
+            cursor.execute(EMAIL_SELECT + " WHERE e.id=%s", (email_id,))
+            row = cursor.fetchone()
+            cursor.close()
+            conn.close()
+            return ReceivedEmail.from_row(row)
+        except Exception as e:
+            conn.close()
+            raise e
+
+    def get_message_ids(self, account_id):
+        """Ensemble des message_id déjà stockés pour un compte (index unique, sans lire les corps)"""
+        conn = self._get_connection(for_write=False)
+        if not conn:
+            raise Exception("Connexion MySQL impossible")
+
+        try:
+            cursor = conn.cursor()
+            cursor.execute(
+                "SELECT message_id FROM received_emails WHERE account_id=%s AND message_id IS NOT NULL",
+                (account_id,)
+            )
+            ids = {row[0] for row in cursor.fetchall()}
+            cursor.close()
+            conn.close()
+            return ids
+        except Exception as e:
+            conn.close()
+            raise e
+
+    def get_received_email_by_message_id(self, account_id, message_id):
+        """Récupère un email par (account_id, message_id)"""
+        conn = self._get_read_connection()
+        if not conn:
+            raise Exception("Connexion MySQL impossible")
+
+        try:
+            cursor = self.get_dict_cursor(conn)
+            cursor.execute(EMAIL_SELECT + " WHERE e.account_id=%s AND e.message_id=%s", (account_id, message_id))
+            rows = cursor.fetchall()
+            cursor.close()
+            conn.close()
+            return ReceivedEmail.from_row(rows[0]) if rows else None
+        except Exception as e:
+            conn.close()
+            raise e
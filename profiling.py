@@ -0,0 +1,273 @@
+import os
+import json
+import time
+import atexit
+import threading
+import functools
+from collections import defaultdict
+
+try:
+    from config import PROFILING
+except ImportError:
+    PROFILING = ""
+
+# Variable d'environnement : "1" ou "spans", "cprofile", "tracemalloc" (combinables par virgule, "all")
+ENV_VAR = "GENERATEUR_PROFILE"
+ENV_DIR = "GENERATEUR_PROFILE_DIR"
+MODES = ("spans", "cprofile", "tracemalloc")
+
+class _NullSpan:
+    """Span sans effet, partagé quand le profilage est désactivé"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_NULL_SPAN = _NullSpan()
+
+class Profiler:
+    """Collecte des spans (trace Chrome et piles repliées) et des profils par cycle
+
+    La trace `trace-<pid>.json` s'ouvre dans Perfetto, chrome://tracing ou
+    speedscope ; `stacks-<pid>.folded` est au format de flamegraph.pl. Les
+    cycles produisent en plus `cycle-<n>-<nom>.prof` (cProfile, pour snakeviz
+    ou pstats) et `cycle-<n>-<nom>.tracemalloc.txt` (allocations du cycle).
+    """
+
+    def __init__(self, modes, output_dir="profiles"):
+        self.modes = set(modes)
+        self.output_dir = output_dir
+        self.events = []
+        self.folded = defaultdict(float)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._cycle_lock = threading.Lock()
+        self._cycle_count = 0
+        self._origin = time.perf_counter()
+
+    def _stack(self):
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def span(self, name, category="app", **args):
+        return _Span(self, name, category, args)
+
+    def _record(self, name, category, start, end, child_time, args, path):
+        event = {
+            "name": name,
+            "cat": category,
+            "ph": "X",
+            "ts": round((start - self._origin) * 1e6, 1),
+            "dur": round((end - start) * 1e6, 1),
+            "pid": os.getpid(),
+            "tid": threading.get_ident()
+        }
+        if args:
+            event["args"] = {key: str(value) for key, value in args.items()}
+        self_time = max(0.0, end - start - child_time)
+        with self._lock:
+            self.events.append(event)
+            self.folded[path] += self_time
+
+    def cycle(self, name):
+        return _Cycle(self, name)
+
+    def dump(self):
+        """Écrit la trace et les piles repliées ; retourne le chemin de la trace"""
+        if not self.events:
+            return None
+        os.makedirs(self.output_dir, exist_ok=True)
+        pid = os.getpid()
+        trace_path = os.path.join(self.output_dir, f"trace-{pid}.json")
+        with self._lock:
+            events = list(self.events)
+            folded = dict(self.folded)
+        with open(trace_path, 'w') as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+        with open(os.path.join(self.output_dir, f"stacks-{pid}.folded"), 'w') as f:
+            for path, seconds in sorted(folded.items()):
+                # flamegraph.pl attend des entiers : microsecondes
+                f.write(f"{path} {max(1, int(seconds * 1e6))}\n")
+        return trace_path
+
+class _Span:
+    """Mesure d'un bloc, imbriquée dans les spans en cours du même thread"""
+
+    __slots__ = ("profiler", "name", "category", "args", "start", "child_time", "path")
+
+    def __init__(self, profiler, name, category, args):
+        self.profiler = profiler
+        self.name = name
+        self.category = category
+        self.args = args
+
+    def __enter__(self):
+        stack = self.profiler._stack()
+        parent = stack[-1] if stack else None
+        self.path = f"{parent.path};{self.name}" if parent else self.name
+        self.child_time = 0.0
+        stack.append(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        end = time.perf_counter()
+        stack = self.profiler._stack()
+        stack.pop()
+        if stack:
+            stack[-1].child_time += end - self.start
+        self.profiler._record(self.name, self.category, self.start, end, self.child_time, self.args, self.path)
+        return False
+
+class _Cycle:
+    """Cycle de synchronisation ou de création : span plus cProfile et tracemalloc si demandés
+
+    Un seul cycle est profilé à la fois (cProfile ne s'imbrique pas) ; les
+    cycles concurrents ne produisent que leur span. cProfile ne voit que le
+    thread du cycle : le travail des pools de threads apparaît dans les spans.
+    """
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+        self.span = profiler.span(name, "cycle")
+        self.owner = False
+        self.profile = None
+
+    def __enter__(self):
+        profiler = self.profiler
+        self.owner = profiler._cycle_lock.acquire(blocking=False)
+        if self.owner:
+            profiler._cycle_count += 1
+            self.index = profiler._cycle_count
+            if "tracemalloc" in profiler.modes:
+                import tracemalloc
+                if not tracemalloc.is_tracing():
+                    tracemalloc.start(25)
+                self.snapshot = tracemalloc.take_snapshot()
+            if "cprofile" in profiler.modes:
+                import cProfile
+                self.profile = cProfile.Profile()
+                self.profile.enable()
+        self.span.__enter__()
+        return self
+
+    def __exit__(self, *exc):
+        self.span.__exit__(*exc)
+        if not self.owner:
+            return False
+        profiler = self.profiler
+        try:
+            os.makedirs(profiler.output_dir, exist_ok=True)
+            prefix = os.path.join(profiler.output_dir, f"cycle-{os.getpid()}-{self.index}-{self.name}")
+            if self.profile:
+                self.profile.disable()
+                self.profile.dump_stats(prefix + ".prof")
+            if "tracemalloc" in profiler.modes:
+                import tracemalloc
+                # Les allocations du profileur lui-même sont écartées
+                filters = [tracemalloc.Filter(False, pattern) for pattern in
+                           (tracemalloc.__file__, "*cProfile.py", "*profile.py", __file__, "<frozen importlib._bootstrap*>")]
+                stats = tracemalloc.take_snapshot().filter_traces(filters).compare_to(
+                    self.snapshot.filter_traces(filters), "lineno")
+                with open(prefix + ".tracemalloc.txt", 'w') as f:
+                    for stat in stats[:50]:
+                        f.write(f"{stat}\n")
+        finally:
+            profiler._cycle_lock.release()
+        return False
+
+_profiler = None
+
+def parse_modes(value):
+    """Convertit "1", "all" ou "spans,cprofile" en ensemble de modes"""
+    value = (value or "").strip().lower()
+    if not value or value in ("0", "false", "no", "off"):
+        return set()
+    if value in ("1", "true", "yes", "on"):
+        return {"spans"}
+    if value == "all":
+        return set(MODES)
+    modes = {mode.strip() for mode in value.split(",") if mode.strip() in MODES}
+    # cProfile et tracemalloc s'appuient sur les cycles, tracés comme des spans
+    return modes | {"spans"} if modes else set()
+
+def enabled():
+    return _profiler is not None
+
+def enable(modes="spans", output_dir=None):
+    """Active le profilage et retourne le profileur (idempotent)"""
+    global _profiler
+    modes = parse_modes(modes) if isinstance(modes, str) else set(modes)
+    if not modes:
+        return None
+    if _profiler is None:
+        _profiler = Profiler(modes, output_dir or os.environ.get(ENV_DIR) or "profiles")
+        atexit.register(_profiler.dump)
+    return _profiler
+
+def span(name, category="app", **args):
+    """Context manager de mesure ; sans effet si le profilage est désactivé"""
+    if _profiler is None:
+        return _NULL_SPAN
+    return _profiler.span(name, category, **args)
+
+def cycle(name):
+    """Context manager d'un cycle complet (span, plus cProfile/tracemalloc selon les modes)"""
+    if _profiler is None:
+        return _NULL_SPAN
+    return _profiler.cycle(name)
+
+def traced(func, name=None, category="app"):
+    """Enveloppe une fonction dans un span à son nom"""
+    label = name or getattr(func, "__qualname__", getattr(func, "__name__", "?"))
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if _profiler is None:
+            return func(*args, **kwargs)
+        with _profiler.span(label, category):
+            return func(*args, **kwargs)
+
+    wrapper.__profiling_wrapped__ = True
+    return wrapper
+
+def instrument(target, names, category):
+    """Remplace sur place les fonctions ou méthodes `names` de `target` par leur version tracée"""
+    for name in names:
+        func = getattr(target, name, None)
+        if func is None or getattr(func, "__profiling_wrapped__", False):
+            continue
+        setattr(target, name, traced(func, category=category))
+
+def _public_methods(cls):
+    return [name for name, value in vars(cls).items() if callable(value) and not name.startswith("__")]
+
+def install():
+    """Instrumente HTTP, décodage JSON et stockage ; à appeler avant d'importer les fonctions de mail_api"""
+    if _profiler is None:
+        return
+    import storage
+    import mail_api
+    import providers
+    instrument(storage.MariaDBStorage, _public_methods(storage.MariaDBStorage), "storage")
+    instrument(mail_api, ("create_account", "create_fresh_account", "fetch_and_store_messages",
+                          "refresh_token_if_needed", "wait_for_message"), "mail_api")
+    instrument(providers.MailProvider, ("_request",), "http")
+    for provider_class in providers.PROVIDER_CLASSES.values():
+        instrument(provider_class, ("create_mailbox", "authenticate", "list_messages", "get_message"), "provider")
+    try:
+        import requests.models
+        instrument(requests.models.Response, ("json",), "json")
+    except ImportError:
+        pass
+
+def install_from_env():
+    """Active et installe le profilage si GENERATEUR_PROFILE (ou config.PROFILING) le demande"""
+    if enable(os.environ.get(ENV_VAR) or PROFILING):
+        install()
+    return _profiler
@@ -0,0 +1,524 @@
+import sys
+import os
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+if current_dir not in sys.path:
+    sys.path.insert(0, current_dir)
+
+import requests
+import json
+import base64
+import time
+import random
+import string
+import threading
+from abc import ABC, abstractmethod
+from email import message_from_string
+from email.utils import parseaddr
+from datetime import datetime
+
+try:
+    from config import API
+except ImportError:
+    API = "https://api.mail.tm"
+
+try:
+    from config import MAILDROP_API
+except ImportError:
+    MAILDROP_API = "https://api.maildrop.cc/graphql"
+
+try:
+    from config import DOMAINS_CACHE_SECONDS
+except ImportError:
+    DOMAINS_CACHE_SECONDS = 300
+
+try:
+    from config import MAIL_PROVIDERS
+except ImportError:
+    MAIL_PROVIDERS = ("mailtm", "maildrop")
+
+try:
+    from config import PROVIDER_RATE_LIMITS
+except ImportError:
+    # Requêtes par seconde tolérées par chaque fournisseur
+    PROVIDER_RATE_LIMITS = {"mailtm": 8.0, "maildrop": 2.0}
+
+DEFAULT_PROVIDER = "mailtm"
+STREAM_CHUNK_SIZE = 64 * 1024
+
+def _iter_response(response):
+    """Morceaux d'une réponse en streaming ; la connexion est rendue à la fin"""
+    try:
+        for chunk in response.iter_content(STREAM_CHUNK_SIZE):
+            if chunk:
+                yield chunk
+    finally:
+        response.close()
+
+def _iter_bytes(content):
+    for start in range(0, len(content), STREAM_CHUNK_SIZE):
+        yield content[start:start + STREAM_CHUNK_SIZE]
+
+def _random_string(alphabet, length):
+    return ''.join(random.choices(alphabet, k=length))
+
+class RateBudget:
+    """Seau à jetons : `rate` requêtes par seconde, rafales jusqu'à `burst`"""
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = float(burst or max(1.0, rate))
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def remaining(self):
+        """Part du budget disponible (0 à 1), nulle pendant un 429"""
+        with self._lock:
+            now = time.monotonic()
+            if now < self._blocked_until:
+                return 0.0
+            self._refill(now)
+            return self._tokens / self.burst
+
+    def acquire(self):
+        """Consomme un jeton, en attendant qu'il y en ait un"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                if now >= self._blocked_until:
+                    self._refill(now)
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        return
+                    wait = (1 - self._tokens) / self.rate
+                else:
+                    wait = self._blocked_until - now
+            time.sleep(wait)
+
+    def block(self, seconds):
+        """Suspend le budget (réponse 429 avec Retry-After)"""
+        with self._lock:
+            self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+            self._tokens = 0.0
+
+class MailProvider(ABC):
+    """Fournisseur d'adresses jetables : création, authentification, liste et lecture
+
+    Les messages listés sont des dicts contenant au moins `id` (et `createdAt`
+    si connu) ; get_message retourne un message complet que message_fields
+    convertit en champs stockés. Toutes les requêtes passent par _request, qui
+    applique le budget de débit et mesure la latence (moyenne mobile
+    exponentielle) utilisée par le Dispatcher.
+    """
+
+    name = None
+    requires_token = False
+
+    def __init__(self, rate=1.0):
+        self.budget = RateBudget(rate)
+        self.latency = None
+        self.stats = {"requests": 0, "errors": 0, "throttled": 0}
+        self._consecutive_errors = 0
+        self._cooldown_until = 0.0
+        self._stats_lock = threading.Lock()
+
+    def _request(self, method, url, **kwargs):
+        self.budget.acquire()
+        started = time.monotonic()
+        try:
+            response = getattr(requests, method)(url, **kwargs)
+        except requests.RequestException:
+            self._record(time.monotonic() - started, False)
+            raise
+        if response.status_code == 429:
+            retry_after = getattr(response, "headers", {}).get("Retry-After")
+            try:
+                retry_after = float(retry_after)
+            except (TypeError, ValueError):
+                retry_after = 5.0
+            self.budget.block(retry_after)
+            with self._stats_lock:
+                self.stats["throttled"] += 1
+        self._record(time.monotonic() - started, response.status_code < 500 and response.status_code != 429)
+        return response
+
+    def _record(self, elapsed, ok):
+        with self._stats_lock:
+            self.stats["requests"] += 1
+            self.latency = elapsed if self.latency is None else 0.8 * self.latency + 0.2 * elapsed
+            if ok:
+                self._consecutive_errors = 0
+                return
+            self.stats["errors"] += 1
+            self._consecutive_errors += 1
+            if self._consecutive_errors >= 3:
+                # Fournisseur en panne : écarté des créations pendant une minute
+                self._cooldown_until = time.monotonic() + 60
+
+    def available(self):
+        return time.monotonic() >= self._cooldown_until
+
+    def snapshot(self):
+        """Métriques courantes (latence en secondes, budget restant de 0 à 1)"""
+        with self._stats_lock:
+            stats = dict(self.stats)
+        stats["latency"] = round(self.latency, 3) if self.latency is not None else None
+        stats["budget"] = round(self.budget.remaining(), 2)
+        stats["available"] = self.available()
+        return stats
+
+    @abstractmethod
+    def create_mailbox(self):
+        """Crée une adresse ; retourne un dict avec `address`, `password` (ou None)"""
+
+    def authenticate(self, address, password):
+        """Retourne (token, échéance) ou None ; toujours None pour les boîtes publiques"""
+        return None
+
+    @abstractmethod
+    def list_messages(self, address, token=None):
+        """Liste légère des messages (sans corps) ; None en cas d'échec"""
+
+    @abstractmethod
+    def get_message(self, address, message_id, token=None):
+        """Message complet, ou None"""
+
+    @abstractmethod
+    def message_fields(self, full_message, account):
+        """Champs stockés (sender, recipient, subject, body, message_id)"""
+
+    def attachments(self, full_message):
+        """Pièces jointes annoncées par un message complet (filename, content_type, size, ...)"""
+        return []
+
+    def stream_attachment(self, address, attachment, token=None):
+        """Contenu d'une pièce jointe par morceaux (itérateur de bytes), ou None"""
+        return None
+
+    def stream_source(self, address, message_id, token=None, full_message=None):
+        """Source MIME brute (.eml) par morceaux, ou None"""
+        return None
+
+class MailTmProvider(MailProvider):
+    """API REST Mail.tm (comptes avec mot de passe et JWT)"""
+
+    name = "mailtm"
+    requires_token = True
+
+    def __init__(self, rate=8.0, api=API):
+        super().__init__(rate)
+        self.api = api
+        self._domains_cache = {"domains": None, "fetched_at": 0.0}
+
+    @staticmethod
+    def _members(data):
+        """Extrait la liste d'éléments d'une réponse Hydra (ou d'une liste brute)"""
+        if isinstance(data, dict) and 'hydra:member' in data:
+            return data['hydra:member']
+        if isinstance(data, list):
+            return data
+        return None
+
+    @staticmethod
+    def token_expiry(token):
+        """Échéance (datetime locale) lue dans le claim `exp` d'un JWT, None si absente"""
+        try:
+            payload = token.split('.')[1]
+            payload += '=' * (-len(payload) % 4)
+            claims = json.loads(base64.urlsafe_b64decode(payload))
+            return datetime.fromtimestamp(int(claims['exp']))
+        except Exception:
+            return None
+
+    def get_domains(self):
+        """Domaines Mail.tm, mis en cache DOMAINS_CACHE_SECONDS secondes"""
+        cache = self._domains_cache
+        if cache["domains"] and time.monotonic() - cache["fetched_at"] < DOMAINS_CACHE_SECONDS:
+            return cache["domains"]
+        domains_response = self._request("get", f"{self.api}/domains", timeout=10)
+        if domains_response.status_code != 200:
+            return None
+        domains = self._members(domains_response.json())
+        if domains:
+            cache["domains"] = domains
+            cache["fetched_at"] = time.monotonic()
+        return domains
+
+    def create_mailbox(self):
+        domains = self.get_domains()
+        if not domains:
+            return None
+        email = f"{_random_string(string.ascii_lowercase + string.digits, 10)}@{domains[0]['domain']}"
+        password = _random_string(string.ascii_letters + string.digits, 12)
+        headers = {
+            "Content-Type": "application/json",
+            "Accept": "application/json"
+        }
+        create_response = self._request("post", f"{self.api}/accounts",
+                                        json={"address": email, "password": password},
+                                        headers=headers, timeout=15)
+        if create_response.status_code != 201:
+            return None
+        account_data = create_response.json()
+        account_data.setdefault("address", email)
+        account_data["password"] = password
+        return account_data
+
+    def authenticate(self, address, password):
+        headers = {
+            "Content-Type": "application/json",
+            "Accept": "application/json"
+        }
+        token_response = self._request("post", f"{self.api}/token",
+                                       json={"address": address, "password": password},
+                                       headers=headers, timeout=10)
+        if token_response.status_code != 200:
+            return None
+        token = token_response.json()['token']
+        return token, self.token_expiry(token)
+
+    def list_messages(self, address, token=None):
+        headers = {
+            "Authorization": f"Bearer {token}",
+            "Accept": "application/json"
+        }
+        messages_response = self._request("get", f"{self.api}/messages", headers=headers, timeout=15)
+        if messages_response.status_code != 200:
+            return None
+        return self._members(messages_response.json())
+
+    def get_message(self, address, message_id, token=None):
+        headers = {
+            "Authorization": f"Bearer {token}",
+            "Accept": "application/json"
+        }
+        response = self._request("get", f"{self.api}/messages/{message_id}", headers=headers, timeout=10)
+        if response.status_code == 200:
+            return response.json()
+        return None
+
+    def _stream(self, url, token):
+        headers = {"Authorization": f"Bearer {token}"}
+        response = self._request("get", url, headers=headers, timeout=30, stream=True)
+        if response.status_code != 200:
+            response.close()
+            return None
+        return _iter_response(response)
+
+    def attachments(self, full_message):
+        return [
+            {
+                "filename": attachment.get('filename'),
+                "content_type": attachment.get('contentType'),
+                "size": attachment.get('size'),
+                "url": attachment.get('downloadUrl')
+            }
+            for attachment in full_message.get('attachments') or []
+            if attachment.get('downloadUrl')
+        ]
+
+    def stream_attachment(self, address, attachment, token=None):
+        url = attachment["url"]
+        return self._stream(f"{self.api}{url}" if url.startswith('/') else url, token)
+
+    def stream_source(self, address, message_id, token=None, full_message=None):
+        return self._stream(f"{self.api}/messages/{message_id}/download", token)
+
+    def message_fields(self, full_message, account):
+        return {
+            "sender": full_message.get('from', {}).get('address', 'Inconnu'),
+            "recipient": full_message.get('to', [{}])[0].get('address', account['email']),
+            "subject": full_message.get('subject', 'Sans sujet'),
+            "body": full_message.get('text', full_message.get('html', '')),
+            "message_id": full_message.get('id')
+        }
+
+class MaildropProvider(MailProvider):
+    """API GraphQL Maildrop : boîtes publiques créées à la volée, sans mot de passe ni token"""
+
+    name = "maildrop"
+    requires_token = False
+    domain = "maildrop.cc"
+
+    def __init__(self, rate=2.0, api=MAILDROP_API):
+        super().__init__(rate)
+        self.api = api
+
+    def _query(self, query, variables):
+        response = self._request("post", self.api, json={"query": query, "variables": variables},
+                                 headers={"Content-Type": "application/json"}, timeout=15)
+        if response.status_code != 200:
+            return None
+        payload = response.json() or {}
+        if payload.get("errors"):
+            return None
+        return payload.get("data")
+
+    @staticmethod
+    def _mailbox(address):
+        return address.split('@', 1)[0]
+
+    def create_mailbox(self):
+        # La boîte existe dès qu'on l'interroge : une requête vérifie que l'API répond
+        address = f"{_random_string(string.ascii_lowercase + string.digits, 12)}@{self.domain}"
+        if self.list_messages(address) is None:
+            return None
+        return {"address": address, "password": None}
+
+    def list_messages(self, address, token=None):
+        data = self._query(
+            "query Inbox($mailbox: String!) { inbox(mailbox: $mailbox) { id headerfrom subject date } }",
+            {"mailbox": self._mailbox(address)}
+        )
+        if data is None:
+            return None
+        return [dict(message, createdAt=message.get("date")) for message in data.get("inbox") or []]
+
+    def get_message(self, address, message_id, token=None):
+        data = self._query(
+            "query Message($mailbox: String!, $id: String!) "
+            "{ message(mailbox: $mailbox, id: $id) { id headerfrom subject date data html } }",
+            {"mailbox": self._mailbox(address), "id": message_id}
+        )
+        return (data or {}).get("message")
+
+    @staticmethod
+    def _plain_text(raw):
+        """Partie text/plain d'un message MIME brut"""
+        if not raw:
+            return None
+        try:
+            parsed = message_from_string(raw)
+            for part in parsed.walk():
+                if part.get_content_type() == "text/plain" and not part.is_multipart():
+                    payload = part.get_payload(decode=True)
+                    if payload is not None:
+                        return payload.decode(part.get_content_charset() or "utf-8", errors="replace")
+        except Exception:
+            return None
+        return None
+
+    def attachments(self, full_message):
+        # Le message GraphQL contient déjà la source complète : les parties sont extraites de `data`
+        try:
+            parsed = message_from_string(full_message.get('data') or '')
+        except Exception:
+            return []
+        found = []
+        for part in parsed.walk():
+            filename = part.get_filename()
+            if not filename or part.is_multipart():
+                continue
+            payload = part.get_payload(decode=True) or b''
+            found.append({
+                "filename": filename,
+                "content_type": part.get_content_type(),
+                "size": len(payload),
+                "payload": payload
+            })
+        return found
+
+    def stream_attachment(self, address, attachment, token=None):
+        return _iter_bytes(attachment["payload"])
+
+    def stream_source(self, address, message_id, token=None, full_message=None):
+        if full_message is None:
+            full_message = self.get_message(address, message_id, token)
+        raw = (full_message or {}).get('data')
+        return _iter_bytes(raw.encode('utf-8', errors='surrogateescape')) if raw else None
+
+    def message_fields(self, full_message, account):
+        sender = parseaddr(full_message.get('headerfrom') or '')[1]
+        return {
+            "sender": sender or 'Inconnu',
+            "recipient": account['email'],
+            "subject": full_message.get('subject') or 'Sans sujet',
+            "body": self._plain_text(full_message.get('data')) or full_message.get('html') or '',
+            "message_id": full_message.get('id')
+        }
+
+PROVIDER_CLASSES = {
+    MailTmProvider.name: MailTmProvider,
+    MaildropProvider.name: MaildropProvider,
+}
+
+class Dispatcher:
+    """Répartit les créations de comptes entre fournisseurs
+
+    Chaque fournisseur reçoit un poids proportionnel à son budget de débit
+    restant et inversement proportionnel à sa latence mesurée ; le tirage est
+    pondéré pour que les créations concurrentes se répartissent au lieu de
+    toutes viser le plus rapide. Un fournisseur en échec répété est écarté
+    pendant son délai de refroidissement. Les synchronisations restent sur le
+    fournisseur propriétaire du compte, à son propre rythme (voir interleave).
+    """
+
+    def __init__(self, providers):
+        self.providers = {provider.name: provider for provider in providers}
+
+    def get(self, name):
+        """Fournisseur par nom ; Mail.tm pour les comptes antérieurs à la colonne provider"""
+        provider = self.providers.get(name or DEFAULT_PROVIDER)
+        if provider is None:
+            provider = PROVIDER_CLASSES[name]() if name in PROVIDER_CLASSES else None
+            if provider:
+                # Compte d'un fournisseur retiré de la configuration : toujours lisible
+                self.providers.setdefault(name, provider)
+                provider = self.providers[name]
+        return provider
+
+    def weight(self, provider):
+        latency = provider.latency if provider.latency is not None else 0.5
+        return (provider.budget.remaining() + 0.05) / max(latency, 0.01)
+
+    def choose(self, exclude=()):
+        """Fournisseur pour une nouvelle création, ou None si aucun n'est disponible"""
+        candidates = [provider for name, provider in self.providers.items()
+                      if name not in exclude and provider.available()]
+        if not candidates:
+            return None
+        return random.choices(candidates, weights=[self.weight(p) for p in candidates])[0]
+
+    def candidates(self, preferred=None):
+        """Ordre d'essai d'une création : `preferred` (ou un tirage pondéré), puis les autres"""
+        first = self.get(preferred) if preferred else self.choose()
+        ordered = [first] if first else []
+        excluded = {first.name} if first else set()
+        while True:
+            provider = self.choose(exclude=excluded)
+            if not provider:
+                break
+            ordered.append(provider)
+            excluded.add(provider.name)
+        return ordered
+
+    def interleave(self, accounts):
+        """Ordonne des comptes en alternant les fournisseurs, pour que les
+        threads de synchronisation sollicitent tous les budgets à la fois"""
+        queues = {}
+        for account in accounts:
+            queues.setdefault(account.get('provider') or DEFAULT_PROVIDER, []).append(account)
+        ordered = []
+        queues = list(queues.values())
+        for index in range(max((len(queue) for queue in queues), default=0)):
+            ordered.extend(queue[index] for queue in queues if index < len(queue))
+        return ordered
+
+    def get_stats(self):
+        return {name: provider.snapshot() for name, provider in self.providers.items()}
+
+def build_dispatcher(names=None):
+    """Dispatcher des fournisseurs configurés (MAIL_PROVIDERS, PROVIDER_RATE_LIMITS)"""
+    providers = []
+    for name in names or MAIL_PROVIDERS:
+        provider_class = PROVIDER_CLASSES.get(name)
+        if provider_class:
+            rate = PROVIDER_RATE_LIMITS.get(name)
+            providers.append(provider_class(rate) if rate else provider_class())
+    return Dispatcher(providers)
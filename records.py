@@ -0,0 +1,124 @@
+from collections.abc import Mapping
+from datetime import datetime
+
+def parse_datetime(value):
+    """Convertit une date stockée (datetime ou chaîne ISO) en datetime, None si illisible"""
+    if value is None or isinstance(value, datetime):
+        return value
+    try:
+        return datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        return None
+
+class Record(Mapping):
+    """Enregistrement compact à __slots__, lisible comme un dict en lecture seule
+
+    record['champ'], record.get('champ'), dict(record) et json.dumps(dict(record))
+    se comportent comme avec les anciens dictionnaires ; les champs sont aussi
+    accessibles en attributs. Les dates sont converties une seule fois, à la
+    construction.
+    """
+
+    __slots__ = ()
+    FIELDS = ()
+    DATETIME_FIELDS = ()
+
+    def __init__(self, **values):
+        for field in self.FIELDS:
+            value = values.get(field)
+            if field in self.DATETIME_FIELDS:
+                value = parse_datetime(value)
+            setattr(self, field, value)
+
+    @classmethod
+    def from_row(cls, row):
+        """Construit un enregistrement depuis un dict (JSON local ou DictCursor), colonnes inconnues ignorées"""
+        return cls(**row) if row is not None else None
+
+    def __getitem__(self, key):
+        if key not in self.FIELDS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __setitem__(self, key, value):
+        if key not in self.FIELDS:
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def __iter__(self):
+        return iter(self.FIELDS)
+
+    def __len__(self):
+        return len(self.FIELDS)
+
+    def __repr__(self):
+        return f"{type(self).__name__}(id={getattr(self, 'id', None)!r})"
+
+class Account(Record):
+    """Compte Mail.tm stocké"""
+
+    FIELDS = ("id", "email", "password", "token", "token_expires_at", "created_at", "pooled", "provider",
+              "last_used_at")
+    DATETIME_FIELDS = ("token_expires_at", "created_at", "last_used_at")
+    __slots__ = FIELDS
+
+    def has_valid_token(self, now=None):
+        """Indique si le token stocké est présent et non expiré"""
+        return bool(self.token and self.token_expires_at and self.token_expires_at > (now or datetime.now()))
+
+class ReceivedEmail(Record):
+    """Email reçu ; le corps peut être chargé à la demande
+
+    Avec `body_loader`, le corps n'est lu (blob store local ou requête MySQL)
+    qu'au premier accès à `body`, puis conservé. Les listes n'en paient donc le
+    coût que pour les messages effectivement ouverts ; elles s'affichent avec
+    `preview`, calculé à l'ingestion comme `body_text` (texte brut des corps
+    HTML, chargé à la demande via `text_loader`), `body_size` et `is_html`.
+    """
+
+    FIELDS = ("id", "account_id", "message_id", "sender", "recipient", "subject",
+              "body", "body_hash", "received_at", "body_text", "preview", "body_size", "is_html")
+    DATETIME_FIELDS = ("received_at",)
+    __slots__ = ("id", "account_id", "message_id", "sender", "recipient", "subject",
+                 "_body", "body_hash", "received_at", "_body_loader",
+                 "_body_text", "_text_loader", "preview", "body_size", "is_html")
+
+    def __init__(self, body_loader=None, text_loader=None, **values):
+        body = values.pop("body", None)
+        body_text = values.pop("body_text", None)
+        super().__init__(**values)
+        self._body = body
+        self._body_loader = body_loader if body is None else None
+        self._body_text = body_text
+        self._text_loader = text_loader if body_text is None else None
+        if self.is_html is not None:
+            self.is_html = bool(self.is_html)
+
+    @property
+    def body(self):
+        if self._body_loader is not None:
+            self._body = self._body_loader()
+            self._body_loader = None
+        return self._body
+
+    @body.setter
+    def body(self, value):
+        self._body = value
+        self._body_loader = None
+
+    @property
+    def body_text(self):
+        if self._text_loader is not None:
+            self._body_text = self._text_loader()
+            self._text_loader = None
+        return self._body_text
+
+    @body_text.setter
+    def body_text(self, value):
+        self._body_text = value
+        self._text_loader = None
+
+    def plain_text(self):
+        """Texte à afficher : version texte précalculée d'un corps HTML, sinon le corps"""
+        body_text = self.body_text
+        return body_text if body_text is not None else self.body
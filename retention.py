@@ -0,0 +1,158 @@
+import threading
+import time
+from datetime import datetime, timedelta
+
+import mail_api
+
+try:
+    from config import RETENTION_MAX_EMAIL_AGE_DAYS
+except ImportError:
+    RETENTION_MAX_EMAIL_AGE_DAYS = None
+
+try:
+    from config import RETENTION_MAX_EMAILS_PER_ACCOUNT
+except ImportError:
+    RETENTION_MAX_EMAILS_PER_ACCOUNT = None
+
+try:
+    from config import RETENTION_EXPIRED_ACCOUNT_DAYS
+except ImportError:
+    RETENTION_EXPIRED_ACCOUNT_DAYS = None
+
+try:
+    from config import RETENTION_PARTITIONING
+except ImportError:
+    RETENTION_PARTITIONING = False
+
+try:
+    from config import RETENTION_BATCH_SIZE, RETENTION_INTERVAL_SECONDS
+except ImportError:
+    RETENTION_BATCH_SIZE = 500
+    RETENTION_INTERVAL_SECONDS = 3600
+
+class RetentionPolicy:
+    """Politique de rétention : chaque limite à None est désactivée"""
+
+    def __init__(self, max_email_age_days=None, max_emails_per_account=None,
+                 expired_account_days=None, partitioning=False,
+                 batch_size=500, pause_seconds=0.1):
+        self.max_email_age_days = max_email_age_days
+        self.max_emails_per_account = max_emails_per_account
+        self.expired_account_days = expired_account_days
+        self.partitioning = partitioning
+        self.batch_size = batch_size
+        self.pause_seconds = pause_seconds
+
+    @classmethod
+    def from_config(cls):
+        """Construit la politique depuis config.py"""
+        return cls(
+            max_email_age_days=RETENTION_MAX_EMAIL_AGE_DAYS,
+            max_emails_per_account=RETENTION_MAX_EMAILS_PER_ACCOUNT,
+            expired_account_days=RETENTION_EXPIRED_ACCOUNT_DAYS,
+            partitioning=RETENTION_PARTITIONING,
+            batch_size=RETENTION_BATCH_SIZE
+        )
+
+    def is_enabled(self):
+        """Indique si au moins une limite est configurée"""
+        return any(limit is not None for limit in (
+            self.max_email_age_days,
+            self.max_emails_per_account,
+            self.expired_account_days
+        ))
+
+class RetentionEngine:
+    """Applique une politique de rétention par lots courts, en tâche de fond"""
+
+    def __init__(self, storage, policy, interval_seconds=RETENTION_INTERVAL_SECONDS):
+        self.storage = storage
+        self.policy = policy
+        self.interval_seconds = interval_seconds
+        self.last_run = None
+        self.last_stats = {}
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def _drain(self, purge, *args, **kwargs):
+        """Répète une purge par lots jusqu'à épuisement, en cédant la main entre chaque lot"""
+        total = 0
+        while not self._stop_event.is_set():
+            deleted = purge(*args, limit=self.policy.batch_size, **kwargs)
+            total += deleted
+            if deleted < self.policy.batch_size:
+                break
+            time.sleep(self.policy.pause_seconds)
+        return total
+
+    def run_once(self):
+        """Exécute un passage complet de la politique et retourne les volumes supprimés"""
+        policy = self.policy
+        now = datetime.now()
+        stats = {"emails_expired": 0, "emails_excess": 0, "accounts_expired": 0, "partitions_dropped": 0,
+                 "blobs_collected": 0}
+
+        if policy.max_email_age_days is not None:
+            cutoff = now - timedelta(days=policy.max_email_age_days)
+            if policy.partitioning and self.storage.partitioned:
+                # Les mois entièrement expirés sont jetés en temps constant
+                stats["partitions_dropped"] = len(self.storage.drop_partitions_before(cutoff))
+                self.storage.ensure_future_partitions()
+            stats["emails_expired"] = self._drain(self.storage.purge_emails_before, cutoff)
+
+        if policy.max_emails_per_account is not None:
+            stats["emails_excess"] = self._drain(
+                self.storage.purge_excess_emails, policy.max_emails_per_account
+            )
+
+        if policy.expired_account_days is not None:
+            cutoff = now - timedelta(days=policy.expired_account_days)
+            # Seuls les comptes à token expirent : un compte Maildrop n'en a jamais
+            stats["accounts_expired"] = self._drain(self.storage.purge_expired_accounts, cutoff,
+                                                    providers=mail_api.token_providers())
+
+        if not self._stop_event.is_set():
+            # Corps, pièces jointes et sources .eml laissés sans référence par les purges
+            # comme par les suppressions unitaires (delete_account, delete_received_email)
+            stats["blobs_collected"] = self.storage.collect_garbage_blobs()
+
+        self.last_run = now
+        self.last_stats = stats
+        return stats
+
+    def _run(self):
+        """Boucle du thread de rétention"""
+        while not self._stop_event.is_set():
+            try:
+                self.run_once()
+            except Exception:
+                pass  # Nouvelle tentative au prochain passage
+            self._stop_event.wait(self.interval_seconds)
+
+    def start(self):
+        """Démarre la purge périodique en arrière-plan"""
+        if self._thread and self._thread.is_alive():
+            return
+        if self.policy.partitioning:
+            try:
+                self.storage.enable_time_partitioning()
+            except Exception:
+                pass  # Le partitionnement reste optionnel
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="retention", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Arrête la purge périodique"""
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+
+def start_from_config(storage):
+    """Démarre le moteur de rétention si config.py définit une politique"""
+    policy = RetentionPolicy.from_config()
+    if not storage or not policy.is_enabled():
+        return None
+    engine = RetentionEngine(storage, policy)
+    engine.start()
+    return engine
@@ -0,0 +1,325 @@
+import hashlib
+import json
+import math
+import os
+import re
+import unicodedata
+from collections import Counter, defaultdict
+from datetime import datetime
+
+from locking import atomic_write_json
+
+# Poids des champs dans le classement (occurrences pondérées)
+FIELD_WEIGHTS = (("subject", 3), ("sender", 2), ("body", 1))
+MIN_TERM_LENGTH = 2
+MAX_TERM_LENGTH = 40
+# Longueur minimale des mots indexés par InnoDB (innodb_ft_min_token_size)
+MYSQL_MIN_TERM_LENGTH = 3
+# Au-delà, le corps n'est plus indexé (pièces de code, longues newsletters)
+MAX_INDEXED_BODY = 100_000
+BUCKET_PREFIX = 3
+
+_TOKEN_RE = re.compile(r"[^\W_]+")
+_TAG_RE = re.compile(r"<(script|style)\b.*?</\1>|<[^>]+>", re.IGNORECASE | re.DOTALL)
+
+def index_text(body):
+    """Texte indexable d'un corps : balises HTML retirées, longueur bornée"""
+    if not body:
+        return ""
+    body = body[:MAX_INDEXED_BODY]
+    return _TAG_RE.sub(" ", body) if "<" in body else body
+
+def tokenize(text):
+    """Mots normalisés (minuscules, sans accents) d'un texte"""
+    if not text:
+        return []
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(char for char in text if not unicodedata.combining(char))
+    return [term for term in _TOKEN_RE.findall(text) if MIN_TERM_LENGTH <= len(term) <= MAX_TERM_LENGTH]
+
+def query_terms(query):
+    """Mots distincts d'une requête, dans l'ordre de saisie"""
+    return list(dict.fromkeys(tokenize(query)))
+
+def mysql_boolean_query(query):
+    """Requête FULLTEXT en mode booléen : tous les mots requis ; None si aucun mot indexable"""
+    terms = [term for term in query_terms(query) if len(term) >= MYSQL_MIN_TERM_LENGTH]
+    return " ".join(f"+{term}" for term in terms) or None
+
+def _timestamp(value):
+    if isinstance(value, str):
+        try:
+            value = datetime.fromisoformat(value)
+        except ValueError:
+            return 0
+    return int(value.timestamp()) if isinstance(value, datetime) else 0
+
+def document_terms(sender, subject, body):
+    """Occurrences pondérées des mots d'un email"""
+    fields = {"subject": subject, "sender": sender, "body": index_text(body)}
+    weights = Counter()
+    for field, weight in FIELD_WEIGHTS:
+        for term in tokenize(fields[field]):
+            weights[term] += weight
+    return weights
+
+def rank_postings(postings, documents, account_ids=None, since=None, until=None, limit=20, offset=0):
+    """Emails présents dans toutes les listes de postings ({id: (compte, date, poids)} par mot de la requête)
+
+    Classement BM25 sans longueur de document, puis du plus récent au plus
+    ancien. Retourne (total, [(id, compte, score)]) pour la page demandée.
+    """
+    if not postings:
+        return 0, []
+    accounts = set(account_ids) if account_ids is not None else None
+    since_ts = _timestamp(since) if since else None
+    until_ts = _timestamp(until) if until else None
+
+    postings = sorted(postings, key=len)
+    documents = max(documents, len(postings[-1]), 1)
+    candidates = None
+    for term_postings in postings:
+        if not term_postings:
+            return 0, []
+        if candidates is None:
+            candidates = {
+                email_id for email_id, (account_id, stamp, _) in term_postings.items()
+                if (accounts is None or account_id in accounts)
+                and (since_ts is None or stamp >= since_ts)
+                and (until_ts is None or stamp < until_ts)
+            }
+        else:
+            candidates &= term_postings.keys()
+        if not candidates:
+            return 0, []
+
+    scores = dict.fromkeys(candidates, 0.0)
+    for term_postings in postings:
+        df = len(term_postings)
+        idf = math.log(1 + (documents - df + 0.5) / (df + 0.5))
+        for email_id in candidates:
+            weight = term_postings[email_id][2]
+            scores[email_id] += idf * weight * 2.2 / (weight + 1.2)
+    first = postings[0]
+    ranked = sorted(candidates, key=lambda email_id: (-scores[email_id], -first[email_id][1], -email_id))
+    page = ranked[offset:offset + limit]
+    return len(ranked), [(email_id, first[email_id][0], scores[email_id]) for email_id in page]
+
+class LocalSearchIndex:
+    """Index inversé du stockage local, tenu à jour à chaque email enregistré
+
+    Les listes de postings sont réparties en 4096 fichiers selon le hash du
+    mot ; une requête ne lit que les fichiers de ses mots. L'ajout d'emails
+    se fait en fin de fichier (une ligne `mot<TAB>id:compte:date:poids ...`
+    par mot et par lot), sans réécriture. Les suppressions sont notées dans
+    `deleted.txt` et filtrées à la lecture jusqu'au compactage, qui réécrit
+    les fichiers sans elles. Les écritures se font sous le verrou du stockage
+    local ; les lectures s'en passent (une ligne incomplète est ignorée).
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.postings_dir = os.path.join(directory, "postings")
+        self.meta_path = os.path.join(directory, "meta.json")
+        self.deleted_path = os.path.join(directory, "deleted.txt")
+
+    def exists(self):
+        return os.path.exists(self.meta_path)
+
+    def _bucket_path(self, term):
+        bucket = hashlib.md5(term.encode('utf-8')).hexdigest()[:BUCKET_PREFIX]
+        return os.path.join(self.postings_dir, f"{bucket}.tsv")
+
+    def _read_meta(self):
+        try:
+            with open(self.meta_path, 'r') as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {"documents": 0}
+
+    def _read_deleted(self):
+        try:
+            with open(self.deleted_path, 'r') as f:
+                return {int(line) for line in f if line.strip().isdigit()}
+        except FileNotFoundError:
+            return set()
+
+    def add(self, documents):
+        """Indexe des emails : itérable de dicts (id, account_id, received_at, sender, subject, body)"""
+        lines = defaultdict(list)
+        count = 0
+        for doc in documents:
+            stamp = _timestamp(doc.get("received_at"))
+            for term, weight in document_terms(doc.get("sender"), doc.get("subject"), doc.get("body")).items():
+                lines[term].append(f"{doc['id']}:{doc.get('account_id') or 0}:{stamp}:{weight}")
+            count += 1
+        if not count:
+            return 0
+        by_bucket = defaultdict(list)
+        for term, postings in lines.items():
+            by_bucket[self._bucket_path(term)].append(f"{term}\t{' '.join(postings)}\n")
+        os.makedirs(self.postings_dir, exist_ok=True)
+        for path, bucket_lines in by_bucket.items():
+            self._append(path, "".join(bucket_lines))
+        meta = self._read_meta()
+        meta["documents"] = meta.get("documents", 0) + count
+        atomic_write_json(self.meta_path, meta)
+        return count
+
+    def _append(self, path, text):
+        with open(path, 'a+b') as f:
+            size = f.seek(0, os.SEEK_END)
+            if size:
+                # Écriture précédente interrompue : la ligne tronquée reste isolée
+                f.seek(size - 1)
+                if f.read(1) != b"\n":
+                    text = "\n" + text
+            f.write(text.encode('utf-8'))
+
+    def delete(self, email_ids):
+        """Retire des emails des résultats (effacés des fichiers au prochain compactage)"""
+        email_ids = [int(email_id) for email_id in email_ids if email_id is not None]
+        if not email_ids or not self.exists():
+            return 0
+        with open(self.deleted_path, 'a') as f:
+            f.write("".join(f"{email_id}\n" for email_id in email_ids))
+        meta = self._read_meta()
+        meta["documents"] = max(0, meta.get("documents", 0) - len(email_ids))
+        atomic_write_json(self.meta_path, meta)
+        return len(email_ids)
+
+    def _postings(self, term, deleted):
+        """Postings d'un mot : {id: (compte, date, poids)}"""
+        try:
+            with open(self._bucket_path(term), 'r', encoding='utf-8') as f:
+                text = f.read()
+        except FileNotFoundError:
+            return {}
+        prefix = term + "\t"
+        found = {}
+        # La dernière ligne sans fin de ligne est peut-être en cours d'écriture
+        for line in text.split("\n")[:-1]:
+            if not line.startswith(prefix):
+                continue
+            try:
+                for posting in line[len(prefix):].split(" "):
+                    email_id, account_id, stamp, weight = map(int, posting.split(":"))
+                    if email_id not in deleted:
+                        found[email_id] = (account_id, stamp, weight)
+            except ValueError:
+                continue
+        return found
+
+    def search(self, query, account_ids=None, since=None, until=None, limit=20, offset=0):
+        """Emails contenant tous les mots de la requête, classés par pertinence (BM25 sans longueur)
+
+        Retourne (total, [(id, compte, score)]) pour la page demandée.
+        """
+        terms = query_terms(query)
+        if not terms or not self.exists():
+            return 0, []
+        deleted = self._read_deleted()
+        postings = [self._postings(term, deleted) for term in terms]
+        return rank_postings(postings, self._read_meta().get("documents", 0),
+                             account_ids, since, until, limit, offset)
+
+    def compact(self):
+        """Réécrit les fichiers sans les emails supprimés, une ligne par mot ; retourne le nombre de postings retirés"""
+        deleted = self._read_deleted()
+        removed = 0
+        if os.path.isdir(self.postings_dir):
+            for name in os.listdir(self.postings_dir):
+                if not name.endswith(".tsv"):
+                    continue
+                path = os.path.join(self.postings_dir, name)
+                with open(path, 'r', encoding='utf-8') as f:
+                    lines = f.read().split("\n")
+                merged = defaultdict(list)
+                for line in lines:
+                    term, _, postings = line.partition("\t")
+                    if not postings:
+                        continue
+                    for posting in postings.split(" "):
+                        email_id = posting.split(":", 1)[0]
+                        if not email_id.isdigit() or posting.count(":") != 3:
+                            continue
+                        if int(email_id) in deleted:
+                            removed += 1
+                        else:
+                            merged[term].append(posting)
+                if not merged:
+                    os.remove(path)
+                    continue
+                tmp_path = f"{path}.{os.getpid()}.tmp"
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    f.write("".join(f"{term}\t{' '.join(postings)}\n" for term, postings in merged.items()))
+                os.replace(tmp_path, path)
+        if os.path.exists(self.deleted_path):
+            os.remove(self.deleted_path)
+        return removed
+
+    def rebuild(self, documents):
+        """Reconstruit l'index complet (première utilisation ou index corrompu)"""
+        if os.path.isdir(self.postings_dir):
+            for name in os.listdir(self.postings_dir):
+                os.remove(os.path.join(self.postings_dir, name))
+        if os.path.exists(self.deleted_path):
+            os.remove(self.deleted_path)
+        os.makedirs(self.directory, exist_ok=True)
+        atomic_write_json(self.meta_path, {"documents": 0})
+        batch = []
+        total = 0
+        for doc in documents:
+            batch.append(doc)
+            if len(batch) >= 1000:
+                total += self.add(batch)
+                batch = []
+        return total + self.add(batch)
+
+class MemorySearchIndex:
+    """Index inversé tenu en mémoire (moteur "memory"), mêmes mots et même classement que LocalSearchIndex
+
+    Les suppressions retirent immédiatement les postings : pas de compactage.
+    L'appelant sérialise les écritures.
+    """
+
+    def __init__(self):
+        self._postings = defaultdict(dict)
+        # Mots de chaque email, pour le retirer de l'index
+        self._terms = {}
+
+    def add(self, documents):
+        """Indexe des emails : itérable de dicts (id, account_id, received_at, sender, subject, body)"""
+        count = 0
+        for doc in documents:
+            stamp = _timestamp(doc.get("received_at"))
+            weights = document_terms(doc.get("sender"), doc.get("subject"), doc.get("body"))
+            for term, weight in weights.items():
+                self._postings[term][doc["id"]] = (doc.get("account_id") or 0, stamp, weight)
+            self._terms[doc["id"]] = list(weights)
+            count += 1
+        return count
+
+    def delete(self, email_ids):
+        """Retire des emails de l'index"""
+        removed = 0
+        for email_id in email_ids:
+            terms = self._terms.pop(email_id, None)
+            if terms is None:
+                continue
+            for term in terms:
+                postings = self._postings.get(term)
+                if postings is not None:
+                    postings.pop(email_id, None)
+                    if not postings:
+                        del self._postings[term]
+            removed += 1
+        return removed
+
+    def search(self, query, account_ids=None, since=None, until=None, limit=20, offset=0):
+        """Emails contenant tous les mots de la requête, classés par pertinence ; voir rank_postings"""
+        terms = query_terms(query)
+        if not terms:
+            return 0, []
+        postings = [self._postings.get(term, {}) for term in terms]
+        return rank_postings(postings, len(self._terms), account_ids, since, until, limit, offset)
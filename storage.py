@@ -1,663 +1,427 @@
+import atexit
 import sys
-import time
-import socket
+from contextlib import contextmanager
 from datetime import datetime, timedelta
-import json
-import os
-
-# Détection d'environnement compilé
-IS_COMPILED = getattr(sys, 'frozen', False)
-
-# Gestion intelligente des drivers MySQL selon l'environnement
-if IS_COMPILED:
-    # En environnement compilé, forcer PyMySQL
-    try:
-        import pymysql
-        import pymysql.cursors
-        pymysql.install_as_MySQLdb()
-        MYSQL_AVAILABLE = True
-        USING_PYMYSQL = True
-    except ImportError as e:
-        MYSQL_AVAILABLE = False
-        USING_PYMYSQL = False
-else:
-    # En environnement normal, essayer mysql-connector d'abord
-    try:
-        import mysql.connector
-        from mysql.connector import pooling, Error as MySQLError
-        MYSQL_AVAILABLE = True
-        USING_PYMYSQL = False
-    except ImportError:
-        try:
-            import pymysql
-            import pymysql.cursors
-            pymysql.install_as_MySQLdb()
-            MYSQL_AVAILABLE = True
-            USING_PYMYSQL = True
-        except ImportError as e:
-            MYSQL_AVAILABLE = False
-            USING_PYMYSQL = False
+
+from circuit_breaker import OfflineJournal
+from write_behind import WriteBehindBuffer
+from content_store import ContentStore
+from json_backend import JsonBackend
+from memory_backend import MemoryBackend
+from mysql_backend import MySQLBackend, MYSQL_AVAILABLE
+# MySQLConnectionManager : classe publique historiquement définie ici, toujours importable depuis storage
+from mysql_backend import MySQLConnectionManager
+
+__all__ = ["BACKENDS", "MariaDBStorage", "MySQLConnectionManager"]
+
+# Moteurs sélectionnables par MariaDBStorage(backend=...)
+BACKENDS = ("mysql", "local", "memory")
 
 try:
-    from config import DB_HOST, DB_PORT, DB_USER, DB_PASSWORD, DB_NAME
+    from config import WRITE_BEHIND_SPILL_FILE
 except ImportError:
-    # Configuration par défaut (remplacez par vos vraies valeurs)
-    DB_HOST = "localhost"
-    DB_PORT = 3306
-    DB_USER = "root"
-    DB_PASSWORD = ""
-    DB_NAME = "generateur"
-
-class MySQLConnectionManager:
-    """Gestionnaire de connexion MySQL robuste avec diagnostic et reconnexion"""
-    
-    def __init__(self):
-        self.connection_pool = None
-        self.last_connection_test = None
-        self.connection_status = "non_testé"
-        
-    def test_network_connectivity(self):
-        """Test la connectivité réseau vers le serveur"""
-        try:
-            sock = socket.create_connection((DB_HOST, DB_PORT), timeout=10)
-            sock.close()
-            return True
-        except:
-            return False
-    
-    def test_mysql_connection(self):
-        """Test la connexion MySQL avec diagnostics détaillés"""
-        if not MYSQL_AVAILABLE:
-            return False, "module_manquant"
-        
-        if not self.test_network_connectivity():
-            return False, "connectivité_réseau"
-        
-        try:
-            if USING_PYMYSQL:
-                import pymysql
-                conn = pymysql.connect(
-                    host=DB_HOST,
-                    port=DB_PORT,
-                    user=DB_USER,
-                    password=DB_PASSWORD,
-                    database=DB_NAME,
-                    connect_timeout=15,
-                    autocommit=True,
-                    charset='utf8mb4'
-                )
-            else:
-                import mysql.connector
-                conn = mysql.connector.connect(
-                    host=DB_HOST,
-                    port=DB_PORT,
-                    user=DB_USER,
-                    password=DB_PASSWORD,
-                    database=DB_NAME,
-                    connect_timeout=15,
-                    autocommit=True,
-                    charset='utf8mb4',
-                    use_unicode=True,
-                    auth_plugin='mysql_native_password'
-                )
-            
-            # Test simple de requête
-            cursor = conn.cursor()
-            cursor.execute("SELECT 1")
-            result = cursor.fetchone()
-            cursor.close()
-            conn.close()
-            
-            if result and result[0] == 1:
-                self.connection_status = "connecté"
-                self.last_connection_test = datetime.now()
-                return True, "succès"
-            else:
-                return False, "test_requête_échoué"
-                
-        except Exception as e:
-            return False, "erreur_mysql"
-    
-    def create_connection_pool(self):
-        """Crée un pool de connexions MySQL"""
-        try:
-            if USING_PYMYSQL:
-                # PyMySQL ne supporte pas les pools natifs, on simulera
-                self.connection_pool = "pymysql_simple"
-                return True
-            else:
-                import mysql.connector.pooling
-                config = {
-                    'host': DB_HOST,
-                    'port': DB_PORT,
-                    'user': DB_USER,
-                    'password': DB_PASSWORD,
-                    'database': DB_NAME,
-                    'pool_name': 'generateur_pool',
-                    'pool_size': 5,
-                    'pool_reset_session': True,
-                    'autocommit': True,
-                    'charset': 'utf8mb4',
-                    'use_unicode': True,
-                    'auth_plugin': 'mysql_native_password'
-                }
-                
-                self.connection_pool = mysql.connector.pooling.MySQLConnectionPool(**config)
-                return True
-        except Exception as e:
-            return False
-    
-    def get_connection(self):
-        """Obtient une connexion du pool"""
-        if not self.connection_pool:
-            success, error = self.test_mysql_connection()
-            if not success:
-                return None
-            if not self.create_connection_pool():
-                return None
-        
-        try:
-            if USING_PYMYSQL:
-                import pymysql
-                return pymysql.connect(
-                    host=DB_HOST,
-                    port=DB_PORT,
-                    user=DB_USER,
-                    password=DB_PASSWORD,
-                    database=DB_NAME,
-                    connect_timeout=15,
-                    autocommit=True,
-                    charset='utf8mb4'
-                )
-            else:
-                return self.connection_pool.get_connection()
-        except Exception as e:
-            return None
+    # Un fichier par moteur : les IDs de comptes n'ont de sens que dans leur moteur
+    WRITE_BEHIND_SPILL_FILE = "write_behind_failed.{backend}.jsonl"
 
 class MariaDBStorage:
-    """Système de stockage MySQL robuste avec diagnostic et fallback intelligent"""
+    """Système de stockage MySQL robuste avec diagnostic et fallback intelligent
+
+    Façade commune aux moteurs de storage_backend (MySQL, fichiers JSON
+    locaux, mémoire) : elle choisit le moteur, porte l'écriture différée et
+    les contenus joints, et délègue le reste.
+    """
     
-    def __init__(self, force_mysql=True):
-        self.force_mysql = force_mysql
-        self.mysql_manager = MySQLConnectionManager()
-        self.use_local_storage = False
-        self.local_data_file = "local_emails.json"
-        self.status_message = ""
+    def __init__(self, force_mysql=True, write_behind=False, backend=None, local_data_file="local_emails.json"):
+        # backend : None (MySQL avec repli local selon force_mysql), "mysql", "local" ou "memory"
+        if backend is not None and backend not in BACKENDS:
+            raise ValueError(f"Moteur de stockage inconnu : {backend}")
+        self.force_mysql = force_mysql or backend == "mysql"
+        self.local_data_file = local_data_file
+        self.write_behind = None
+        # Pièces jointes et sources .eml, hors base (adressées par contenu)
+        self.content_store = ContentStore()
         
         # Test initial de connexion
-        self._initialize_storage()
+        self.backend = self._initialize_storage(backend)
+        # Lots d'écriture différée en échec définitif, rejoués au démarrage suivant
+        self.spill_journal = OfflineJournal(WRITE_BEHIND_SPILL_FILE.format(backend=self.backend.name))
+        self._replay_spilled_writes()
+        
+        if write_behind:
+            self.enable_write_behind()
     
-    def _initialize_storage(self):
-        """Initialise le système de stockage"""
-        if not MYSQL_AVAILABLE:
-            self.status_message = "Module MySQL non installé"
-            if not self.force_mysql:
-                self.use_local_storage = True
-                self._init_local_storage()
-            return
+    def _initialize_storage(self, name):
+        """Choisit et ouvre le moteur de stockage"""
+        if name == "memory":
+            return self._open_backend(MemoryBackend())
+        if name == "local":
+            return self._open_backend(JsonBackend(self.local_data_file), "Stockage local")
         
-        success, error_type = self.mysql_manager.test_mysql_connection()
+        mysql = MySQLBackend()
+        if not MYSQL_AVAILABLE:
+            mysql.status_message = "Module MySQL non installé"
+            if self.force_mysql:
+                return mysql
+            return self._open_backend(JsonBackend(self.local_data_file), mysql.status_message)
         
+        success, error_type = mysql.open()
         if success:
-            self.status_message = "Connecté à MySQL"
-            
-            # Créer les tables si nécessaire
-            if self._create_tables():
-                pass  # Tables vérifiées/créées avec succès
-            else:
-                self.status_message = "Erreur de création des tables"
-        else:
-            if self.force_mysql:
-                self.status_message = f"Système indisponible - Erreur MySQL: {error_type}"
-                return
-            else:
-                self.status_message = f"Basculement vers stockage local - MySQL: {error_type}"
-                self.use_local_storage = True
-                self._init_local_storage()
+            return mysql
+        if self.force_mysql:
+            mysql.status_message = f"Système indisponible - Erreur MySQL: {error_type}"
+            return mysql
+        return self._open_backend(JsonBackend(self.local_data_file),
+                                  f"Basculement vers stockage local - MySQL: {error_type}")
+    
+    def _open_backend(self, backend, status_message=None):
+        backend.open()
+        if status_message:
+            backend.status_message = status_message
+        return backend
+    
+    @property
+    def use_local_storage(self):
+        """Vrai hors MySQL (fichiers locaux ou mémoire)"""
+        return self.backend.name != "mysql"
+    
+    @property
+    def partitioned(self):
+        return self.backend.partitioned
+    
+    @property
+    def status_message(self):
+        return self.backend.status_message
     
     def get_status_message(self):
         """Retourne le message de statut du système"""
-        return self.status_message
+        return self.backend.status_message
     
     def is_mysql_connected(self):
         """Vérifie si MySQL est connecté"""
-        return not self.use_local_storage and self.mysql_manager.connection_status == "connecté"
+        return self.backend.name == "mysql" and self.backend.is_connected()
 
-    def _create_tables(self):
-        """Crée les tables nécessaires"""
-        conn = self.mysql_manager.get_connection()
-        if not conn:
-            return False
-        
-        try:
-            cursor = conn.cursor()
-            
-            # Table des comptes
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS accounts (
-                    id INT AUTO_INCREMENT PRIMARY KEY,
-                    email VARCHAR(255) NOT NULL UNIQUE,
-                    password VARCHAR(255),
-                    token TEXT,
-                    token_expires_at DATETIME,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
-            """)
-            
-            # Table des emails reçus
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS received_emails (
-                    id INT AUTO_INCREMENT PRIMARY KEY,
-                    account_id INT,
-                    message_id VARCHAR(255),
-                    sender VARCHAR(255),
-                    recipient VARCHAR(255),
-                    subject VARCHAR(500),
-                    body LONGTEXT,
-                    received_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (account_id) REFERENCES accounts(id) ON DELETE CASCADE
-                ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
-            """)
-            
-            # Index pour les performances
-            try:
-                cursor.execute("""
-                    CREATE UNIQUE INDEX IF NOT EXISTS idx_unique_message
-                    ON received_emails(account_id, message_id)
-                """)
-            except:
-                pass
-            
-            try:
-                cursor.execute("""
-                    CREATE INDEX IF NOT EXISTS idx_sender_subject
-                    ON received_emails(account_id, sender, subject)
-                """)
-            except:
-                pass
-            
-            conn.commit()
-            cursor.close()
-            conn.close()
-            return True
-            
-        except Exception as e:
-            if conn:
-                conn.close()
-            return False
-    
-    def _init_local_storage(self):
-        """Initialise le stockage local JSON"""
-        if not os.path.exists(self.local_data_file):
-            initial_data = {
-                "accounts": [],
-                "emails": [],
-                "next_account_id": 1,
-                "next_email_id": 1
-            }
-            with open(self.local_data_file, 'w') as f:
-                json.dump(initial_data, f, indent=2, default=str)
-    
-    def _load_local_data(self):
-        """Charge les données locales"""
-        try:
-            with open(self.local_data_file, 'r') as f:
-                return json.load(f)
-        except:
-            return {"accounts": [], "emails": [], "next_account_id": 1, "next_email_id": 1}
-    
-    def _save_local_data(self, data):
-        """Sauvegarde les données locales"""
-        with open(self.local_data_file, 'w') as f:
-            json.dump(data, f, indent=2, default=str)
-    
-    def save_account(self, email, password):
-        """Sauvegarde un compte"""
-        if self.use_local_storage:
-            data = self._load_local_data()
-            existing_account = next((acc for acc in data["accounts"] if acc["email"] == email), None)
-            if existing_account:
-                existing_account["password"] = password
-                account_id = existing_account["id"]
-            else:
-                account_id = data["next_account_id"]
-                data["accounts"].append({
-                    "id": account_id,
-                    "email": email,
-                    "password": password,
-                    "token": None,
-                    "token_expires_at": None,
-                    "created_at": datetime.now().isoformat()
-                })
-                data["next_account_id"] += 1
-            self._save_local_data(data)
-            return account_id
-        else:
-            conn = self.mysql_manager.get_connection()
-            if not conn:
-                raise Exception("Connexion MySQL impossible")
-            
-            try:
-                cursor = conn.cursor()
-                cursor.execute(
-                    "INSERT INTO accounts (email, password) VALUES (%s, %s) ON DUPLICATE KEY UPDATE password=VALUES(password)",
-                    (email, password)
-                )
-                conn.commit()
-                
-                # Récupérer l'ID
-                cursor.execute("SELECT id FROM accounts WHERE email = %s", (email,))
-                result = cursor.fetchone()
-                account_id = result[0] if result else cursor.lastrowid
-                
-                cursor.close()
-                conn.close()
-                return account_id
-            except Exception as e:
-                conn.close()
-                raise e
-
-    def save_token(self, account_id, token, expires_hours=24):
-        """Sauvegarde un token"""
-        expires_at = datetime.now() + timedelta(hours=expires_hours)
-        
-        if self.use_local_storage:
-            data = self._load_local_data()
-            for account in data["accounts"]:
-                if account["id"] == account_id:
-                    account["token"] = token
-                    account["token_expires_at"] = expires_at.isoformat()
-                    break
-            self._save_local_data(data)
-        else:
-            conn = self.mysql_manager.get_connection()
-            if not conn:
-                raise Exception("Connexion MySQL impossible")
-            
-            try:
-                cursor = conn.cursor()
-                cursor.execute(
-                    "UPDATE accounts SET token=%s, token_expires_at=%s WHERE id=%s",
-                    (token, expires_at, account_id)
-                )
-                conn.commit()
-                cursor.close()
-                conn.close()
-            except Exception as e:
-                conn.close()
-                raise e
-        
-        # Token sauvegardé
-
-    def get_valid_token(self, account_id):
-        """Récupère un token valide"""
-        if self.use_local_storage:
-            data = self._load_local_data()
-            for account in data["accounts"]:
-                if account["id"] == account_id and account.get("token"):
-                    expires_str = account.get("token_expires_at")
-                    if expires_str:
-                        expires_at = datetime.fromisoformat(expires_str)
-                        if expires_at > datetime.now():
-                            return account["token"]
-            return None
-        else:
-            conn = self.mysql_manager.get_connection()
-            if not conn:
-                raise Exception("Connexion MySQL impossible")
-            
+    def save_token(self, account_id, token, expires_hours=24, expires_at=None):
+        """Sauvegarde un token
+
+        `expires_at` (échéance réelle, p. ex. le claim `exp` du JWT) prime sur
+        la durée forfaitaire `expires_hours`.
+        """
+        if expires_at is None:
+            expires_at = datetime.now() + timedelta(hours=expires_hours)
+        self.backend.save_token(account_id, token, expires_at)
+
+    @contextmanager
+    def session(self, transactional=False):
+        """Unité de travail : les appels du bloc (même thread) partagent une seule connexion
+
+        Un cycle de synchronisation ou de création ne prend ainsi qu'une
+        connexion du pool et réutilise ses instructions préparées. Avec
+        `transactional`, tout le bloc forme une seule transaction, validée à la
+        sortie ou annulée sur exception (les écritures différées de
+        write_behind n'en font pas partie). Les sessions imbriquées rejoignent
+        la session englobante ; hors MySQL, le bloc est sans effet.
+        """
+        with self.backend.session(transactional):
+            yield self
+
+    def enable_write_behind(self, max_batch=100, flush_interval=0.5, max_queue=1000):
+        """Active l'écriture différée des emails reçus (validation groupée)
+
+        save_received_email retourne alors True dès que l'email est en file, sans
+        ID : les doublons sont écartés au moment du vidage.
+        """
+        if not self.write_behind:
+            self.write_behind = WriteBehindBuffer(
+                self._flush_write_behind,
+                max_batch=max_batch,
+                flush_interval=flush_interval,
+                max_queue=max_queue,
+                on_failure=self._spill_write_behind
+            )
+            atexit.register(self.close)
+        return self.write_behind
+
+    def _flush_write_behind(self, rows):
+        """Vidage de l'écriture différée ; les lignes vont en file durable pendant une panne"""
+        return self.backend.write_received_emails(rows)
+
+    def _spill_write_behind(self, rows, error):
+        """Lot d'écriture différée en échec définitif : écrit sur disque et signalé, jamais jeté"""
+        received_at = datetime.now().isoformat()
+        self.spill_journal.append("email", [
+            dict(row, received_at=row.get("received_at") or received_at) for row in rows
+        ])
+        sys.stderr.write(f"Écriture différée en échec ({error}) : {len(rows)} email(s) "
+                         f"conservé(s) dans {self.spill_journal.path}\n")
+        sys.stderr.flush()
+
+    def _replay_spilled_writes(self):
+        """Réécrit les emails laissés dans le fichier de secours par une exécution précédente"""
+        # Un moteur en mémoire ne retrouve pas les comptes d'un autre processus : le fichier reste une trace
+        if self.backend.name == "memory" or not self.spill_journal.pending() or not self.backend.is_connected():
+            return
+        with self.spill_journal.lock:
+            entries = self.spill_journal.read()
             try:
-                cursor = self.get_dict_cursor(conn)
-                cursor.execute(
-                    "SELECT token, token_expires_at FROM accounts WHERE id=%s", 
-                    (account_id,)
-                )
-                result = cursor.fetchone()
-                cursor.close()
-                conn.close()
-                
-                if not result or not result['token']:
-                    return None
-                    
-                if result['token_expires_at'] and result['token_expires_at'] > datetime.now():
-                    return result['token']
-                else:
-                    return None
-            except Exception as e:
-                conn.close()
-                raise e
+                self.backend.save_received_emails([entry["data"] for entry in entries])
+            except Exception:
+                return  # Nouvel essai au prochain démarrage
+            self.spill_journal.truncate([])
+
+    def flush(self):
+        """Écrit immédiatement les emails en attente d'écriture différée"""
+        if self.write_behind and self.write_behind.pending():
+            self.write_behind.flush()
+
+    def close(self):
+        """Vide les écritures différées avant l'arrêt"""
+        if self.write_behind:
+            self.write_behind.close()
+        self.backend.close()
+
+    def save_received_email(self, account_id, sender, subject, body, recipient=None, message_id=None,
+                            attachments=None):
+        """Sauvegarde un email reçu
+
+        `attachments` : métadonnées des pièces jointes déjà écrites dans
+        content_store (kind, filename, content_type, size, content_hash).
+        """
+        row = {
+            "account_id": account_id,
+            "message_id": message_id,
+            "sender": sender,
+            "recipient": recipient,
+            "subject": subject,
+            "body": body,
+            "attachments": attachments or []
+        }
+        if self.write_behind:
+            return self.write_behind.submit(row)
+        # Base hors service : l'email est mis en file (True, comme en écriture différée)
+        return self.backend.write_received_emails([row])[0]
+
+    def save_received_emails_batch(self, rows):
+        """Sauvegarde immédiatement un lot d'emails et retourne leurs IDs (None pour les doublons)
+
+        Chaque ligne reprend les arguments de save_received_email, avec un
+        `received_at` optionnel pour conserver la date d'origine.
+        """
+        return self.backend.save_received_emails(rows)
+
+    def collect_garbage_blobs(self):
+        """Supprime les blobs et fichiers joints qui ne sont plus référencés par aucun email"""
+        removed = self.backend.collect_garbage_blobs()
+        return removed + self.content_store.sweep(self.backend.attachment_hashes())
+
+    def get_latest_code(self, account_id, sender=None, since=None):
+        """Retourne le code le plus probable du dernier email reçu (dict) ou None"""
+        self.flush()
+        rows = self.backend.query_artifacts(account_id, "code", sender=sender, since=since, limit=1)
+        return rows[0] if rows else None
+
+    def get_links(self, account_id, domain=None, sender=None, since=None, limit=20):
+        """Retourne les liens extraits, du plus récent au plus ancien"""
+        self.flush()
+        return self.backend.query_artifacts(account_id, "url", sender=sender, domain=domain, since=since, limit=limit)
+
+    def get_schema_version(self):
+        """Retourne la version de schéma appliquée"""
+        return self.backend.get_schema_version()
+
+    def save_account(self, email, password, pooled=False, provider="mailtm"):
+        """Sauvegarde un compte (`pooled` : mis en réserve, invisible jusqu'à son attribution ;
+        `provider` : fournisseur propriétaire de l'adresse)"""
+        return self.backend.save_account(email, password, pooled, provider)
+
+    def save_accounts_batch(self, accounts):
+        """Sauvegarde un lot de comptes complets (email, password, token, dates)
+
+        Retourne un dictionnaire email -> ID ; un compte existant conserve son ID
+        et voit son mot de passe et son token mis à jour.
+        """
+        return self.backend.save_accounts_batch(accounts)
+
+    def iter_accounts(self, chunk_size=500):
+        """Parcourt tous les comptes, secrets compris, par ordre d'ID croissant"""
+        return self.backend.iter_accounts(chunk_size)
+
+    def save_tokens_batch(self, tokens):
+        """Sauvegarde plusieurs tokens en une écriture : liste de (account_id, token, expires_at)"""
+        return self.backend.save_tokens_batch(tokens)
+
+    def mark_account_used(self, account_id, used_at=None):
+        """Note l'utilisation réelle d'un compte (message reçu, ouverture)
+
+        C'est ce qui le garde actif pour le renouvellement des tokens et à
+        l'abri de purge_expired_accounts ; renouveler son token ne compte pas.
+        """
+        self.backend.touch_account(account_id, used_at or datetime.now())
+
+    def get_accounts_needing_token(self, refresh_before, active_since, limit=500, providers=None):
+        """Comptes actifs dont le token manque ou expire avant `refresh_before`
+
+        Un compte est actif s'il a été utilisé (mark_account_used) ou, à
+        défaut, créé après `active_since` : son propre renouvellement ne le
+        garde pas actif. C'est le critère inverse de purge_expired_accounts.
+        Les tokens absents sont servis en premier, puis par échéance croissante.
+        `providers` limite la recherche aux fournisseurs qui utilisent des tokens.
+        """
+        return self.backend.get_accounts_needing_token(refresh_before, active_since, limit, providers)
+
+    def get_valid_token(self, account_id, min_validity_seconds=0):
+        """Récupère un token valide encore au moins `min_validity_seconds` secondes"""
+        return self.backend.get_valid_token(account_id, min_validity_seconds)
 
     def clear_token(self, account_id):
         """Supprime un token"""
-        if self.use_local_storage:
-            data = self._load_local_data()
-            for account in data["accounts"]:
-                if account["id"] == account_id:
-                    account["token"] = None
-                    account["token_expires_at"] = None
-                    break
-            self._save_local_data(data)
-        else:
-            conn = self.mysql_manager.get_connection()
-            if not conn:
-                raise Exception("Connexion MySQL impossible")
-            
-            try:
-                cursor = conn.cursor()
-                cursor.execute(
-                    "UPDATE accounts SET token=NULL, token_expires_at=NULL WHERE id=%s",
-                    (account_id,)
-                )
-                conn.commit()
-                cursor.close()
-                conn.close()
-            except Exception as e:
-                conn.close()
-                raise e
-        # Token supprimé
-
-    def get_dict_cursor(self, conn):
-        """Crée un curseur de dictionnaire de manière compatible."""
-        if USING_PYMYSQL:
-            import pymysql.cursors
-            return conn.cursor(pymysql.cursors.DictCursor)
-        else:
-            return conn.cursor(dictionary=True)
+        return self.backend.clear_token(account_id)
 
     def get_all_accounts(self):
-        """Récupère tous les comptes"""
-        if self.use_local_storage:
-            data = self._load_local_data()
-            return data["accounts"]
-        else:
-            conn = self.mysql_manager.get_connection()
-            if not conn:
-                raise Exception("Connexion MySQL impossible")
-            
-            try:
-                cursor = self.get_dict_cursor(conn)
-                cursor.execute("SELECT id, email, password, created_at, token_expires_at FROM accounts")
-                rows = cursor.fetchall()
-                cursor.close()
-                conn.close()
-                return rows
-            except Exception as e:
-                conn.close()
-                raise e
+        """Récupère tous les comptes attribués (hors réserve)"""
+        return self.backend.get_all_accounts()
+
+    def search_accounts(self, text, limit=20):
+        """Comptes attribués dont l'adresse commence par `text`, puis ceux qui la contiennent
+
+        Sans mot de passe ni token : de quoi afficher et choisir un compte. Au
+        plus `limit` comptes, par ordre alphabétique dans chaque groupe ;
+        demander limit + 1 permet de savoir s'il en reste.
+        """
+        return self.backend.search_accounts(text, limit)
+
+    def get_pooled_accounts(self, limit=100):
+        """Comptes en réserve, les plus anciens d'abord"""
+        return self.backend.get_pooled_accounts(limit)
+
+    def claim_pooled_account(self, account_id):
+        """Sort un compte de la réserve ; False s'il a déjà été attribué (autre processus)"""
+        return self.backend.claim_pooled_account(account_id)
 
     def get_account_by_email(self, email):
         """Récupère un compte par email"""
-        if self.use_local_storage:
-            data = self._load_local_data()
-            return next((acc for acc in data["accounts"] if acc["email"] == email), None)
-        else:
-            conn = self.mysql_manager.get_connection()
-            if not conn:
-                raise Exception("Connexion MySQL impossible")
-            
-            try:
-                cursor = self.get_dict_cursor(conn)
-                cursor.execute("SELECT * FROM accounts WHERE email=%s", (email,))
-                row = cursor.fetchone()
-                cursor.close()
-                conn.close()
-                return row
-            except Exception as e:
-                conn.close()
-                raise e
+        return self.backend.get_account_by_email(email)
 
     def get_account_by_id(self, account_id):
         """Récupère un compte par ID"""
-        if self.use_local_storage:
-            data = self._load_local_data()
-            return next((acc for acc in data["accounts"] if acc["id"] == account_id), None)
-        else:
-            conn = self.mysql_manager.get_connection()
-            if not conn:
-                raise Exception("Connexion MySQL impossible")
-            
-            try:
-                cursor = self.get_dict_cursor(conn)
-                cursor.execute("SELECT * FROM accounts WHERE id=%s", (account_id,))
-                row = cursor.fetchone()
-                cursor.close()
-                conn.close()
-                return row
-            except Exception as e:
-                conn.close()
-                raise e
-
-    def save_received_email(self, account_id, sender, subject, body, recipient=None, message_id=None):
-        """Sauvegarde un email reçu"""
-        if self.use_local_storage:
-            data = self._load_local_data()
-            existing_email = next((email for email in data["emails"] 
-                                 if email.get("message_id") == message_id and message_id), None)
-            if existing_email:
-                return None  # Email ignoré (déjà existant)
-            
-            email_id = data["next_email_id"]
-            data["emails"].append({
-                "id": email_id,
-                "account_id": account_id,
-                "message_id": message_id,
-                "sender": sender,
-                "recipient": recipient,
-                "subject": subject,
-                "body": body,
-                "received_at": datetime.now().isoformat()
-            })
-            data["next_email_id"] += 1
-            self._save_local_data(data)
-            # Email sauvegardé avec succès
-            return email_id
-        else:
-            conn = self.mysql_manager.get_connection()
-            if not conn:
-                raise Exception("Connexion MySQL impossible")
-            
-            try:
-                cursor = conn.cursor()
-                cursor.execute(
-                    """
-                    INSERT INTO received_emails (account_id, message_id, sender, recipient, subject, body) 
-                    VALUES (%s, %s, %s, %s, %s, %s)
-                    """,
-                    (account_id, message_id, sender, recipient, subject, body)
-                )
-                conn.commit()
-                last_id = cursor.lastrowid
-                # Email sauvegardé avec succès
-                cursor.close()
-                conn.close()
-                return last_id
-            except mysql.connector.IntegrityError as e:
-                if "idx_unique_message" in str(e):
-                    pass  # Email ignoré (déjà existant)
-                else:
-                    pass  # Email ignoré (doublon détecté)
-                cursor.close()
-                conn.close()
-                return None
-            except Exception as e:
-                cursor.close()
-                conn.close()
-                raise e
+        return self.backend.get_account_by_id(account_id)
+
+    def get_replica_status(self):
+        """État des réplicas de lecture (liste vide sans réplica)"""
+        return self.backend.get_replica_status()
+
+    def get_offline_status(self):
+        """État du disjoncteur et nombre d'écritures en attente (None sans disjoncteur)"""
+        return self.backend.get_offline_status()
+
+    def get_email_attachments(self, email_id, account_id=None):
+        """Pièces jointes et source d'un email (métadonnées ; contenu via content_store.open)
+
+        En stockage local, `account_id` limite la lecture au fichier du compte.
+        """
+        return self.backend.get_email_attachments(email_id, account_id)
+
+    def add_email_attachment(self, email_id, account_id, attachment):
+        """Rattache après coup un contenu à un email (p. ex. source .eml téléchargée à la demande)"""
+        return self.backend.add_email_attachment(email_id, account_id, attachment)
+
+    def delete_received_email(self, email_id, account_id=None):
+        """Supprime un email reçu et libère son blob
+
+        En stockage local, `account_id` limite la lecture au fichier du compte.
+        """
+        return self.backend.delete_received_email(email_id, account_id)
+
+    def delete_account(self, account_id):
+        """Supprime un compte, ses emails et libère les blobs associés"""
+        return self.backend.delete_account(account_id)
+
+    def purge_emails_before(self, cutoff, limit=500):
+        """Supprime au plus `limit` emails reçus avant `cutoff` et retourne leur nombre"""
+        return self.backend.purge_emails_before(cutoff, limit)
+
+    def purge_excess_emails(self, max_per_account, limit=500):
+        """Ne conserve que les `max_per_account` emails les plus récents de chaque compte"""
+        return self.backend.purge_excess_emails(max_per_account, limit)
+
+    def purge_expired_accounts(self, cutoff, limit=500, providers=None):
+        """Supprime les comptes dont le token a expiré (ou jamais obtenu) avant `cutoff`
+
+        Un compte utilisé depuis `cutoff` (mark_account_used) est épargné.
+        `providers` limite la purge aux fournisseurs à tokens : sans token, un
+        compte Maildrop paraîtrait expiré dès sa création. Les emails des
+        comptes concernés sont supprimés par lots d'au plus `limit` lignes ; le
+        compte n'est retiré qu'une fois vide. Retourne le nombre de lignes
+        supprimées (emails et comptes).
+        """
+        return self.backend.purge_expired_accounts(cutoff, limit, providers)
+
+    def enable_time_partitioning(self, months_ahead=3):
+        """Partitionne received_emails par mois (MySQL uniquement ; False sinon)"""
+        return self.backend.enable_time_partitioning(months_ahead)
+
+    def ensure_future_partitions(self, months_ahead=3):
+        """Crée les partitions mensuelles à venir en scindant la partition p_future"""
+        return self.backend.ensure_future_partitions(months_ahead)
+
+    def drop_partitions_before(self, cutoff):
+        """Supprime en temps constant les partitions mensuelles entièrement antérieures à `cutoff`"""
+        return self.backend.drop_partitions_before(cutoff)
+
+    def search_emails(self, query, account_id=None, since=None, until=None, limit=20, offset=0):
+        """Recherche plein texte dans le sujet, l'expéditeur et le corps, pour un compte ou tous
+
+        Tous les mots de la requête doivent figurer dans l'email (casse et
+        accents ignorés) ; `since` et `until` bornent la date de réception
+        (until exclue). Les résultats sont classés par pertinence, le sujet
+        comptant davantage, puis du plus récent au plus ancien. Retourne
+        {"total": nombre de résultats, "results": [{"email", "score"}]} pour la
+        page [offset, offset + limit), corps chargés à la demande.
+        """
+        self.flush()
+        return self.backend.search_emails(query, account_id, since, until, limit, offset)
 
     def get_all_received_emails(self):
         """Récupère tous les emails reçus"""
-        if self.use_local_storage:
-            data = self._load_local_data()
-            emails = sorted(data["emails"], key=lambda x: x["received_at"], reverse=True)
-            for email in emails:
-                if isinstance(email["received_at"], str):
-                    try:
-                        email["received_at"] = datetime.fromisoformat(email["received_at"])
-                    except:
-                        email["received_at"] = datetime.now()
-            return emails
-        else:
-            conn = self.mysql_manager.get_connection()
-            if not conn:
-                raise Exception("Connexion MySQL impossible")
-            
-            try:
-                cursor = self.get_dict_cursor(conn)
-                cursor.execute("SELECT * FROM received_emails ORDER BY received_at DESC")
-                rows = cursor.fetchall()
-                cursor.close()
-                conn.close()
-                return rows
-            except Exception as e:
-                conn.close()
-                raise e
+        self.flush()
+        return self.backend.get_all_received_emails()
 
     def get_received_emails_by_account(self, account_id):
         """Récupère les emails reçus pour un compte spécifique"""
-        if self.use_local_storage:
-            data = self._load_local_data()
-            emails = [email for email in data["emails"] if email.get("account_id") == account_id]
-            emails = sorted(emails, key=lambda x: x["received_at"], reverse=True)
-            for email in emails:
-                if isinstance(email["received_at"], str):
-                    try:
-                        email["received_at"] = datetime.fromisoformat(email["received_at"])
-                    except:
-                        email["received_at"] = datetime.now()
-            return emails
-        else:
-            conn = self.mysql_manager.get_connection()
-            if not conn:
-                raise Exception("Connexion MySQL impossible")
-            
-            try:
-                cursor = self.get_dict_cursor(conn)
-                cursor.execute("SELECT * FROM received_emails WHERE account_id=%s ORDER BY received_at DESC", (account_id,))
-                rows = cursor.fetchall()
-                cursor.close()
-                conn.close()
-                return rows
-            except Exception as e:
-                conn.close()
-                raise e
+        self.flush()
+        return self.backend.get_received_emails_by_account(account_id)
+
+    def iter_received_emails(self, account_id=None, chunk_size=500, after_id=0):
+        """Parcourt les emails reçus par ordre d'ID croissant, sans tout charger en mémoire
+
+        MySQL : curseur côté serveur lu par paquets de `chunk_size` ; la connexion
+        reste occupée tant que le générateur n'est pas épuisé ou fermé.
+        Local : fichiers de comptes lus un à un et fusionnés par ID, corps
+        résolus à la demande.
+        """
+        self.flush()
+        return self.backend.iter_received_emails(account_id, chunk_size, after_id)
+
+    def get_last_email_id(self):
+        """Retourne l'ID du dernier email enregistré (0 si aucun)"""
+        self.flush()
+        return self.backend.get_last_email_id()
+
+    def get_received_emails_after(self, last_id, account_id=None, limit=500):
+        """Récupère les emails d'ID supérieur à `last_id` (ordre croissant), pour un suivi incrémental"""
+        self.flush()
+        return self.backend.get_received_emails_after(last_id, account_id, limit)
 
     def get_received_email_by_id(self, email_id):
         """Récupère un email par ID"""
-        if self.use_local_storage:
-            data = self._load_local_data()
-            return next((email for email in data["emails"] if email["id"] == email_id), None)
-        else:
-            conn = self.mysql_manager.get_connection()
-            if not conn:
-                raise Exception("Connexion MySQL impossible")
-            
-            try:
-                cursor = self.get_dict_cursor(conn)
-                cursor.execute("SELECT * FROM received_emails WHERE id=%s", (email_id,))
-                row = cursor.fetchone()
-                cursor.close()
-                conn.close()
-                return row
-            except Exception as e:
-                conn.close()
-                raise e
\ No newline at end of file
+        self.flush()
+        return self.backend.get_received_email_by_id(email_id)
+
+    def get_message_ids(self, account_id):
+        """Ensemble des message_id déjà stockés pour un compte (index unique, sans lire les corps)"""
+        self.flush()
+        return self.backend.get_message_ids(account_id)
+
+    def get_received_email_by_message_id(self, account_id, message_id):
+        """Récupère un email par (account_id, message_id)"""
+        self.flush()
+        return self.backend.get_received_email_by_message_id(account_id, message_id)
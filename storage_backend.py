@@ -0,0 +1,274 @@
+import hashlib
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from datetime import datetime
+
+from extraction import extract_artifacts, sender_domain
+
+def content_hash(content):
+    """Calcule l'empreinte SHA-256 d'un contenu (clé du blob store)"""
+    if content is None:
+        content = ""
+    if isinstance(content, str):
+        content = content.encode('utf-8')
+    return hashlib.sha256(content).hexdigest()
+
+class StorageBackend(ABC):
+    """Moteur de stockage des comptes et des emails, choisi par MariaDBStorage
+
+    MariaDBStorage garde ce qui est commun à tous les moteurs (écriture
+    différée, contenus joints hors base, extraction des codes et liens) et
+    délègue le reste ici. Les méthodes reprennent ses signatures et ses
+    valeurs de retour : un compte est un Account, un email un ReceivedEmail,
+    un ID absent se traduit par None. Les moteurs sont sûrs entre threads ;
+    les lectures n'attendent pas les écritures différées (MariaDBStorage
+    vide la file avant de les appeler).
+    """
+
+    # Identifiant court du moteur ("mysql", "local", "memory")
+    name = None
+
+    def __init__(self):
+        self.status_message = ""
+        self.partitioned = False
+
+    def open(self):
+        """Prépare le moteur (schéma, migrations, index) ; retourne (succès, cause de l'échec)"""
+        return True, None
+
+    def is_connected(self):
+        """Indique si le moteur est utilisable"""
+        return True
+
+    def close(self):
+        """Libère les ressources du moteur (tâches de fond)"""
+
+    @contextmanager
+    def session(self, transactional=False):
+        """Unité de travail (voir MariaDBStorage.session) ; sans effet par défaut"""
+        yield self
+
+    # --- Schéma
+
+    @abstractmethod
+    def get_schema_version(self):
+        """Version de schéma appliquée"""
+
+    # --- Comptes
+
+    @abstractmethod
+    def save_account(self, email, password, pooled=False, provider="mailtm"):
+        """Crée un compte ou met à jour son mot de passe ; retourne son ID"""
+
+    @abstractmethod
+    def save_accounts_batch(self, accounts):
+        """Crée ou met à jour un lot de comptes complets ; retourne email -> ID"""
+
+    @abstractmethod
+    def iter_accounts(self, chunk_size=500):
+        """Parcourt tous les comptes, secrets compris, par ordre d'ID croissant"""
+
+    @abstractmethod
+    def save_token(self, account_id, token, expires_at):
+        """Enregistre le token d'un compte et son échéance"""
+
+    @abstractmethod
+    def save_tokens_batch(self, tokens):
+        """Enregistre une liste de (account_id, token, expires_at)"""
+
+    @abstractmethod
+    def clear_token(self, account_id):
+        """Efface le token d'un compte"""
+
+    @abstractmethod
+    def touch_account(self, account_id, used_at):
+        """Enregistre la dernière utilisation réelle d'un compte"""
+
+    @abstractmethod
+    def get_accounts_needing_token(self, refresh_before, active_since, limit=500, providers=None):
+        """Comptes actifs dont le token manque ou expire avant `refresh_before`"""
+
+    @abstractmethod
+    def get_valid_token(self, account_id, min_validity_seconds=0):
+        """Token valide encore au moins `min_validity_seconds` secondes, sinon None"""
+
+    @abstractmethod
+    def get_all_accounts(self):
+        """Comptes attribués (hors réserve)"""
+
+    @abstractmethod
+    def search_accounts(self, text, limit=20):
+        """Comptes attribués dont l'adresse commence par `text`, puis ceux qui la contiennent"""
+
+    @abstractmethod
+    def get_pooled_accounts(self, limit=100):
+        """Comptes en réserve, les plus anciens d'abord"""
+
+    @abstractmethod
+    def claim_pooled_account(self, account_id):
+        """Sort un compte de la réserve ; False s'il a déjà été attribué"""
+
+    @abstractmethod
+    def get_account_by_email(self, email):
+        """Compte d'adresse `email`, sinon None"""
+
+    @abstractmethod
+    def get_account_by_id(self, account_id):
+        """Compte d'ID `account_id`, sinon None"""
+
+    @abstractmethod
+    def delete_account(self, account_id):
+        """Supprime un compte et ses emails ; False s'il n'existe pas"""
+
+    @abstractmethod
+    def purge_expired_accounts(self, cutoff, limit=500, providers=None):
+        """Supprime par lots les comptes expirés et inutilisés avant `cutoff` et leurs emails ; retourne le nombre de lignes"""
+
+    # --- Emails
+
+    @abstractmethod
+    def save_received_emails(self, rows):
+        """Enregistre un lot d'emails en une écriture ; retourne leurs IDs (None si doublon)"""
+
+    def write_received_emails(self, rows):
+        """Enregistre un lot d'emails, ou le met en file si le moteur est hors service
+
+        Retourne les IDs, ou True pour chaque email mis en file.
+        """
+        return self.save_received_emails(rows)
+
+    @abstractmethod
+    def get_email_attachments(self, email_id, account_id=None):
+        """Métadonnées des pièces jointes et de la source d'un email"""
+
+    @abstractmethod
+    def add_email_attachment(self, email_id, account_id, attachment):
+        """Rattache après coup un contenu à un email"""
+
+    @abstractmethod
+    def attachment_hashes(self):
+        """Empreintes des contenus joints encore référencés"""
+
+    @abstractmethod
+    def delete_received_email(self, email_id, account_id=None):
+        """Supprime un email (`account_id` : compte connu, lecture ciblée) ; False s'il n'existe pas"""
+
+    @abstractmethod
+    def collect_garbage_blobs(self):
+        """Supprime les corps qui ne sont plus référencés ; retourne leur nombre"""
+
+    @abstractmethod
+    def purge_emails_before(self, cutoff, limit=500):
+        """Supprime au plus `limit` emails reçus avant `cutoff` ; retourne leur nombre"""
+
+    @abstractmethod
+    def purge_excess_emails(self, max_per_account, limit=500):
+        """Ne conserve que les `max_per_account` emails les plus récents de chaque compte"""
+
+    @abstractmethod
+    def query_artifacts(self, account_id, kind, sender=None, domain=None, since=None, limit=1):
+        """Codes ou liens extraits d'un compte, du plus récent au plus ancien"""
+
+    @abstractmethod
+    def search_emails(self, query, account_id=None, since=None, until=None, limit=20, offset=0):
+        """Recherche plein texte (voir MariaDBStorage.search_emails)"""
+
+    @abstractmethod
+    def get_all_received_emails(self):
+        """Tous les emails, du plus récent au plus ancien"""
+
+    @abstractmethod
+    def get_received_emails_by_account(self, account_id):
+        """Emails d'un compte, du plus récent au plus ancien"""
+
+    @abstractmethod
+    def iter_received_emails(self, account_id=None, chunk_size=500, after_id=0):
+        """Parcourt les emails par ordre d'ID croissant, par paquets"""
+
+    @abstractmethod
+    def get_last_email_id(self):
+        """ID du dernier email enregistré (0 si aucun)"""
+
+    @abstractmethod
+    def get_received_emails_after(self, last_id, account_id=None, limit=500):
+        """Emails d'ID supérieur à `last_id`, par ordre croissant"""
+
+    @abstractmethod
+    def get_received_email_by_id(self, email_id):
+        """Email d'ID `email_id`, sinon None"""
+
+    @abstractmethod
+    def get_message_ids(self, account_id):
+        """Ensemble des message_id déjà stockés pour un compte"""
+
+    @abstractmethod
+    def get_received_email_by_message_id(self, account_id, message_id):
+        """Email (account_id, message_id), sinon None"""
+
+    # --- Exploitation (moteurs qui le permettent)
+
+    def get_replica_status(self):
+        """État des réplicas de lecture (liste vide sans réplica)"""
+        return []
+
+    def get_offline_status(self):
+        """État du disjoncteur (None sans disjoncteur)"""
+        return None
+
+    def enable_time_partitioning(self, months_ahead=3):
+        """Partitionne les emails par mois ; False si le moteur ne le permet pas"""
+        return False
+
+    def ensure_future_partitions(self, months_ahead=3):
+        """Crée les partitions des mois à venir ; retourne leur nombre"""
+        return 0
+
+    def drop_partitions_before(self, cutoff):
+        """Supprime les partitions antérieures à `cutoff` ; retourne leurs noms"""
+        return []
+
+    # --- Aides communes
+
+    def _local_datetime_str(self, value):
+        """Normalise une date pour le stockage local (chaîne ISO)"""
+        if isinstance(value, datetime):
+            return value.isoformat()
+        return value
+
+    def _parse_local_datetime(self, value):
+        """Convertit une date du stockage local en datetime"""
+        if isinstance(value, datetime):
+            return value
+        try:
+            return datetime.fromisoformat(value)
+        except (TypeError, ValueError):
+            return None
+
+    def _attachment_records(self, email_id, row):
+        """Lignes de métadonnées des pièces jointes d'un email"""
+        return [
+            {
+                "email_id": email_id,
+                "account_id": row["account_id"],
+                "kind": attachment.get("kind", "attachment"),
+                "filename": (attachment.get("filename") or "")[:255],
+                "content_type": (attachment.get("content_type") or "")[:127],
+                "size": attachment.get("size"),
+                "content_hash": attachment["content_hash"],
+                "position": position
+            }
+            for position, attachment in enumerate(row.get("attachments") or [])
+        ]
+
+    def _artifact_records(self, email_id, row, received_at):
+        """Extrait une fois pour toutes les codes et liens d'un email à l'ingestion"""
+        sender = row.get("sender")
+        return [
+            dict(artifact,
+                 email_id=email_id,
+                 account_id=row["account_id"],
+                 sender=sender,
+                 sender_domain=sender_domain(sender),
+                 received_at=received_at)
+            for artifact in extract_artifacts(row.get("subject"), row.get("body"))
+        ]
@@ -0,0 +1,244 @@
+import bisect
+import hashlib
+import multiprocessing
+import queue
+import time
+
+class ConsistentHashRing:
+    """Anneau de hachage cohérent : retirer un nœud ne déplace que ses propres clés"""
+
+    def __init__(self, nodes=(), replicas=64):
+        self.replicas = replicas
+        self._keys = []
+        self._nodes = {}
+        for node in nodes:
+            self.add_node(node)
+
+    def _hash(self, value):
+        return int(hashlib.md5(str(value).encode('utf-8')).hexdigest()[:16], 16)
+
+    def add_node(self, node):
+        """Ajoute un nœud avec ses répliques virtuelles"""
+        for replica in range(self.replicas):
+            key = self._hash(f"{node}#{replica}")
+            self._nodes[key] = node
+            bisect.insort(self._keys, key)
+
+    def remove_node(self, node):
+        """Retire un nœud et toutes ses répliques virtuelles"""
+        for replica in range(self.replicas):
+            key = self._hash(f"{node}#{replica}")
+            if self._nodes.pop(key, None) is not None:
+                index = bisect.bisect_left(self._keys, key)
+                del self._keys[index]
+
+    def get_node(self, key):
+        """Retourne le nœud responsable d'une clé"""
+        if not self._keys:
+            return None
+        index = bisect.bisect(self._keys, self._hash(key)) % len(self._keys)
+        return self._nodes[self._keys[index]]
+
+    def nodes(self):
+        return set(self._nodes.values())
+
+def _worker_main(worker_id, task_queue, result_queue, current_account, backend, local_data_file, force_mysql):
+    """Processus de synchronisation : sa propre connexion de stockage, ses propres comptes
+
+    Le stockage est ouvert avec le moteur du coordinateur (`backend`), jamais
+    par repli : les IDs reçus n'ont de sens que dans ce stockage.
+    """
+    import storage as storage_module
+    import mail_api
+    import profiling
+
+    # Le processus se termine sans passer par atexit : la trace est écrite explicitement
+    profiler = profiling.install_from_env()
+    storage = storage_module.MariaDBStorage(force_mysql=force_mysql, backend=backend,
+                                            local_data_file=local_data_file)
+    if storage.backend.name != backend or (backend == "mysql" and not storage.is_mysql_connected()):
+        storage.close()
+        raise RuntimeError(f"Stockage du worker {worker_id} différent du coordinateur : "
+                           f"{storage.get_status_message()}")
+    mail_api.set_storage(storage)
+    result_queue.put(("ready", worker_id, None, 0, 0.0))
+
+    while True:
+        account_ids = task_queue.get()
+        if account_ids is None:
+            break
+        for account_id in account_ids:
+            # Mémoire partagée plutôt que la file : visible même si le processus meurt net
+            current_account.value = account_id
+            started = time.perf_counter()
+            try:
+                new_count = mail_api.fetch_and_store_messages(account_id)
+            except Exception:
+                new_count = 0
+            current_account.value = -1
+            result_queue.put(("done", worker_id, account_id, new_count, time.perf_counter() - started))
+
+    storage.close()
+    if profiler:
+        profiler.dump()
+
+class ShardedSyncCoordinator:
+    """Répartit la synchronisation des comptes sur N processus par hachage cohérent
+
+    Chaque compte est attribué à un worker selon son ID. Si un worker meurt, ses
+    comptes en attente sont redistribués aux survivants (seules ses clés changent
+    de propriétaire) puis un remplaçant est lancé pour le cycle suivant. Les
+    workers ouvrent le même moteur et le même fichier local que `storage`.
+    """
+
+    def __init__(self, storage, num_workers=None, max_attempts=3):
+        self.storage = storage
+        self.storage_options = (storage.backend.name, storage.local_data_file, storage.force_mysql)
+        self.num_workers = num_workers or multiprocessing.cpu_count()
+        self.max_attempts = max_attempts
+        self.ring = ConsistentHashRing()
+        self.workers = {}
+        self.task_queues = {}
+        self.current_accounts = {}
+        self.ready = set()
+        self.result_queue = multiprocessing.Queue()
+        self.shard_stats = {}
+        self._next_worker_id = 0
+
+    def _spawn_worker(self):
+        """Lance un nouveau worker et l'ajoute à l'anneau"""
+        worker_id = self._next_worker_id
+        self._next_worker_id += 1
+        task_queue = multiprocessing.Queue()
+        current_account = multiprocessing.Value('i', -1, lock=False)
+        process = multiprocessing.Process(
+            target=_worker_main,
+            args=(worker_id, task_queue, self.result_queue, current_account) + self.storage_options,
+            name=f"sync-worker-{worker_id}",
+            daemon=True
+        )
+        process.start()
+        self.workers[worker_id] = process
+        self.task_queues[worker_id] = task_queue
+        self.current_accounts[worker_id] = current_account
+        self.shard_stats[worker_id] = {"accounts": 0, "messages": 0, "busy_seconds": 0.0}
+        self.ring.add_node(worker_id)
+        return worker_id
+
+    def start(self):
+        """Démarre les workers"""
+        while len(self.workers) < self.num_workers:
+            self._spawn_worker()
+
+    def stop(self):
+        """Arrête proprement tous les workers"""
+        for task_queue in self.task_queues.values():
+            task_queue.put(None)
+        for process in self.workers.values():
+            process.join(timeout=10)
+        self.workers.clear()
+        self.task_queues.clear()
+        self.current_accounts.clear()
+        self.ready.clear()
+
+    def _dispatch(self, account_ids, pending):
+        """Envoie chaque compte au worker propriétaire selon l'anneau"""
+        shards = {}
+        for account_id in account_ids:
+            worker_id = self.ring.get_node(account_id)
+            shards.setdefault(worker_id, []).append(account_id)
+            pending[account_id] = worker_id
+        for worker_id, shard in shards.items():
+            self.task_queues[worker_id].put(shard)
+
+    def _reap_dead_workers(self, pending, attempts):
+        """Retire les workers morts et rééquilibre leurs comptes en attente
+
+        Seul le compte en cours de traitement au moment du crash est compté comme
+        tentative : après `max_attempts` crashs, il est abandonné pour ce cycle.
+        Un worker mort avant d'être prêt (stockage ou profilage en échec) lève
+        RuntimeError : ses remplaçants échoueraient de la même façon.
+        """
+        dead = [worker_id for worker_id, process in self.workers.items() if not process.is_alive()]
+        if not dead:
+            return
+        for worker_id in dead:
+            if worker_id not in self.ready and self.current_accounts[worker_id].value == -1:
+                raise RuntimeError(f"Worker de synchronisation {worker_id} arrêté au démarrage "
+                                   f"(code {self.workers[worker_id].exitcode})")
+        for worker_id in dead:
+            self.ready.discard(worker_id)
+            account_id = self.current_accounts.pop(worker_id).value
+            self.ring.remove_node(worker_id)
+            del self.workers[worker_id]
+            del self.task_queues[worker_id]
+            if account_id in pending:
+                attempts[account_id] = attempts.get(account_id, 0) + 1
+                if attempts[account_id] >= self.max_attempts:
+                    del pending[account_id]  # Compte qui fait tomber les workers : abandonné
+        if not self.workers:
+            self._spawn_worker()
+        orphans = [account_id for account_id, owner in pending.items() if owner in dead]
+        self._dispatch(orphans, pending)
+
+    def sync_all(self, timeout=None, account_ids=None):
+        """Synchronise une fois les comptes `account_ids` (tous si None) et retourne le nombre de nouveaux messages"""
+        self.start()
+        if account_ids is None:
+            account_ids = [account['id'] for account in self.storage.get_all_accounts()]
+        pending = {}
+        attempts = {}
+        self._dispatch(account_ids, pending)
+
+        total_new = 0
+        deadline = time.monotonic() + timeout if timeout else None
+        while pending:
+            if deadline and time.monotonic() >= deadline:
+                break
+            try:
+                kind, worker_id, account_id, new_count, elapsed = self.result_queue.get(timeout=0.5)
+            except queue.Empty:
+                self._reap_dead_workers(pending, attempts)
+                continue
+            if kind == "ready":
+                self.ready.add(worker_id)
+                continue
+            if account_id not in pending:
+                continue
+            del pending[account_id]
+            total_new += new_count
+            stats = self.shard_stats.setdefault(worker_id, {"accounts": 0, "messages": 0, "busy_seconds": 0.0})
+            stats["accounts"] += 1
+            stats["messages"] += new_count
+            stats["busy_seconds"] += elapsed
+
+        # Remplacement des workers perdus pour le prochain cycle
+        self.start()
+        return total_new
+
+    def run_forever(self, interval=30):
+        """Enchaîne les cycles de synchronisation"""
+        try:
+            while True:
+                self.sync_all()
+                time.sleep(interval)
+        finally:
+            self.stop()
+
+    def get_stats(self):
+        """Statistiques par shard et agrégées (comptes/s et messages/s en temps de travail)"""
+        shards = {}
+        for worker_id, stats in self.shard_stats.items():
+            busy = stats["busy_seconds"] or 1e-9
+            shards[worker_id] = dict(
+                stats,
+                alive=worker_id in self.workers,
+                accounts_per_second=stats["accounts"] / busy,
+                messages_per_second=stats["messages"] / busy
+            )
+        return {
+            "workers": len(self.workers),
+            "accounts": sum(s["accounts"] for s in self.shard_stats.values()),
+            "messages": sum(s["messages"] for s in self.shard_stats.values()),
+            "shards": shards
+        }
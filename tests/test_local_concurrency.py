@@ -0,0 +1,133 @@
+"""Stress du stockage local : écritures concurrentes entre threads et entre processus
+
+Chaque test lance des écrivains en parallèle sur un même fichier local puis
+vérifie qu'aucune écriture n'a été perdue ni dupliquée et que les fichiers
+restent du JSON valide. Lancement : python -m unittest discover tests
+"""
+import glob
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import threading
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from json_backend import JsonBackend
+from locking import InterProcessLock
+
+THREADS = 8
+PROCESSES = 4
+EMAILS_PER_WRITER = 25
+
+def _open_backend(path):
+    backend = JsonBackend(path)
+    backend.open()
+    return backend
+
+def _write_emails(path, writer):
+    """Un écrivain : son compte puis ses emails, un lot d'un email à la fois"""
+    backend = _open_backend(path)
+    account_id = backend.save_account(f"writer{writer}@example.com", "secret")
+    for i in range(EMAILS_PER_WRITER):
+        backend.save_received_emails([{
+            "account_id": account_id,
+            "message_id": f"{writer}-{i}",
+            "sender": "stress@example.com",
+            "subject": f"Message {i}",
+            "body": f"Corps {writer}-{i}"
+        }])
+
+def _increment_counter(lock_path, counter_path, rounds):
+    """Lecture-modification-écriture d'un compteur sous InterProcessLock"""
+    lock = InterProcessLock(lock_path)
+    for _ in range(rounds):
+        with lock:
+            with open(counter_path) as f:
+                value = int(f.read() or 0)
+            with open(counter_path, 'w') as f:
+                f.write(str(value + 1))
+
+class LocalConcurrencyTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "local_emails.json")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def _check_store(self, writers):
+        """Tous les comptes et emails présents, une seule fois, fichiers lisibles"""
+        for file_path in glob.glob(os.path.join(self.tmp.name, "**", "*.json"), recursive=True):
+            with open(file_path) as f:
+                json.load(f)
+        backend = _open_backend(self.path)
+        accounts = {account["email"]: account["id"] for account in backend.get_all_accounts()}
+        self.assertEqual(len(accounts), writers)
+        emails = list(backend.iter_received_emails())
+        self.assertEqual(len(emails), writers * EMAILS_PER_WRITER)
+        self.assertEqual(len({email["id"] for email in emails}), len(emails))
+        expected = {f"{writer}-{i}" for writer in range(writers) for i in range(EMAILS_PER_WRITER)}
+        self.assertEqual({email["message_id"] for email in emails}, expected)
+        for email in emails:
+            writer = email["message_id"].split("-")[0]
+            self.assertEqual(email["account_id"], accounts[f"writer{writer}@example.com"])
+            self.assertEqual(email["body"], f"Corps {email['message_id']}")
+
+    def test_threads(self):
+        _open_backend(self.path)
+        threads = [threading.Thread(target=_write_emails, args=(self.path, writer)) for writer in range(THREADS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self._check_store(THREADS)
+
+    def test_processes(self):
+        _open_backend(self.path)
+        context = multiprocessing.get_context("spawn")
+        processes = [context.Process(target=_write_emails, args=(self.path, writer)) for writer in range(PROCESSES)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+            self.assertEqual(process.exitcode, 0)
+        self._check_store(PROCESSES)
+
+    def test_processes_and_threads(self):
+        _open_backend(self.path)
+        context = multiprocessing.get_context("spawn")
+        processes = [context.Process(target=_write_emails, args=(self.path, writer)) for writer in range(PROCESSES)]
+        threads = [threading.Thread(target=_write_emails, args=(self.path, writer))
+                   for writer in range(PROCESSES, PROCESSES + THREADS)]
+        for worker in processes + threads:
+            worker.start()
+        for worker in processes + threads:
+            worker.join()
+        for process in processes:
+            self.assertEqual(process.exitcode, 0)
+        self._check_store(PROCESSES + THREADS)
+
+    def test_inter_process_lock(self):
+        lock_path = os.path.join(self.tmp.name, "counter.lock")
+        counter_path = os.path.join(self.tmp.name, "counter")
+        with open(counter_path, 'w') as f:
+            f.write("0")
+        rounds = 200
+        context = multiprocessing.get_context("spawn")
+        processes = [context.Process(target=_increment_counter, args=(lock_path, counter_path, rounds))
+                     for _ in range(PROCESSES)]
+        for process in processes:
+            process.start()
+        _increment_counter(lock_path, counter_path, rounds)
+        for process in processes:
+            process.join()
+            self.assertEqual(process.exitcode, 0)
+        with open(counter_path) as f:
+            self.assertEqual(int(f.read()), rounds * (PROCESSES + 1))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,128 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import mail_api
+
+try:
+    from config import TOKEN_REFRESH_ENABLED
+except ImportError:
+    TOKEN_REFRESH_ENABLED = True
+
+try:
+    from config import TOKEN_REFRESH_MARGIN_SECONDS, TOKEN_REFRESH_INTERVAL_SECONDS
+except ImportError:
+    TOKEN_REFRESH_MARGIN_SECONDS = 600
+    TOKEN_REFRESH_INTERVAL_SECONDS = 60
+
+try:
+    from config import TOKEN_REFRESH_CONCURRENCY, TOKEN_REFRESH_BATCH_SIZE
+except ImportError:
+    TOKEN_REFRESH_CONCURRENCY = 8
+    TOKEN_REFRESH_BATCH_SIZE = 200
+
+try:
+    from config import TOKEN_ACTIVE_DAYS
+except ImportError:
+    TOKEN_ACTIVE_DAYS = 7
+
+class TokenRefresher:
+    """Renouvelle en tâche de fond les tokens des comptes actifs avant leur échéance
+
+    Les synchronisations trouvent ainsi toujours un token valide et n'attendent
+    jamais /token. Les renouvellements d'un passage sont faits en parallèle
+    puis enregistrés en une seule écriture.
+    """
+
+    def __init__(self, storage, margin_seconds=TOKEN_REFRESH_MARGIN_SECONDS,
+                 interval_seconds=TOKEN_REFRESH_INTERVAL_SECONDS,
+                 concurrency=TOKEN_REFRESH_CONCURRENCY, batch_size=TOKEN_REFRESH_BATCH_SIZE,
+                 active_days=TOKEN_ACTIVE_DAYS, retry_seconds=300):
+        self.storage = storage
+        self.margin_seconds = margin_seconds
+        self.interval_seconds = interval_seconds
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self.active_days = active_days
+        self.retry_seconds = retry_seconds
+        self.last_run = None
+        self.last_stats = {}
+        # Comptes en échec (identifiants invalides, compte supprimé) : pas de nouvel essai avant l'échéance
+        self._retry_after = {}
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def _request(self, account):
+        try:
+            return mail_api.request_token(account['email'], account['password'], account.get('provider'))
+        except Exception:
+            return None
+
+    def run_once(self):
+        """Renouvelle les tokens qui expirent dans la marge et retourne les compteurs"""
+        now = datetime.now()
+        stats = {"checked": 0, "refreshed": 0, "failed": 0}
+        self._retry_after = {account_id: retry_at for account_id, retry_at in self._retry_after.items()
+                             if retry_at > now}
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            while not self._stop_event.is_set():
+                accounts = self.storage.get_accounts_needing_token(
+                    now + timedelta(seconds=self.margin_seconds),
+                    now - timedelta(days=self.active_days),
+                    limit=self.batch_size + len(self._retry_after),
+                    providers=mail_api.token_providers()
+                )
+                accounts = [acc for acc in accounts
+                            if acc['id'] not in self._retry_after and acc.get('password')][:self.batch_size]
+                if not accounts:
+                    break
+                stats["checked"] += len(accounts)
+
+                renewed = []
+                for account, token_info in zip(accounts, executor.map(self._request, accounts)):
+                    if token_info:
+                        token, expires_at = token_info
+                        renewed.append((account['id'], token, expires_at or now + timedelta(hours=24)))
+                    else:
+                        self._retry_after[account['id']] = now + timedelta(seconds=self.retry_seconds)
+                        stats["failed"] += 1
+                self.storage.save_tokens_batch(renewed)
+                stats["refreshed"] += len(renewed)
+                if len(accounts) < self.batch_size:
+                    break
+
+        self.last_run = now
+        self.last_stats = stats
+        return stats
+
+    def _run(self):
+        """Boucle du thread de renouvellement"""
+        while not self._stop_event.is_set():
+            try:
+                self.run_once()
+            except Exception:
+                pass  # Nouvelle tentative au prochain passage
+            self._stop_event.wait(self.interval_seconds)
+
+    def start(self):
+        """Démarre le renouvellement périodique en arrière-plan"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="token-refresher", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Arrête le renouvellement périodique"""
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+
+def start_from_config(storage):
+    """Démarre le renouvellement des tokens sauf si config.py le désactive"""
+    if not storage or not TOKEN_REFRESH_ENABLED:
+        return None
+    refresher = TokenRefresher(storage)
+    refresher.start()
+    return refresher
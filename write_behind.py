@@ -0,0 +1,142 @@
+import queue
+import threading
+import time
+
+class _FlushRequest:
+    """Marqueur placé dans la file pour forcer un vidage synchrone"""
+
+    def __init__(self):
+        self.done = threading.Event()
+
+class WriteBehindBuffer:
+    """File d'écriture différée avec validation groupée
+
+    Les lignes soumises depuis n'importe quel thread sont regroupées par un thread
+    unique, puis transmises à `flush_callback(rows)` dès que `max_batch` lignes
+    sont en attente ou que `flush_interval` secondes se sont écoulées depuis la
+    première. Une file pleine bloque l'appelant (contre-pression). Un lot qui
+    échoue encore après `max_retries` essais est confié à `on_failure(rows,
+    erreur)` (p. ex. écrit dans un fichier de secours) plutôt que perdu.
+    """
+
+    def __init__(self, flush_callback, max_batch=100, flush_interval=0.5,
+                 max_queue=1000, max_retries=3, on_failure=None):
+        self.flush_callback = flush_callback
+        self.on_failure = on_failure
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.stats = {"submitted": 0, "flushed": 0, "batches": 0, "failed": 0, "spilled": 0}
+        self.last_error = None
+        self._closed = False
+        self._stats_lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+        self._thread.start()
+
+    def submit(self, row, timeout=None):
+        """Ajoute une ligne ; bloque tant que la file est pleine (queue.Full après `timeout`)"""
+        if self._closed:
+            raise Exception("Tampon d'écriture fermé")
+        self.queue.put(row, timeout=timeout)
+        with self._stats_lock:
+            self.stats["submitted"] += 1
+        return True
+
+    def pending(self):
+        """Nombre approximatif de lignes en attente"""
+        return self.queue.qsize()
+
+    def flush(self, timeout=None):
+        """Attend que toutes les lignes soumises jusqu'ici soient écrites"""
+        if not self._thread.is_alive():
+            return False
+        request = _FlushRequest()
+        self.queue.put(request)
+        return request.done.wait(timeout)
+
+    def close(self, timeout=30):
+        """Vide la file puis arrête le thread d'écriture"""
+        if self._closed:
+            return
+        self._closed = True
+        self.queue.put(None)
+        self._thread.join(timeout)
+
+    def _write(self, batch):
+        """Transmet un lot au callback avec quelques nouvelles tentatives"""
+        if not batch:
+            return
+        for attempt in range(self.max_retries):
+            try:
+                self.flush_callback(batch)
+                with self._stats_lock:
+                    self.stats["flushed"] += len(batch)
+                    self.stats["batches"] += 1
+                return
+            except Exception as e:
+                self.last_error = e
+                time.sleep(0.2 * (attempt + 1))
+        with self._stats_lock:
+            self.stats["failed"] += len(batch)
+        if self.on_failure:
+            try:
+                self.on_failure(batch, self.last_error)
+            except Exception as e:
+                self.last_error = e
+                return
+            with self._stats_lock:
+                self.stats["spilled"] += len(batch)
+
+    def _run(self):
+        """Boucle de regroupement : taille ou délai, selon ce qui arrive en premier"""
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            if isinstance(item, _FlushRequest):
+                item.done.set()
+                continue
+
+            batch = [item]
+            waiters = []
+            stop = False
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self.queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                if isinstance(item, _FlushRequest):
+                    waiters.append(item)
+                    break
+                batch.append(item)
+
+            self._write(batch)
+            for waiter in waiters:
+                waiter.done.set()
+            if stop:
+                break
+
+        # Arrêt : tout ce qui reste dans la file est écrit avant de rendre la main
+        remaining_rows = []
+        waiters = []
+        while True:
+            try:
+                item = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if isinstance(item, _FlushRequest):
+                waiters.append(item)
+            elif item is not None:
+                remaining_rows.append(item)
+        for start in range(0, len(remaining_rows), self.max_batch):
+            self._write(remaining_rows[start:start + self.max_batch])
+        for waiter in waiters:
+            waiter.done.set()